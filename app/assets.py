@@ -4,42 +4,234 @@ Dagster assets for ingesting Tuya device logs and processing them into a staging
 import os
 import glob
 import json
-from datetime import datetime, timezone
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import pandas as pd
 import duckdb # Keep direct import for type hints if needed, resource provides connection
 from dotenv import load_dotenv
-from tuya_connector import TuyaOpenAPI
 from dagster import (
     asset,
     AssetExecutionContext, # Added
     Definitions,
+    DailyPartitionsDefinition,
+    HourlyPartitionsDefinition,
     ScheduleDefinition,
+    build_schedule_from_partitioned_job,
     define_asset_job,
     AssetIn, # Added
+    AssetDep,
+    TimeWindowPartitionMapping,
+    AutomationCondition,
+    AutomationConditionSensorDefinition,
     Config, # Added
     EnvVar, # Added
+    sensor,
+    SensorEvaluationContext,
+    RunRequest,
+    SkipReason,
+    DefaultSensorStatus,
+    DagsterRunStatus,
+    RunsFilter,
 )
 from dagster_duckdb import DuckDBResource # Added
 
 # Import helper functions from the utils module
 from app.data_ingestion.ingestion_utils import (
     load_device_mapping,
-    get_time_range_ms,
-    get_device_supported_codes,
+    lookup_device_codes,
     fetch_status_logs,
+    plan_time_slices,
+    iter_sliced_status_log_pages,
+    is_invalid_codes_error,
+    SharedTokenBucketRateLimiter,
+)
+from app.data_ingestion.raw_log_writer import RawLogWriter, RAW_FILE_SUFFIXES, newest_raw_files
+from app.data_ingestion.raw_archive import (
+    ARCHIVE_FILE_SUFFIX,
+    list_device_days,
+    raw_files_in,
+    archive_device_day,
+    raw_logs_source_sql,
+)
+from app.instrumentation import (
+    Timer,
+    new_device_metrics,
+    summarize_device_metrics,
+    slowest_devices_table,
+    write_prometheus_textfile,
+)
+from app.data_processing.staging_manifest import (
+    load_manifest,
+    save_manifest,
+    find_unstaged_files,
+    mark_staged,
+    forget_files,
+)
+from app.data_processing.staging_batches import (
+    plan_batches,
+    batch_plan_id,
+    part_file_path,
+    load_checkpoint,
+    save_checkpoint,
+    clear_work_dir,
+    merge_parts,
+)
+from app.data_processing.duckdb_resource import TunedDuckDBResource
+from app.data_processing.state_intervals import (
+    interval_file_path,
+    compute_state_intervals,
+    write_device_intervals,
+)
+from app.data_processing.warehouse import ensure_device_logs_table, upsert_device_logs
+from app.data_processing.typed_values import CODE_SCHEMA_VIEW, code_schema_frame
+from app.data_processing.staging_schema import staged_columns_sql, code_schema_join_sql
+from app.data_processing.staging_query import update_staging_file_index
+from app.data_processing.microbatch import (
+    remove_microbatch_files,
+    microbatch_logs_frame,
+    write_microbatch_files,
+)
+from app.data_processing.rollups import compute_hourly_rollup, compute_daily_rollup
+from app.data_processing.compaction import (
+    COMPACTED_FILE_NAME,
+    DEFAULT_ROW_GROUP_SIZE,
+    list_partition_dirs,
+    compact_partition,
+    partition_lock,
+    read_partitions,
+    remove_range_from_compacted,
+)
+from app.data_ingestion.tuya_client import TuyaOpenAPIResource, DEFAULT_TOKEN_CACHE_PATH
+from app.data_ingestion.codes_cache import (
+    SupportedCodesCache,
+    DEFAULT_CODES_CACHE_TTL_HOURS,
+)
+from app.data_ingestion.watermark_state import (
+    load_watermarks,
+    save_watermarks,
+    advance_watermark,
+    get_fetch_start_ms,
+    filter_new_logs,
+    expected_records,
+    record_fetch_volume,
 )
 
 # --- Configuration ---
+# Partitioning Config
+# Both assets are partitioned by hour; the partition decides the fetch window
+# and the staging output file, so backfills run one independent run per hour
+PARTITIONS_START_DATE = os.getenv("TUYA_PARTITIONS_START_DATE", "2025-04-01-00:00")
+hourly_partitions = HourlyPartitionsDefinition(start_date=PARTITIONS_START_DATE)
+# Daily partitions (same start day) for assets aggregating whole days
+daily_partitions = DailyPartitionsDefinition(start_date=PARTITIONS_START_DATE[:10])
+# Maps a partition to the one before it, for assets carrying state from hour to hour
+PREVIOUS_PARTITION_MAPPING = TimeWindowPartitionMapping(start_offset=-1, end_offset=-1)
+# Tuya keeps report logs for a limited time; older partitions fetch nothing
+TUYA_LOG_RETENTION_DAYS = 7
+# Catch-up: how often tuya_catchup_sensor looks for hourly partitions missed
+# within the retention window (e.g. after an outage), and how many it requests at once
+CATCHUP_INTERVAL_SECONDS = int(os.getenv("TUYA_CATCHUP_INTERVAL_SECONDS", "900"))
+CATCHUP_MAX_RUNS_PER_TICK = int(os.getenv("TUYA_CATCHUP_MAX_RUNS_PER_TICK", "4"))
+CATCHUP_RUN_TAG = "tuya/catchup"
+
 # Ingestion Config
-TIME_WINDOW_HOURS = 1
 # Path relative to app dir for ingestion asset
 DEFAULT_INGESTION_MAPPING_PATH = "device_mapping.json"
 BASE_OUTPUT_DIR = "data/raw"  # Path relative to app dir for ingestion asset
+# Raw file format: "ndjson" (optionally gzip/zstd compressed) or legacy "json" arrays
+DEFAULT_RAW_FORMAT = "ndjson"
+DEFAULT_RAW_COMPRESSION = "gzip"
+# Concurrent fetch defaults (1 worker = serial fetch)
+DEFAULT_FETCH_WORKERS = 8
+# Tuya's default OpenAPI quota is on the order of 10 requests/second per project
+DEFAULT_API_QPS = 10.0
+# Token bucket shared by every run calling the Tuya API (hourly, catch-up,
+# backfills, micro-batches), so together they stay within the quota
+API_RATE_LIMIT_STATE_PATH = "data/state/tuya_api_rate_limit.json"  # Path relative to app dir
+# Adaptive time slicing: a device expected (from previous runs) to report more
+# logs than this in the window is fetched as parallel time slices of about this
+# many logs each, up to DEFAULT_MAX_SLICES_PER_DEVICE slices (1 disables slicing)
+DEFAULT_SLICE_TARGET_RECORDS = 2000
+DEFAULT_MAX_SLICES_PER_DEVICE = 8
+# Per-device log volume (records_per_hour) of complete hourly fetches
+WATERMARK_STATE_PATH = "data/state/watermarks.json"  # Path relative to app dir
+# On-disk cache of each device's supported codes
+CODES_CACHE_PATH = "data/state/supported_codes.json"  # Path relative to app dir
+# Persisted Tuya access token shared by runs of the "tuya" resource
+TOKEN_CACHE_PATH = DEFAULT_TOKEN_CACHE_PATH  # Path relative to app dir
 
 # Processing Config
 STAGING_DIR = "data/staging"  # Path relative to app dir for staging asset
 # Path relative to app dir for processing asset
 DEFAULT_PROCESSING_MAPPING_PATH = "device_mapping.json"
+# Raw files already loaded into staging (path, size, mtime)
+STAGING_MANIFEST_PATH = "data/state/staging_manifest.json"  # Path relative to app dir
+# Per-file event_time range and device/code sets of the staging files (see StagingQuery)
+STAGING_FILE_INDEX_PATH = "data/state/staging_file_index.json"  # Path relative to app dir
+# Staging reads a partition's raw files in batches of at most this many files
+# and bytes, writing each batch to a part file under STAGING_WORK_DIR first
+DEFAULT_STAGING_BATCH_FILES = 200
+DEFAULT_STAGING_BATCH_BYTES = 256 * 1024 * 1024
+STAGING_WORK_DIR = "data/tmp/staging_batches"  # Path relative to app dir
+# DuckDB limits for the "duckdb" and "warehouse" resources (empty/0 = DuckDB default)
+DUCKDB_MEMORY_LIMIT = os.getenv("TUYA_DUCKDB_MEMORY_LIMIT", "")
+DUCKDB_THREADS = int(os.getenv("TUYA_DUCKDB_THREADS", "0"))
+# Where DuckDB spills when a query exceeds the memory limit (relative to app dir)
+DUCKDB_TEMP_DIRECTORY = os.getenv("TUYA_DUCKDB_TEMP_DIRECTORY", "data/tmp/duckdb")
+
+# Compaction Config
+# event_date partitions at least this many days old are considered closed
+COMPACTION_MIN_AGE_DAYS = 2
+
+# Raw Archive Config
+# Raw device-days at least this many days old are rolled into Parquet archives
+RAW_ARCHIVE_MIN_AGE_DAYS = 2
+
+# Rollups Config
+ROLLUPS_DIR = "data/rollups"  # Path relative to app dir for rollup assets
+# How far back to look for the last known state of boolean codes (on-time),
+# in staged events and in earlier hourly rollups
+ROLLUP_STATE_LOOKBACK_HOURS = 24
+# Rollups of hours (re)staged late are refreshed by rollup_refresh_sensor,
+# along with the later hours carrying their state and the day's rollup.
+# Only partitions within Tuya's log retention can be restaged by catch-up runs.
+ROLLUP_REFRESH_CONDITION = (
+    AutomationCondition.in_latest_time_window(timedelta(days=TUYA_LOG_RETENTION_DAYS + 1))
+    & AutomationCondition.any_deps_updated().since_last_handled()
+    & ~AutomationCondition.any_deps_in_progress()
+    & ~AutomationCondition.in_progress()
+)
+
+# State Intervals Config
+INTERVALS_DIR = "data/intervals"  # Path relative to app dir for the intervals asset
+# Codes whose value_double is power in W, integrated to energy_kwh
+DEFAULT_INTERVAL_POWER_CODES = ("cur_power",)
+# How far back to look for a device's last known state at the start of a day,
+# in staged events and in earlier interval files
+INTERVAL_STATE_LOOKBACK_DAYS = 7
+
+# Warehouse Config
+# File-backed DuckDB database holding the deduplicated device_logs table
+WAREHOUSE_DATABASE_PATH = os.getenv(
+    "TUYA_WAREHOUSE_DATABASE", "data/warehouse/tuya.duckdb"
+)  # Path relative to app dir
+
+# Micro-batch Config
+# How often the (optional) micro-batch sensor requests a near-real-time run
+MICROBATCH_INTERVAL_SECONDS = int(os.getenv("TUYA_MICROBATCH_INTERVAL_SECONDS", "60"))
+# Per-device cursor of the micro-batch path, separate from the hourly watermarks
+MICROBATCH_CURSOR_PATH = "data/state/microbatch_cursor.json"  # Path relative to app dir
+# Micro-batches never look back further than this; older gaps are left to the hourly run
+DEFAULT_MICROBATCH_MAX_LOOKBACK_MINUTES = 60
+# Fetch windows end this many seconds before now, so in-flight reports are not cut off
+DEFAULT_MICROBATCH_END_LAG_SECONDS = 30
+
+# Instrumentation Config
+# If set, each run also writes its metrics as a Prometheus text file here
+# (e.g. node_exporter's --collector.textfile.directory); empty disables it
+PROMETHEUS_TEXTFILE_DIR = os.getenv("TUYA_PROMETHEUS_TEXTFILE_DIR", "")
 
 # --- Load Environment Variables ---
 # Ensure .env file is in the 'app' directory or accessible from where Dagster runs
@@ -47,32 +239,112 @@ load_dotenv()
 
 # --- Dagster Asset Definitions ---
 
-# Use EnvVar for configuration from environment variables
-class TuyaCredentials(Config):
-    """Configuration for Tuya API credentials and mapping file path."""
-    access_id: str = EnvVar("ACCESS_ID")
-    access_secret: str = EnvVar("ACCESS_SECRET")
-    api_endpoint: str = EnvVar("API_ENDPOINT")
+class TuyaIngestionConfig(Config):
+    """Configuration for the Tuya ingestion asset (credentials live on the "tuya" resource)."""
     # Store relative path from env or default, resolve later
     device_mapping_path: str = os.getenv(
         "DEVICE_MAPPING_PATH", DEFAULT_INGESTION_MAPPING_PATH
     )
+    # Number of devices fetched concurrently; 1 keeps the serial behaviour
+    max_workers: int = int(os.getenv("TUYA_FETCH_WORKERS", str(DEFAULT_FETCH_WORKERS)))
+    # Aggregate request rate shared by all workers and concurrent runs (token
+    # bucket in API_RATE_LIMIT_STATE_PATH)
+    api_qps: float = float(os.getenv("TUYA_API_QPS", str(DEFAULT_API_QPS)))
+    # How long a device's supported codes are reused before querying the API again
+    codes_cache_ttl_hours: float = float(
+        os.getenv("TUYA_CODES_CACHE_TTL_HOURS", str(DEFAULT_CODES_CACHE_TTL_HOURS))
+    )
+    # Force a fresh supported-codes lookup for every device on this run
+    refresh_codes_cache: bool = False
+    # Adaptive time slicing of high-volume devices (see DEFAULT_SLICE_TARGET_RECORDS)
+    slice_target_records: int = int(
+        os.getenv("TUYA_SLICE_TARGET_RECORDS", str(DEFAULT_SLICE_TARGET_RECORDS))
+    )
+    max_slices_per_device: int = int(
+        os.getenv("TUYA_MAX_SLICES_PER_DEVICE", str(DEFAULT_MAX_SLICES_PER_DEVICE))
+    )
+    # Raw output format ("ndjson" or "json") and compression ("none", "gzip", "zstd")
+    raw_format: str = os.getenv("TUYA_RAW_FORMAT", DEFAULT_RAW_FORMAT)
+    raw_compression: str = os.getenv("TUYA_RAW_COMPRESSION", DEFAULT_RAW_COMPRESSION)
+
+
+def partition_hour_stamp(partition_start: datetime) -> str:
+    """Returns the timestamp used in raw file names for an hourly partition."""
+    return partition_start.strftime('%Y%m%d%H%M%S')
+
+
+def resolve_staged_hour_file(staging_dir: str, partition_window) -> tuple:
+    """
+    Locates the staged data of an hourly partition. Returns (path, start_ms, end_ms):
+    the hour's own file with no time filter, or the day's compacted file with
+    the hour's bounds (the rows must then be filtered), or (None, None, None).
+    """
+    date_folder_str = partition_window.start.strftime('%Y-%m-%d')
+    partition_dir = os.path.join(staging_dir, f"event_date={date_folder_str}")
+    hour_file_path = os.path.join(
+        partition_dir, f"data_{partition_hour_stamp(partition_window.start)}.parquet"
+    )
+    if os.path.exists(hour_file_path):
+        return hour_file_path, None, None
+    # The day may have been compacted: read this hour from the compacted file
+    compacted_file_path = os.path.join(partition_dir, COMPACTED_FILE_NAME)
+    if os.path.exists(compacted_file_path):
+        return (
+            compacted_file_path,
+            int(partition_window.start.timestamp() * 1000),
+            int(partition_window.end.timestamp() * 1000),
+        )
+    return None, None, None
+
 
+def hour_is_staged(staging_dir: str, hour_start: datetime) -> bool:
+    """Whether the hourly pipeline already staged an hour (its own or the compacted file)."""
+    partition_dir = os.path.join(staging_dir, f"event_date={hour_start.strftime('%Y-%m-%d')}")
+    return os.path.exists(
+        os.path.join(partition_dir, f"data_{partition_hour_stamp(hour_start)}.parquet")
+    ) or os.path.exists(os.path.join(partition_dir, COMPACTED_FILE_NAME))
 
-@asset(group_name="data_ingestion")
-def raw_tuya_logs(context: AssetExecutionContext, config: TuyaCredentials) -> str:
+
+def staged_partition_dirs_between(staging_dir: str, start: datetime, end: datetime) -> list:
+    """The event_date partition directories overlapping [start, end), existing or not."""
+    partition_dirs = []
+    day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    while day < end:
+        partition_dirs.append(
+            os.path.join(staging_dir, f"event_date={day.strftime('%Y-%m-%d')}")
+        )
+        day += timedelta(days=1)
+    return partition_dirs
+
+
+def staged_files_between(staging_dir: str, start: datetime, end: datetime) -> list:
+    """
+    The staged Parquet files of the event_date partitions overlapping [start, end).
+    Call under read_partitions on those partitions, so none is swapped out.
+    """
+    files = []
+    for partition_dir in staged_partition_dirs_between(staging_dir, start, end):
+        files.extend(glob.glob(os.path.join(partition_dir, "*.parquet")))
+    return sorted(files)
+
+
+@asset(
+    group_name="data_ingestion",
+    required_resource_keys={"tuya"}, # Shared, pre-authenticated Tuya client
+    partitions_def=hourly_partitions,
+)
+def raw_tuya_logs(context: AssetExecutionContext, config: TuyaIngestionConfig) -> str:
     """
     Fetches device status logs from the Tuya Cloud API for configured devices
-    and saves them as JSON files in a structured directory:
-    data/raw/<device_id>/<YYYY-MM-DD>/<device_id>_<timestamp>_logs.json
+    over the partition's hour and saves them in a structured directory:
+    data/raw/<device_id>/<YYYY-MM-DD>/<device_id>_<partition_start>_logs.<ext>
+    where <ext> depends on the configured raw format (e.g. ndjson.gz).
+    Re-materializing a partition replaces that hour's files, whatever their format.
     Returns the absolute base path where logs are saved.
     """
-    context.log.info("Starting Tuya Log Ingestion Asset...")
+    context.log.info(f"Starting Tuya Log Ingestion Asset for partition {context.partition_key}...")
+    run_started = time.perf_counter()
 
-    # Config object handles validation via EnvVar
-    access_id = config.access_id
-    access_secret = config.access_secret
-    api_endpoint = config.api_endpoint
     # Resolve the mapping path relative to this script's directory
     script_dir = os.path.dirname(__file__)
     relative_mapping_path = config.device_mapping_path
@@ -96,13 +368,27 @@ def raw_tuya_logs(context: AssetExecutionContext, config: TuyaCredentials) -> st
 
     context.log.info(f"Found {len(device_ids)} devices in mapping file.")
 
-    # Calculate time range
-    start_time_ms, end_time_ms = get_time_range_ms(TIME_WINDOW_HOURS) # Use imported helper
+    # Calculate time range from the partition: [start, end) in milliseconds
+    # (Tuya's end_time is inclusive, so the last millisecond is excluded)
+    partition_window = context.partition_time_window
+    start_time_ms = int(partition_window.start.timestamp() * 1000)
+    end_time_ms = int(partition_window.end.timestamp() * 1000) - 1
+    context.log.info(
+        f"Querying logs from {partition_window.start} to {partition_window.end} "
+        f"({start_time_ms}ms to {end_time_ms}ms)"
+    )
+    if (datetime.now(timezone.utc) - partition_window.end).days >= TUYA_LOG_RETENTION_DAYS:
+        context.log.warning(
+            f"Partition is older than Tuya's {TUYA_LOG_RETENTION_DAYS}-day log retention; "
+            "the API may return no logs."
+        )
+    # Per-device log volume of past complete fetches, for adaptive time slicing
+    watermark_state_path = os.path.abspath(os.path.join(script_dir, WATERMARK_STATE_PATH))
+    watermarks = load_watermarks(watermark_state_path)
 
-    # Initialize Tuya OpenAPI connector
+    # Get the Tuya OpenAPI client (token and connections are reused across runs)
     try:
-        openapi = TuyaOpenAPI(api_endpoint, access_id, access_secret) # Use config values
-        openapi.connect()
+        openapi = context.resources.tuya.get_client()
         context.log.info("Successfully connected to Tuya API.")
     except ConnectionError as e:
         context.log.error(f"Error connecting to Tuya API: {e}")
@@ -113,47 +399,25 @@ def raw_tuya_logs(context: AssetExecutionContext, config: TuyaCredentials) -> st
         raise RuntimeError(f"An unexpected error occurred connecting to Tuya API: {e}") from e
 
 
-    # Fetch logs for each device
-    all_device_logs = {}
-    for device_id in device_ids:
-        device_name = device_mapping.get(device_id, "Unknown Device")
-        context.log.info("-" * 30)
-        context.log.info(f"Processing: {device_name} ({device_id})")
-
-        supported_codes = get_device_supported_codes(openapi, device_id) # Use imported helper
-
-        if supported_codes is None:
-            # Wrapped long line
-            context.log.warning(
-                f"  - Skipping log fetch for {device_id} due to error retrieving codes."
-            )
-            all_device_logs[device_id] = []
-            continue
-        if not supported_codes:
-            # Wrapped long line
-            context.log.warning(
-                f"  - No supported codes found for {device_id}. Skipping log fetch."
-            )
-            all_device_logs[device_id] = []
-            continue
-
-        codes_str = ",".join(supported_codes) # Renamed variable
+    # Rate limiter shared with every other run keeps all workers under the API QPS quota
+    rate_limiter = SharedTokenBucketRateLimiter(
+        os.path.abspath(os.path.join(script_dir, API_RATE_LIMIT_STATE_PATH)), config.api_qps
+    )
 
-        logs = fetch_status_logs( # Use imported helper
-            openapi,
-            device_id,
-            codes_str, # Use renamed variable
-            start_time_ms,
-            end_time_ms
-        )
-        all_device_logs[device_id] = logs
+    # Supported codes rarely change, so they are cached on disk between runs
+    codes_cache = SupportedCodesCache(
+        os.path.abspath(os.path.join(script_dir, CODES_CACHE_PATH)),
+        config.codes_cache_ttl_hours * 3600,
+    )
+    if config.refresh_codes_cache:
+        context.log.info("Invalidating supported codes cache for all devices.")
+        codes_cache.invalidate()
 
-    context.log.info("-" * 30)
-    context.log.info("Log ingestion fetch finished.")
+    def lookup_supported_codes(device_id: str):
+        """Returns (codes, from_cache), querying the API only on a cache miss."""
+        return lookup_device_codes(openapi, device_id, codes_cache, rate_limiter)
 
-    # --- Save logs to files ---
-    # Ensure base directory exists, relative to this script's directory
-    script_dir = os.path.dirname(__file__)
+    # --- Output location and lineage fields ---
     absolute_base_output_dir = os.path.abspath(os.path.join(script_dir, BASE_OUTPUT_DIR))
     os.makedirs(absolute_base_output_dir, exist_ok=True)
     context.log.info(f"Base log directory: {absolute_base_output_dir}")
@@ -161,56 +425,189 @@ def raw_tuya_logs(context: AssetExecutionContext, config: TuyaCredentials) -> st
     ingestion_time_utc = datetime.now(timezone.utc).isoformat()
     ingested_by_identifier = "dagster_tuya_log_ingestion_asset" # Renamed variable
     context.log.info(f"Ingestion timestamp (UTC): {ingestion_time_utc}")
+    lineage_fields = {
+        "ingestion_timestamp_utc": ingestion_time_utc,
+        "ingested_by": ingested_by_identifier,
+    }
+    # Workers update and persist the shared volume state one at a time
+    watermark_lock = threading.Lock()
 
-    saved_files_count = 0
-    for device_id, logs in all_device_logs.items():
-        if logs:
-            try:
-                processed_logs = []
-                for log in logs:
-                    log_copy = log.copy()
-                    log_copy["device_id"] = device_id
-                    log_copy["ingestion_timestamp_utc"] = ingestion_time_utc
-                    log_copy["ingested_by"] = ingested_by_identifier # Use renamed variable
-                    processed_logs.append(log_copy)
-
-                # Determine output path based on first log entry's date
-                first_log_time_ms = logs[0].get('event_time', 0)
-                first_log_time_sec = first_log_time_ms / 1000
-                dt_object = datetime.fromtimestamp(first_log_time_sec, timezone.utc)
-                date_folder_str = dt_object.strftime('%Y-%m-%d')
-                timestamp_str = dt_object.strftime('%Y%m%d%H%M%S')
-
-                # Path: data/raw/<device_id>/<YYYY-MM-DD>/
-                date_specific_output_dir = os.path.join(
-                    absolute_base_output_dir, device_id, date_folder_str
-                )
-                os.makedirs(date_specific_output_dir, exist_ok=True)
+    def stream_device_logs(device_id, codes_str, writer, metrics):
+        """
+        Streams each page of logs straight into the writer, adding the fetch's
+        counters and timings to `metrics`. Devices whose past volume is high are
+        fetched as parallel time slices, written slice by slice (see
+        iter_sliced_status_log_pages); logs are not sorted by event_time.
+        Returns fetch stats.
+        """
+        fetch_stats = {}
+        time_slices = plan_time_slices(
+            start_time_ms,
+            end_time_ms,
+            expected_records(watermarks, device_id, end_time_ms - start_time_ms + 1),
+            config.slice_target_records,
+            config.max_slices_per_device,
+        )
+        metrics["slices"] = max(metrics["slices"], len(time_slices))
+        for page_logs in iter_sliced_status_log_pages( # Use imported helper
+            openapi,
+            device_id,
+            codes_str,
+            time_slices,
+            rate_limiter,
+            fetch_stats
+        ):
+            with Timer(metrics, "write_seconds"):
+                writer.write(page_logs)
+        for field in ("pages", "requests", "api_seconds", "rate_limit_wait_seconds"):
+            metrics[field] += fetch_stats.get(field, 0)
+        return fetch_stats
 
-                file_name = f"{device_id}_{timestamp_str}_logs.json"
-                output_file_path = os.path.join(date_specific_output_dir, file_name)
+    def fetch_device_logs(device_id: str, metrics: dict) -> int:
+        """
+        Fetches the logs of a single device (codes lookup + paginated logs) over
+        the partition window and streams them to its raw file. The volume
+        history is updated only if the whole window was fetched and written.
+        Returns the number of files saved (0 or 1).
+        """
+        device_name = device_mapping.get(device_id, "Unknown Device")
+        context.log.info(f"Processing: {device_name} ({device_id})")
 
-                with open(output_file_path, 'w', encoding='utf-8') as f:
-                    # Wrapped long line
-                    json.dump(
-                        processed_logs, f, indent=4, ensure_ascii=False
-                    )
-                # Create message string first to avoid long line
-                save_message = (
-                    f"  - Saved {len(processed_logs)} logs for {device_id} "
-                    f"to {output_file_path}"
+        supported_codes, from_cache = lookup_supported_codes(device_id)
+
+        if supported_codes is None:
+            # Wrapped long line
+            context.log.warning(
+                f"  - Skipping log fetch for {device_id} due to error retrieving codes."
+            )
+            return 0
+        if supported_codes:
+            writer = RawLogWriter(
+                absolute_base_output_dir,
+                device_id,
+                lineage_fields,
+                config.raw_format,
+                config.raw_compression,
+                partition_window.start,
+            )
+            try:
+                fetch_stats = stream_device_logs(
+                    device_id, ",".join(supported_codes), writer, metrics
                 )
-                context.log.info(save_message)
-                saved_files_count += 1
+                if (
+                    is_invalid_codes_error(fetch_stats.get("api_error"))
+                    and from_cache
+                    and writer.records_written == 0
+                ):
+                    # A stale cached code list (an unknown code) makes report-logs
+                    # reject the request: refresh the codes and retry once. Other
+                    # errors (rate limit, token) must not cost a codes lookup
+                    context.log.warning(
+                        f"  - Log fetch for {device_id} failed with cached codes; "
+                        "refreshing codes."
+                    )
+                    codes_cache.invalidate(device_id)
+                    supported_codes, _ = lookup_supported_codes(device_id)
+                    if supported_codes is None:
+                        return 0
+                    fetch_stats = {"complete": True}
+                    if supported_codes:
+                        fetch_stats = stream_device_logs(
+                            device_id, ",".join(supported_codes), writer, metrics
+                        )
+                output_file_path = writer.close()
             except (IOError, TypeError, ValueError) as e: # Catch more specific errors
+                writer.abort()
                 context.log.error(f"  - Error processing or saving logs for {device_id}: {e}")
+                return 0 # A failed window is left to a re-run of the partition
             except Exception as e: # pylint: disable=broad-except
+                writer.abort()
                 # Wrapped long line
                 context.log.error(
                     f"  - Unexpected error processing/saving logs for {device_id}: {e}"
                 )
+                return 0
+
+            metrics["records"] = writer.records_written
+            if output_file_path:
+                metrics["bytes"] = os.path.getsize(output_file_path)
+                context.log.info(
+                    f"  - Saved {writer.records_written} logs for {device_id} "
+                    f"to {output_file_path}"
+                )
+            else:
+                context.log.info(f"  - No logs to save for {device_id}.")
+            if not fetch_stats.get("complete", False):
+                context.log.warning(
+                    f"  - Log fetch for {device_id} stopped early; volume history not updated."
+                )
+                return 1 if output_file_path else 0
         else:
-            context.log.info(f"  - No logs to save for {device_id}.")
+            # Wrapped long line
+            context.log.warning(
+                f"  - No supported codes found for {device_id}. Skipping log fetch."
+            )
+            output_file_path = None
+
+        # Record the volume only once the device's file is safely written
+        with watermark_lock:
+            record_fetch_volume(
+                watermarks, device_id, metrics["records"], end_time_ms - start_time_ms + 1
+            )
+            save_watermarks(watermark_state_path, watermarks)
+        return 1 if output_file_path else 0
+
+    # Per-device timings and counters, reported as metadata at the end of the run
+    device_metrics = {}
+
+    def fetch_device(device_id: str) -> int:
+        """Runs fetch_device_logs for one device, timing it. Returns files saved."""
+        metrics = device_metrics[device_id] = new_device_metrics()
+        with Timer(metrics, "seconds"):
+            return fetch_device_logs(device_id, metrics)
+
+    # Fetch logs for each device, concurrently when more than one worker is configured
+    max_workers = max(1, min(config.max_workers, len(device_ids)))
+    context.log.info(
+        f"Fetching logs with {max_workers} worker(s) at up to {config.api_qps} requests/s."
+    )
+    if max_workers == 1:
+        saved_files = [fetch_device(device_id) for device_id in device_ids]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # executor.map preserves input order, so results match the serial path
+            saved_files = list(executor.map(fetch_device, device_ids))
+    saved_files_count = sum(saved_files)
+
+    codes_cache.save()
+    context.log.info(
+        f"Supported codes cache: {codes_cache.hits} hits, {codes_cache.misses} misses."
+    )
+    run_seconds = time.perf_counter() - run_started
+    run_metrics = {
+        "duration_seconds": round(run_seconds, 3),
+        # Share of the partition's hour used by this run (approaching 1 means overlap)
+        "hourly_budget_used": round(
+            run_seconds / (partition_window.end - partition_window.start).total_seconds(), 4
+        ),
+        "devices": len(device_ids),
+        "files_saved": saved_files_count,
+        "codes_cache_hits": codes_cache.hits,
+        "codes_cache_misses": codes_cache.misses,
+        **summarize_device_metrics(device_metrics),
+    }
+    context.add_output_metadata({
+        **run_metrics,
+        "slowest_devices": slowest_devices_table(device_metrics),
+    })
+    if PROMETHEUS_TEXTFILE_DIR:
+        write_prometheus_textfile(
+            PROMETHEUS_TEXTFILE_DIR, "raw_tuya_logs", context.partition_key,
+            run_metrics, device_metrics,
+        )
+
+    context.log.info("-" * 30)
+    context.log.info("Log ingestion fetch finished.")
 
     context.log.info(f"Finished saving logs. Total files saved: {saved_files_count}")
     if saved_files_count == 0:
@@ -221,21 +618,48 @@ def raw_tuya_logs(context: AssetExecutionContext, config: TuyaCredentials) -> st
     return absolute_base_output_dir
 
 
+class StagingConfig(Config):
+    """Configuration for the raw-to-staging processing asset."""
+    # Restage the partition even if none of its raw files changed
+    force_restage: bool = False
+    # Bounds of each batch of raw files read in one query (see DEFAULT_STAGING_BATCH_FILES)
+    max_batch_files: int = int(
+        os.getenv("TUYA_STAGING_BATCH_FILES", str(DEFAULT_STAGING_BATCH_FILES))
+    )
+    max_batch_bytes: int = int(
+        os.getenv("TUYA_STAGING_BATCH_BYTES", str(DEFAULT_STAGING_BATCH_BYTES))
+    )
+
+
 @asset(
     ins={"raw_tuya_logs_path": AssetIn(key="raw_tuya_logs")}, # Declare dependency
     group_name="data_ingestion",
     required_resource_keys={"duckdb"}, # Declare resource requirement
+    partitions_def=hourly_partitions,
 )
-def staging_tuya_logs(context: AssetExecutionContext, raw_tuya_logs_path: str) -> str:
+def staging_tuya_logs(
+    context: AssetExecutionContext, config: StagingConfig, raw_tuya_logs_path: str
+) -> str:
     """
-    Processes raw JSON logs from the raw_tuya_logs asset output directory
-    into a partitioned Parquet dataset using DuckDB.
+    Processes the partition's raw logs from the raw_tuya_logs asset output
+    directory into a partitioned Parquet dataset using DuckDB.
 
-    Reads JSON files, enriches data (timestamp, filename, device_name),
-    and saves partitioned Parquet to data/staging/, partitioned by event_date.
+    Reads the raw files of the partition's hour, enriches data (timestamp,
+    filename, device_name), adds typed value columns (value_bool, value_int,
+    value_double, value_str) from the device code schemas cached at ingestion,
+    and writes them to one Parquet file per hour:
+    data/staging/event_date=<YYYY-MM-DD>/data_<partition_start>.parquet
+    Raw files are read in bounded batches (by file count and bytes) written to
+    checkpointed part files first, so a failed run resumes from the last
+    completed batch. Re-materializing a partition replaces only that hour's
+    file. Partitions whose raw files are unchanged since they were staged
+    (tracked in a staging manifest) are skipped unless `force_restage` is set.
     Returns the absolute path to the staging directory.
     """
-    context.log.info("Starting Raw-to-Staging Processing Asset...")
+    context.log.info(
+        f"Starting Raw-to-Staging Processing Asset for partition {context.partition_key}..."
+    )
+    run_started = time.perf_counter()
     context.log.info(f"Input raw logs directory: {raw_tuya_logs_path}")
 
     # Define paths relative to this script's directory
@@ -272,17 +696,68 @@ def staging_tuya_logs(context: AssetExecutionContext, raw_tuya_logs_path: str) -
     except Exception as e: # pylint: disable=broad-except # Catch other potential errors during loading
         context.log.error(f"An unexpected error occurred loading device mapping: {e}")
 
-    # Find all JSON files in the input directory structure
-    raw_data_pattern = os.path.join(raw_tuya_logs_path, '**', '*.json')
-    json_files = glob.glob(raw_data_pattern, recursive=True)
+    # Code types and scales cached by the ingestion asset, for the typed value columns
+    codes_cache_path_abs = os.path.abspath(os.path.join(script_dir, CODES_CACHE_PATH))
+    code_schema_df = code_schema_frame(
+        SupportedCodesCache(codes_cache_path_abs, ttl_seconds=0).get_schemas()
+    )
+    context.log.info(f"Loaded {len(code_schema_df)} device code schema entries.")
 
-    if not json_files:
-        context.log.warning(f"No JSON files found in {raw_tuya_logs_path}. Skipping processing.")
+    # Find the partition's raw files (legacy JSON arrays and NDJSON, compressed or not)
+    partition_window = context.partition_time_window
+    date_folder_str = partition_window.start.strftime('%Y-%m-%d')
+    hour_stamp = partition_hour_stamp(partition_window.start)
+    raw_data_pattern = os.path.join(
+        raw_tuya_logs_path, '*', date_folder_str, f'*_{hour_stamp}_logs*'
+    )
+    matched_raw_files = [
+        f for f in glob.glob(raw_data_pattern) if f.endswith(RAW_FILE_SUFFIXES)
+    ]
+    # One raw file per device and hour, even if an older format's file lingers
+    json_files = newest_raw_files(matched_raw_files)
+    for superseded_file in sorted(set(matched_raw_files) - set(json_files)):
+        context.log.warning(f"Skipping superseded raw file {superseded_file}.")
+    # Device-days already archived are read back from their archives
+    archive_files = glob.glob(
+        os.path.join(raw_tuya_logs_path, '*', date_folder_str, f'*{ARCHIVE_FILE_SUFFIX}')
+    )
+    source_files = json_files + archive_files
+
+    if not source_files:
+        context.log.warning(
+            f"No raw files found for partition {context.partition_key} in "
+            f"{raw_tuya_logs_path}. Skipping processing."
+        )
+        # The hour is final: its provisional micro-batch files must not linger
+        hour_partition_dir = os.path.join(staging_dir_abs, f"event_date={date_folder_str}")
+        if os.path.isdir(hour_partition_dir):
+            with partition_lock(hour_partition_dir):
+                remove_microbatch_files(hour_partition_dir, hour_stamp)
         # Still return the target staging dir path, even if empty
         return staging_dir_abs
 
-    context.log.info(f"Found {len(json_files)} JSON files to process.")
-    files_list_str = ', '.join([f"'{f}'" for f in json_files])
+    partition_dir = os.path.join(staging_dir_abs, f"event_date={date_folder_str}")
+    output_file_path = os.path.join(partition_dir, f"data_{hour_stamp}.parquet")
+
+    # Skip the partition if all of its raw files were already staged unchanged
+    manifest_path_abs = os.path.abspath(os.path.join(script_dir, STAGING_MANIFEST_PATH))
+    manifest = load_manifest(manifest_path_abs)
+    unstaged_files = find_unstaged_files(manifest, raw_tuya_logs_path, source_files)
+    context.log.info(
+        f"Found {len(json_files)} raw files and {len(archive_files)} archives, "
+        f"{len(unstaged_files)} new or changed since last run."
+    )
+    if not unstaged_files and os.path.exists(output_file_path) and not config.force_restage:
+        context.log.info("Partition raw files are unchanged; nothing to restage.")
+        # Micro-batches written after the hour was staged are covered by its file
+        with partition_lock(partition_dir):
+            remove_microbatch_files(partition_dir, hour_stamp)
+        return staging_dir_abs
+
+    os.makedirs(partition_dir, exist_ok=True)
+    tmp_output_file_path = f"{output_file_path}.tmp"
+    start_time_ms = int(partition_window.start.timestamp() * 1000)
+    end_time_ms = int(partition_window.end.timestamp() * 1000)
 
     # Get DuckDB connection from the resource
     duckdb_resource: DuckDBResource = context.resources.duckdb
@@ -308,43 +783,84 @@ def staging_tuya_logs(context: AssetExecutionContext, raw_tuya_logs_path: str) -
                 select_device_name = "NULL AS device_name"
         else:
             context.log.warning("Skipping device name enrichment due to mapping load error.")
+        conn.register(CODE_SCHEMA_VIEW, code_schema_df)
 
-        copy_query = f"""
-        COPY (
-            WITH raw_logs AS (
-                SELECT *
-                FROM read_json_auto(
-                    [{files_list_str}],
-                    format='auto',
-                    filename=true
-                )
+        # Read the files in bounded batches, each into its own checkpointed part
+        batches = plan_batches(source_files, config.max_batch_files, config.max_batch_bytes)
+        work_dir = os.path.join(
+            os.path.abspath(os.path.join(script_dir, STAGING_WORK_DIR)), hour_stamp
+        )
+        plan_id = batch_plan_id(batches, start_time_ms, end_time_ms)
+        completed_parts = load_checkpoint(work_dir, plan_id)
+        if completed_parts:
+            context.log.info(
+                f"Resuming from checkpoint: {len(completed_parts)} of {len(batches)} batches done."
             )
-            SELECT
-                rl.code,
-                rl.value,
-                rl.device_id,
-                rl.ingestion_timestamp_utc,
-                rl.ingested_by,
-                rl.filename,
-                to_timestamp(rl.event_time / 1000)::TIMESTAMP AS event_time,
-                {select_device_name},
-                strftime(to_timestamp(rl.event_time / 1000), '%Y-%m-%d') AS event_date
-            FROM raw_logs rl
-            {join_clause}
-        ) TO '{staging_dir_abs}' (
-            FORMAT PARQUET,
-            PARTITION_BY (event_date),
-            OVERWRITE_OR_IGNORE 1
-        );
-        """
+        batches_resumed = len(completed_parts)
+        os.makedirs(work_dir, exist_ok=True)
 
         try:
-            context.log.info(f"Executing query:\n{copy_query}")
-            conn.execute(copy_query)
+            with Timer() as copy_timer:
+                for batch_index, batch_files in enumerate(batches):
+                    if batch_index in completed_parts:
+                        continue
+                    batch_json_files = [f for f in batch_files if not f.endswith(ARCHIVE_FILE_SUFFIX)]
+                    batch_archive_files = [f for f in batch_files if f.endswith(ARCHIVE_FILE_SUFFIX)]
+                    part_path = part_file_path(work_dir, batch_index)
+                    copy_query = f"""
+                    COPY (
+                        WITH raw_logs AS (
+                            {raw_logs_source_sql(batch_json_files, batch_archive_files, json_files)}
+                        )
+                        SELECT {staged_columns_sql(select_device_name)}
+                        FROM raw_logs rl
+                        {join_clause}
+                        {code_schema_join_sql()}
+                        WHERE rl.event_time >= {start_time_ms} AND rl.event_time < {end_time_ms}
+                    ) TO '{part_path}.tmp' (FORMAT PARQUET);
+                    """
+                    context.log.debug(f"Executing query:\n{copy_query}")
+                    conn.execute(copy_query)
+                    os.replace(f"{part_path}.tmp", part_path)
+                    completed_parts[batch_index] = conn.execute(
+                        f"SELECT count(*) FROM read_parquet('{part_path}')"
+                    ).fetchone()[0]
+                    save_checkpoint(work_dir, plan_id, completed_parts)
+                    context.log.info(
+                        f"Staged batch {batch_index + 1}/{len(batches)} "
+                        f"({len(batch_files)} files, {completed_parts[batch_index]} rows)."
+                    )
+                merge_parts(
+                    conn,
+                    [part_file_path(work_dir, batch_index) for batch_index in range(len(batches))],
+                    tmp_output_file_path,
+                )
+            rows_staged = conn.execute(
+                f"SELECT count(*) FROM read_parquet('{tmp_output_file_path}')"
+            ).fetchone()[0]
+            # Serialize with compaction and micro-batches writing this partition
+            with partition_lock(partition_dir):
+                # If the day was already compacted, drop this hour from the compacted
+                # file first so the re-staged hour is not duplicated
+                with Timer() as compacted_timer:
+                    remove_range_from_compacted(conn, partition_dir, start_time_ms, end_time_ms)
+                # Swap the hour's file into place so readers never see a partial file
+                os.replace(tmp_output_file_path, output_file_path)
+                # The hour's file supersedes its provisional micro-batch files
+                microbatch_files_removed = remove_microbatch_files(partition_dir, hour_stamp)
             # Wrapped long line
             context.log.info(
-                "Successfully processed raw data and saved partitioned Parquet files to "
-                f"{staging_dir_abs}"
+                "Successfully processed raw data and saved partitioned Parquet file to "
+                f"{output_file_path}"
+            )
+            # Record the files only after their rows were written
+            mark_staged(manifest, raw_tuya_logs_path, source_files)
+            save_manifest(manifest_path_abs, manifest)
+            clear_work_dir(work_dir)
+            # Keep the query file index current so the first query pays no scan
+            update_staging_file_index(
+                conn, staging_dir_abs,
+                os.path.abspath(os.path.join(script_dir, STAGING_FILE_INDEX_PATH)),
             )
         except duckdb.Error as e:
             context.log.error(f"A DuckDB error occurred during processing: {e}")
@@ -353,6 +869,639 @@ def staging_tuya_logs(context: AssetExecutionContext, raw_tuya_logs_path: str) -
             context.log.error(f"An unexpected error occurred during processing: {e}")
             raise # Re-raise the error
 
+    run_metrics = {
+        "duration_seconds": round(time.perf_counter() - run_started, 3),
+        "raw_files": len(json_files),
+        "archive_files": len(archive_files),
+        "raw_files_changed": len(unstaged_files),
+        "raw_bytes": sum(os.path.getsize(f) for f in source_files),
+        "batches": len(batches),
+        "batches_resumed": batches_resumed,
+        "copy_seconds": round(copy_timer.seconds, 3),
+        "compacted_rewrite_seconds": round(compacted_timer.seconds, 3),
+        "rows_staged": rows_staged,
+        "bytes_written": os.path.getsize(output_file_path),
+        "microbatch_files_removed": microbatch_files_removed,
+    }
+    context.add_output_metadata(run_metrics)
+    if PROMETHEUS_TEXTFILE_DIR:
+        write_prometheus_textfile(
+            PROMETHEUS_TEXTFILE_DIR, "staging_tuya_logs", context.partition_key, run_metrics
+        )
+    return staging_dir_abs
+
+
+@asset(
+    ins={"staging_tuya_logs_path": AssetIn(key="staging_tuya_logs")}, # Declare dependency
+    group_name="warehouse",
+    required_resource_keys={"warehouse"},
+    partitions_def=hourly_partitions,
+)
+def warehouse_device_logs(context: AssetExecutionContext, staging_tuya_logs_path: str) -> str:
+    """
+    Loads the partition's staged Parquet file into the persistent DuckDB
+    warehouse table `device_logs`, keyed on (device_id, code, event_time).
+    The load is an upsert, so retries, re-materializations and overlapping
+    fetch windows never produce duplicate rows.
+    Returns the absolute path to the warehouse database.
+    """
+    partition_window = context.partition_time_window
+    warehouse_resource: DuckDBResource = context.resources.warehouse
+    database_path = os.path.abspath(warehouse_resource.database)
+    # Shared lock: compaction or a restage must not swap the file while it is read
+    with read_partitions(staged_partition_dirs_between(
+        staging_tuya_logs_path, partition_window.start, partition_window.end
+    )):
+        staged_file_path, start_time_ms, end_time_ms = resolve_staged_hour_file(
+            staging_tuya_logs_path, partition_window
+        )
+        if staged_file_path is None:
+            context.log.warning(
+                f"No staged data for partition {context.partition_key}. Skipping warehouse load."
+            )
+            return database_path
+
+        os.makedirs(os.path.dirname(database_path), exist_ok=True)
+        with warehouse_resource.get_connection() as conn:
+            try:
+                ensure_device_logs_table(conn)
+                batch_rows = upsert_device_logs(
+                    conn, staged_file_path, start_time_ms, end_time_ms
+                )
+                total_rows = conn.execute("SELECT count(*) FROM device_logs").fetchone()[0]
+            except duckdb.Error as e:
+                context.log.error(f"A DuckDB error occurred loading the warehouse: {e}")
+                raise # Re-raise the error to fail the asset run
+
+    context.log.info(
+        f"Upserted {batch_rows} rows from {staged_file_path} into device_logs "
+        f"({total_rows} rows total)."
+    )
+    context.add_output_metadata({
+        "rows_upserted": batch_rows,
+        "device_logs_total_rows": total_rows,
+        "database_path": database_path,
+    })
+    return database_path
+
+
+def hourly_rollup_path(rollups_dir: str, bucket_start: datetime) -> str:
+    """Returns the Parquet file holding the hourly rollup of a bucket."""
+    return os.path.join(
+        rollups_dir,
+        "hourly",
+        f"event_date={bucket_start.strftime('%Y-%m-%d')}",
+        f"rollup_{partition_hour_stamp(bucket_start)}.parquet",
+    )
+
+
+@asset(
+    ins={"staging_tuya_logs_path": AssetIn(key="staging_tuya_logs")}, # Declare dependency
+    # Each hour follows the previous one, so asset backfills run the hours in order
+    deps=[AssetDep("hourly_device_rollups", partition_mapping=PREVIOUS_PARTITION_MAPPING)],
+    group_name="rollups",
+    required_resource_keys={"duckdb"},
+    partitions_def=hourly_partitions,
+    # Hours not rolled up yet are left to the hourly and catch-up runs
+    automation_condition=ROLLUP_REFRESH_CONDITION & ~AutomationCondition.missing(),
+)
+def hourly_device_rollups(context: AssetExecutionContext, staging_tuya_logs_path: str) -> str:
+    """
+    Aggregates the partition's hour of staged logs per device and code (counts,
+    min, max, mean, last value and on-time of boolean codes) into
+    data/rollups/hourly/event_date=<YYYY-MM-DD>/rollup_<partition_start>.parquet
+    Only the partition's bucket is recomputed. The on-time state at the start of
+    the hour is the last boolean event staged in the ROLLUP_STATE_LOOKBACK_HOURS
+    before it, falling back to the nearest earlier hourly rollup for states
+    unchanged for longer. The asset depends on its previous partition, so asset
+    backfills materialize the hours (and stage their data) in order, and
+    rollup_refresh_sensor recomputes the later hours when an hour is restaged.
+    Returns the absolute path to the rollups directory.
+    """
+    script_dir = os.path.dirname(__file__)
+    rollups_dir_abs = os.path.abspath(os.path.join(script_dir, ROLLUPS_DIR))
+    partition_window = context.partition_time_window
+    start_time_ms = int(partition_window.start.timestamp() * 1000)
+    end_time_ms = int(partition_window.end.timestamp() * 1000)
+
+    # Nearest earlier hourly rollup, which carries every boolean code's last state
+    previous_rollup_paths = []
+    for hours_back in range(1, ROLLUP_STATE_LOOKBACK_HOURS + 1):
+        previous_path = hourly_rollup_path(
+            rollups_dir_abs, partition_window.start - timedelta(hours=hours_back)
+        )
+        if os.path.exists(previous_path):
+            previous_rollup_paths.append(previous_path)
+            break
+
+    output_path = hourly_rollup_path(rollups_dir_abs, partition_window.start)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_output_path = f"{output_path}.tmp"
+    state_since = partition_window.start - timedelta(hours=ROLLUP_STATE_LOOKBACK_HOURS)
+    duckdb_resource: DuckDBResource = context.resources.duckdb
+    # Shared locks: compaction or a restage must not swap the files read
+    with read_partitions(staged_partition_dirs_between(
+        staging_tuya_logs_path, state_since, partition_window.end
+    )):
+        source_path, _, _ = resolve_staged_hour_file(staging_tuya_logs_path, partition_window)
+        if source_path is None:
+            context.log.info(
+                f"No staged data for partition {context.partition_key}; carrying states forward only."
+            )
+        # Staged events of the lookback window, for the last state before the hour
+        previous_staging_files = staged_files_between(
+            staging_tuya_logs_path, state_since, partition_window.end
+        )
+        with duckdb_resource.get_connection() as conn:
+            try:
+                compute_hourly_rollup(
+                    conn, source_path, start_time_ms, end_time_ms,
+                    previous_rollup_paths, tmp_output_path,
+                    previous_staging_files, int(state_since.timestamp() * 1000),
+                )
+                os.replace(tmp_output_path, output_path)
+                rollup_rows = conn.execute(
+                    f"SELECT count(*) FROM read_parquet('{output_path}')"
+                ).fetchone()[0]
+            except duckdb.Error as e:
+                context.log.error(f"A DuckDB error occurred computing the hourly rollup: {e}")
+                raise # Re-raise the error to fail the asset run
+
+    context.log.info(f"Saved hourly rollup with {rollup_rows} rows to {output_path}")
+    context.add_output_metadata({"rollup_rows": rollup_rows, "path": output_path})
+    return rollups_dir_abs
+
+
+@asset(
+    deps=[hourly_device_rollups],
+    group_name="rollups",
+    required_resource_keys={"duckdb"},
+    partitions_def=daily_partitions,
+    automation_condition=ROLLUP_REFRESH_CONDITION,
+)
+def daily_device_rollups(context: AssetExecutionContext) -> str:
+    """
+    Merges the partition day's hourly rollups into one row per device and code:
+    data/rollups/daily/event_month=<YYYY-MM>/rollup_<YYYY-MM-DD>.parquet
+    Recomputed by rollup_refresh_sensor whenever one of the day's hourly
+    rollups changes (e.g. hours staged late by catch-up runs).
+    Returns the absolute path to the rollups directory.
+    """
+    script_dir = os.path.dirname(__file__)
+    rollups_dir_abs = os.path.abspath(os.path.join(script_dir, ROLLUPS_DIR))
+    day = context.partition_time_window.start
+    hourly_rollup_paths = sorted(glob.glob(os.path.join(
+        rollups_dir_abs, "hourly", f"event_date={day.strftime('%Y-%m-%d')}", "*.parquet"
+    )))
+    if not hourly_rollup_paths:
+        context.log.warning(f"No hourly rollups found for {context.partition_key}. Skipping.")
+        return rollups_dir_abs
+
+    output_path = os.path.join(
+        rollups_dir_abs,
+        "daily",
+        f"event_month={day.strftime('%Y-%m')}",
+        f"rollup_{day.strftime('%Y-%m-%d')}.parquet",
+    )
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_output_path = f"{output_path}.tmp"
+    duckdb_resource: DuckDBResource = context.resources.duckdb
+    with duckdb_resource.get_connection() as conn:
+        try:
+            compute_daily_rollup(conn, hourly_rollup_paths, tmp_output_path)
+            os.replace(tmp_output_path, output_path)
+        except duckdb.Error as e:
+            context.log.error(f"A DuckDB error occurred computing the daily rollup: {e}")
+            raise # Re-raise the error to fail the asset run
+
+    context.log.info(
+        f"Saved daily rollup from {len(hourly_rollup_paths)} hourly rollups to {output_path}"
+    )
+    context.add_output_metadata({"hourly_rollups": len(hourly_rollup_paths), "path": output_path})
+    return rollups_dir_abs
+
+
+class IntervalConfig(Config):
+    """Configuration for the state intervals asset."""
+    # Codes reporting power in W (after scaling); their intervals get energy_kwh
+    power_codes: list[str] = list(DEFAULT_INTERVAL_POWER_CODES)
+
+
+@asset(
+    ins={"staging_tuya_logs_path": AssetIn(key="staging_tuya_logs")}, # Declare dependency
+    # Each hour follows the previous one, so asset backfills run the hours in order
+    deps=[AssetDep("device_state_intervals", partition_mapping=PREVIOUS_PARTITION_MAPPING)],
+    group_name="rollups",
+    required_resource_keys={"duckdb"},
+    partitions_def=hourly_partitions,
+)
+def device_state_intervals(
+    context: AssetExecutionContext, config: IntervalConfig, staging_tuya_logs_path: str
+) -> str:
+    """
+    Turns the switch (boolean) and power events of the devices with staged logs
+    in the partition's hour into (device_id, code, value, start_time, end_time,
+    duration_seconds) intervals, with energy_kwh integrated over power
+    intervals. Each of those devices' whole day is recomputed from the day's
+    staged files and written to
+    data/intervals/event_date=<YYYY-MM-DD>/intervals_<device_id>.parquet
+    Other devices and days are left untouched. The state at midnight is each
+    code's last event staged in the INTERVAL_STATE_LOOKBACK_DAYS before it,
+    falling back to earlier interval files for states unchanged for longer; as
+    with the rollups, asset backfills materialize the hours in order.
+    Returns the absolute path to the intervals directory.
+    """
+    script_dir = os.path.dirname(__file__)
+    intervals_dir_abs = os.path.abspath(os.path.join(script_dir, INTERVALS_DIR))
+    partition_window = context.partition_time_window
+    day_start = partition_window.start.replace(hour=0, minute=0, second=0, microsecond=0)
+    day_end = day_start + timedelta(days=1)
+    # Shared locks: compaction or a restage must not swap the files read
+    with read_partitions(staged_partition_dirs_between(
+        staging_tuya_logs_path, day_start - timedelta(days=INTERVAL_STATE_LOOKBACK_DAYS), day_end
+    )):
+        source_path, hour_start_ms, hour_end_ms = resolve_staged_hour_file(
+            staging_tuya_logs_path, partition_window
+        )
+        if source_path is None:
+            context.log.info(f"No staged data for partition {context.partition_key}. Skipping.")
+            return intervals_dir_abs
+
+        date_str = day_start.strftime('%Y-%m-%d')
+        day_start_ms = int(day_start.timestamp() * 1000)
+        day_end_ms = int(day_end.timestamp() * 1000)
+        staging_files = sorted(glob.glob(os.path.join(
+            staging_tuya_logs_path, f"event_date={date_str}", "*.parquet"
+        )))
+        # Intervals end where the day's staged data ends (the latest staged hour, or
+        # midnight once compacted); open intervals are extended by later runs
+        staged_until_ms = int(partition_window.end.timestamp() * 1000)
+        for staging_file in staging_files:
+            file_name = os.path.basename(staging_file)
+            if file_name == COMPACTED_FILE_NAME:
+                staged_until_ms = day_end_ms
+            elif file_name.startswith("data_"):
+                hour_start = datetime.strptime(
+                    file_name[len("data_"):-len(".parquet")], '%Y%m%d%H%M%S'
+                ).replace(tzinfo=timezone.utc)
+                staged_until_ms = max(
+                    staged_until_ms, int((hour_start + timedelta(hours=1)).timestamp() * 1000)
+                )
+        bound_ms = min(
+            day_end_ms, staged_until_ms, int(datetime.now(timezone.utc).timestamp() * 1000)
+        )
+
+        duckdb_resource: DuckDBResource = context.resources.duckdb
+        with duckdb_resource.get_connection() as conn:
+            try:
+                # Only devices with events in this hour need their day recomputed
+                hour_filter = (
+                    f"WHERE epoch_ms(event_time) >= {hour_start_ms} AND epoch_ms(event_time) < {hour_end_ms}"
+                    if hour_start_ms is not None else ""
+                )
+                device_ids = sorted(row[0] for row in conn.execute(f"""
+                    SELECT DISTINCT device_id
+                    FROM read_parquet('{source_path}', hive_partitioning=false)
+                    {hour_filter}
+                """).fetchall() if row[0] is not None)
+                if not device_ids:
+                    context.log.info("No device events in the staged hour. Skipping.")
+                    return intervals_dir_abs
+
+                # Nearest earlier interval file of each device, for its state at midnight
+                previous_interval_paths = []
+                for device_id in device_ids:
+                    for days_back in range(1, INTERVAL_STATE_LOOKBACK_DAYS + 1):
+                        previous_path = interval_file_path(
+                            intervals_dir_abs,
+                            (day_start - timedelta(days=days_back)).strftime('%Y-%m-%d'),
+                            device_id,
+                        )
+                        if os.path.exists(previous_path):
+                            previous_interval_paths.append(previous_path)
+                            break
+
+                # Staged files of the preceding days, for the last state before midnight
+                previous_staging_files = staged_files_between(
+                    staging_tuya_logs_path,
+                    day_start - timedelta(days=INTERVAL_STATE_LOOKBACK_DAYS),
+                    day_start,
+                )
+
+                with Timer() as compute_timer:
+                    interval_count = compute_state_intervals(
+                        conn, staging_files, device_ids, config.power_codes,
+                        day_start_ms, day_end_ms, bound_ms,
+                        previous_interval_paths, "device_state_intervals",
+                        previous_staging_files,
+                    )
+                    for device_id in device_ids:
+                        write_device_intervals(
+                            conn, "device_state_intervals", intervals_dir_abs, date_str, device_id
+                        )
+                on_seconds, energy_kwh = conn.execute("""
+                    SELECT
+                        sum(duration_seconds) FILTER (WHERE lower(value) = 'true'),
+                        sum(energy_kwh)
+                    FROM device_state_intervals
+                """).fetchone()
+            except duckdb.Error as e:
+                context.log.error(f"A DuckDB error occurred computing state intervals: {e}")
+                raise # Re-raise the error to fail the asset run
+
+    context.log.info(
+        f"Saved {interval_count} intervals of {len(device_ids)} devices for {date_str} "
+        f"to {intervals_dir_abs}"
+    )
+    context.add_output_metadata({
+        "devices": len(device_ids),
+        "intervals": interval_count,
+        "on_seconds": round(on_seconds or 0.0, 3),
+        "energy_kwh": round(energy_kwh or 0.0, 6),
+        "compute_seconds": round(compute_timer.seconds, 3),
+    })
+    return intervals_dir_abs
+
+
+class CompactionConfig(Config):
+    """Configuration for the staging compaction asset."""
+    # Partitions younger than this (in days) are still receiving data and are skipped
+    min_age_days: int = COMPACTION_MIN_AGE_DAYS
+    # Rows per Parquet row group in the compacted files
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE
+
+
+@asset(
+    group_name="maintenance",
+    required_resource_keys={"duckdb"},
+    deps=[staging_tuya_logs],
+)
+def compacted_staging_partitions(context: AssetExecutionContext, config: CompactionConfig) -> str:
+    """
+    Rewrites every closed event_date partition of data/staging/ that holds more
+    than one file into a single Parquet file sorted by device_id, code and
+    event_time, in place. Each partition is locked against concurrent staging
+    while it is rewritten, and only the files the rewrite read are deleted.
+    Reports file counts and bytes before and after as metadata.
+    Returns the absolute path to the staging directory.
+    """
+    script_dir = os.path.dirname(__file__)
+    staging_dir_abs = os.path.abspath(os.path.join(script_dir, STAGING_DIR))
+    cutoff_date = (
+        datetime.now(timezone.utc) - timedelta(days=config.min_age_days)
+    ).strftime('%Y-%m-%d')
+    context.log.info(f"Compacting staging partitions before {cutoff_date} in {staging_dir_abs}")
+
+    totals = {"partitions_compacted": 0, "files_before": 0, "bytes_before": 0,
+              "files_after": 0, "bytes_after": 0}
+    duckdb_resource: DuckDBResource = context.resources.duckdb
+    with duckdb_resource.get_connection() as conn:
+        for event_date, partition_dir in list_partition_dirs(staging_dir_abs):
+            if event_date >= cutoff_date:
+                continue
+            parquet_files = glob.glob(os.path.join(partition_dir, "*.parquet"))
+            if len(parquet_files) <= 1:
+                continue # Already compacted (or empty)
+            try:
+                with partition_lock(partition_dir):
+                    (files_before, bytes_before), (files_after, bytes_after) = compact_partition(
+                        conn, partition_dir, config.row_group_size
+                    )
+            except duckdb.Error as e:
+                context.log.error(f"A DuckDB error occurred compacting {partition_dir}: {e}")
+                raise # Re-raise the error to fail the asset run
+            context.log.info(
+                f"  - event_date={event_date}: {files_before} files / {bytes_before} bytes -> "
+                f"{files_after} files / {bytes_after} bytes"
+            )
+            totals["partitions_compacted"] += 1
+            totals["files_before"] += files_before
+            totals["bytes_before"] += bytes_before
+            totals["files_after"] += files_after
+            totals["bytes_after"] += bytes_after
+        # Compaction replaces a partition's files: re-index them for the query API
+        update_staging_file_index(
+            conn, staging_dir_abs,
+            os.path.abspath(os.path.join(script_dir, STAGING_FILE_INDEX_PATH)),
+        )
+
+    context.log.info(f"Compaction finished: {totals}")
+    context.add_output_metadata(totals)
+    return staging_dir_abs
+
+
+class ArchiveConfig(Config):
+    """Configuration for the raw archival asset."""
+    # Device-days younger than this (in days) may still receive raw files and are skipped
+    min_age_days: int = RAW_ARCHIVE_MIN_AGE_DAYS
+
+
+@asset(
+    group_name="maintenance",
+    required_resource_keys={"duckdb"},
+    deps=[raw_tuya_logs],
+)
+def archived_raw_logs(context: AssetExecutionContext, config: ArchiveConfig) -> str:
+    """
+    Rolls the raw files of every closed device-day in data/raw/ into one
+    ZSTD-compressed Parquet archive per device and day, keeping each row's
+    source filename. The raw files are deleted once the archive is verified;
+    staging reads archives alongside raw files, so archived days can still
+    be reprocessed.
+    Reports device-days, files archived, rows and bytes as metadata.
+    Returns the absolute path to the raw directory.
+    """
+    script_dir = os.path.dirname(__file__)
+    raw_dir_abs = os.path.abspath(os.path.join(script_dir, BASE_OUTPUT_DIR))
+    cutoff_date = (
+        datetime.now(timezone.utc) - timedelta(days=config.min_age_days)
+    ).strftime('%Y-%m-%d')
+    context.log.info(f"Archiving raw device-days before {cutoff_date} in {raw_dir_abs}")
+
+    totals = {"device_days_archived": 0, "files_archived": 0, "bytes_before": 0,
+              "archive_rows": 0, "archive_bytes": 0}
+    archived_files = []
+    duckdb_resource: DuckDBResource = context.resources.duckdb
+    with duckdb_resource.get_connection() as conn:
+        for device_id, date_str, day_dir in list_device_days(raw_dir_abs):
+            if date_str >= cutoff_date:
+                continue
+            raw_files = raw_files_in(day_dir)
+            if not raw_files:
+                continue # Already archived
+            bytes_before = sum(os.path.getsize(f) for f in raw_files)
+            try:
+                files_archived, rows, archive_bytes = archive_device_day(
+                    conn, day_dir, device_id, date_str
+                )
+            except duckdb.Error as e:
+                context.log.error(f"A DuckDB error occurred archiving {day_dir}: {e}")
+                raise # Re-raise the error to fail the asset run
+            context.log.info(
+                f"  - {device_id} {date_str}: {files_archived} files / {bytes_before} bytes -> "
+                f"{rows} rows / {archive_bytes} bytes"
+            )
+            archived_files.extend(raw_files)
+            totals["device_days_archived"] += 1
+            totals["files_archived"] += files_archived
+            totals["bytes_before"] += bytes_before
+            totals["archive_rows"] += rows
+            totals["archive_bytes"] += archive_bytes
+
+    if archived_files:
+        # Archived raw files are gone: drop them from the staging manifest
+        forget_files(
+            os.path.abspath(os.path.join(script_dir, STAGING_MANIFEST_PATH)),
+            raw_dir_abs,
+            archived_files,
+        )
+
+    context.log.info(f"Raw archival finished: {totals}")
+    context.add_output_metadata(totals)
+    return raw_dir_abs
+
+
+class MicrobatchConfig(Config):
+    """Configuration for the near-real-time micro-batch asset."""
+    device_mapping_path: str = os.getenv(
+        "DEVICE_MAPPING_PATH", DEFAULT_INGESTION_MAPPING_PATH
+    )
+    max_workers: int = int(os.getenv("TUYA_FETCH_WORKERS", str(DEFAULT_FETCH_WORKERS)))
+    api_qps: float = float(os.getenv("TUYA_API_QPS", str(DEFAULT_API_QPS)))
+    max_lookback_minutes: int = int(
+        os.getenv(
+            "TUYA_MICROBATCH_MAX_LOOKBACK_MINUTES", str(DEFAULT_MICROBATCH_MAX_LOOKBACK_MINUTES)
+        )
+    )
+    end_lag_seconds: int = DEFAULT_MICROBATCH_END_LAG_SECONDS
+
+
+@asset(
+    group_name="near_real_time",
+    required_resource_keys={"tuya", "duckdb"},
+)
+def microbatch_tuya_logs(context: AssetExecutionContext, config: MicrobatchConfig) -> str:
+    """
+    Fetches only the logs each device reported since its micro-batch cursor
+    (at most `max_lookback_minutes` back) and appends them to data/staging/ as
+    provisional micro-batch files, one per hour touched. Hours the hourly
+    pipeline has already staged are skipped (and re-checked after writing),
+    and the hourly staging asset removes an hour's micro-batch files when it
+    stages that hour, so the hourly pipeline stays the source of truth. Triggered every minute or so
+    by tuya_microbatch_sensor.
+    Returns the absolute path to the staging directory.
+    """
+    run_started = time.perf_counter()
+    script_dir = os.path.dirname(__file__)
+    absolute_mapping_path = os.path.abspath(os.path.join(script_dir, config.device_mapping_path))
+    device_mapping = load_device_mapping(absolute_mapping_path)
+    if not device_mapping:
+        raise FileNotFoundError(f"Could not load device mapping from {absolute_mapping_path}")
+    device_ids = list(device_mapping.keys())
+    staging_dir_abs = os.path.abspath(os.path.join(script_dir, STAGING_DIR))
+
+    batch_time = datetime.now(timezone.utc)
+    end_time_ms = int((batch_time - timedelta(seconds=config.end_lag_seconds)).timestamp() * 1000)
+    min_start_ms = end_time_ms - config.max_lookback_minutes * 60 * 1000
+    cursor_path = os.path.abspath(os.path.join(script_dir, MICROBATCH_CURSOR_PATH))
+    cursor = load_watermarks(cursor_path)
+
+    openapi = context.resources.tuya.get_client()
+    # Draws from the same bucket as the hourly and catch-up runs, without waiting for them
+    rate_limiter = SharedTokenBucketRateLimiter(
+        os.path.abspath(os.path.join(script_dir, API_RATE_LIMIT_STATE_PATH)), config.api_qps
+    )
+    codes_cache = SupportedCodesCache(
+        os.path.abspath(os.path.join(script_dir, CODES_CACHE_PATH)),
+        DEFAULT_CODES_CACHE_TTL_HOURS * 3600,
+    )
+
+    def fetch_new_logs(device_id: str) -> tuple:
+        """Returns (new_logs, complete) for one device since its cursor."""
+        supported_codes, _ = lookup_device_codes(openapi, device_id, codes_cache, rate_limiter)
+        if not supported_codes:
+            return [], supported_codes is not None
+        # The cursor never reaches further back than max_lookback_minutes
+        start_ms = max(get_fetch_start_ms(cursor, device_id, min_start_ms), min_start_ms)
+        fetch_stats = {}
+        logs = fetch_status_logs(
+            openapi, device_id, ",".join(supported_codes), start_ms, end_time_ms,
+            rate_limiter, fetch_stats,
+        )
+        # The window starts at the cursor itself, so drop logs already ingested
+        return filter_new_logs(cursor, device_id, logs), fetch_stats.get("complete", False)
+
+    max_workers = max(1, min(config.max_workers, len(device_ids)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = dict(zip(device_ids, executor.map(fetch_new_logs, device_ids)))
+    codes_cache.save()
+
+    staged_hours = {}
+
+    def event_hour_is_staged(event_time_ms: int) -> bool:
+        """Whether the hourly pipeline already staged the hour of an event."""
+        hour_start_ms = event_time_ms - event_time_ms % (3600 * 1000)
+        if hour_start_ms not in staged_hours:
+            staged_hours[hour_start_ms] = hour_is_staged(
+                staging_dir_abs, datetime.fromtimestamp(hour_start_ms / 1000, tz=timezone.utc)
+            )
+        return staged_hours[hour_start_ms]
+
+    logs_by_device = {
+        device_id: [log for log in new_logs if not event_hour_is_staged(log.get("event_time", 0))]
+        for device_id, (new_logs, _) in results.items()
+    }
+    lineage_fields = {
+        "ingestion_timestamp_utc": batch_time.isoformat(),
+        "ingested_by": "dagster_tuya_microbatch_asset",
+        "filename": "tuya_api_microbatch",
+    }
+    logs_df = microbatch_logs_frame(logs_by_device, lineage_fields)
+    device_map_df = pd.DataFrame(list(device_mapping.items()), columns=['device_id', 'device_name'])
+    code_schema_df = code_schema_frame(codes_cache.get_schemas())
+
+    duckdb_resource: DuckDBResource = context.resources.duckdb
+    with duckdb_resource.get_connection() as conn:
+        conn.register('device_map_view', device_map_df)
+        conn.register(CODE_SCHEMA_VIEW, code_schema_df)
+        written_files = write_microbatch_files(
+            conn,
+            staging_dir_abs,
+            logs_df,
+            "dm.device_name",
+            "LEFT JOIN device_map_view dm ON rl.device_id = dm.device_id",
+            batch_time,
+        )
+    files_superseded = 0
+    for hour_start, file_path, rows in written_files:
+        # The hour may have been staged while we fetched: its hourly file then
+        # already holds these logs and staging removed micro-batches before ours
+        with partition_lock(os.path.dirname(file_path)):
+            if hour_is_staged(staging_dir_abs, hour_start):
+                os.remove(file_path)
+                files_superseded += 1
+                context.log.info(f"  - Hour {hour_start} was staged meanwhile; dropped {file_path}")
+                continue
+        context.log.info(f"  - Appended {rows} logs for hour {hour_start} to {file_path}")
+
+    # Advance the cursors only once the logs are in staging; incomplete fetches retry
+    complete_devices = 0
+    for device_id, (new_logs, complete) in results.items():
+        if complete:
+            complete_devices += 1
+            advance_watermark(cursor, device_id, end_time_ms, new_logs)
+    save_watermarks(cursor_path, cursor)
+
+    context.add_output_metadata({
+        "duration_seconds": round(time.perf_counter() - run_started, 3),
+        "devices": len(device_ids),
+        "devices_complete": complete_devices,
+        "new_logs": sum(len(new_logs) for new_logs, _ in results.values()),
+        "logs_appended": len(logs_df),
+        "files_written": len(written_files) - files_superseded,
+        "files_superseded": files_superseded,
+        "window_end": datetime.fromtimestamp(end_time_ms / 1000, tz=timezone.utc).isoformat(),
+    })
     return staging_dir_abs
 
 
@@ -360,23 +1509,231 @@ def staging_tuya_logs(context: AssetExecutionContext, raw_tuya_logs_path: str) -
 # Define a job that targets both assets
 tuya_processing_job = define_asset_job(
     name="tuya_processing_job",
-    selection=[raw_tuya_logs, staging_tuya_logs]
+    selection=[
+        raw_tuya_logs,
+        staging_tuya_logs,
+        hourly_device_rollups,
+        device_state_intervals,
+    ],
+    partitions_def=hourly_partitions,
+)
+
+# Optional job loading staged hours into the persistent warehouse; kept out of
+# tuya_processing_job so the hourly path does not depend on the warehouse
+warehouse_load_job = define_asset_job(
+    name="warehouse_load_job",
+    selection=[warehouse_device_logs],
+    partitions_def=hourly_partitions,
+)
+
+# Daily job merging each finished day's hourly rollups
+daily_rollup_job = define_asset_job(
+    name="daily_rollup_job",
+    selection=[daily_device_rollups],
+    partitions_def=daily_partitions,
+)
+
+# Daily maintenance job compacting closed staging partitions
+staging_compaction_job = define_asset_job(
+    name="staging_compaction_job",
+    selection=[compacted_staging_partitions],
+)
+
+# Daily maintenance job archiving closed raw device-days
+raw_archive_job = define_asset_job(
+    name="raw_archive_job",
+    selection=[archived_raw_logs],
+)
+
+# Near-real-time micro-batch job, triggered by tuya_microbatch_sensor
+tuya_microbatch_job = define_asset_job(
+    name="tuya_microbatch_job",
+    selection=[microbatch_tuya_logs],
 )
 
 # --- Schedule Definition ---
-# Define the hourly schedule for the job
-hourly_schedule = ScheduleDefinition(
+# Every hour, materialize the partition for the hour that just ended.
+# Runs a few minutes past the hour so late device reports have arrived.
+# Keeps the name of the original hourly ScheduleDefinition, so the schedule's
+# running state and tick history carry over in existing Dagster instances.
+hourly_schedule = build_schedule_from_partitioned_job(
+    tuya_processing_job,
+    name="tuya_processing_job_schedule",
+    minute_of_hour=5,
+)
+
+# Load the hour that just ended into the warehouse, once the hourly run staged it
+# (turn it on in the UI when the warehouse is used)
+warehouse_load_schedule = build_schedule_from_partitioned_job(
+    warehouse_load_job,
+    minute_of_hour=25,
+)
+
+# Roll up the previous day once its last hourly partition has been processed
+# (later changes to its hours are picked up by rollup_refresh_sensor)
+daily_rollup_schedule = build_schedule_from_partitioned_job(
+    daily_rollup_job,
+    hour_of_day=0,
+    minute_of_hour=45,
+)
+
+# Compact closed partitions once a day, away from the top of the hour
+daily_compaction_schedule = ScheduleDefinition(
+    job=staging_compaction_job,
+    cron_schedule="30 3 * * *",  # Every day at 03:30
+)
+
+# Archive closed raw device-days once a day, before compaction
+daily_raw_archive_schedule = ScheduleDefinition(
+    job=raw_archive_job,
+    cron_schedule="15 3 * * *",  # Every day at 03:15
+)
+
+# --- Sensor Definition ---
+# Optional near-real-time mode (stopped by default; turn it on in the UI):
+# requests a micro-batch run every MICROBATCH_INTERVAL_SECONDS unless the
+# previous one is still running
+@sensor(
+    job=tuya_microbatch_job,
+    minimum_interval_seconds=MICROBATCH_INTERVAL_SECONDS,
+    default_status=DefaultSensorStatus.STOPPED,
+)
+def tuya_microbatch_sensor(context: SensorEvaluationContext):
+    active_runs = context.instance.get_runs(
+        filters=RunsFilter(
+            job_name=tuya_microbatch_job.name,
+            statuses=[
+                DagsterRunStatus.QUEUED,
+                DagsterRunStatus.NOT_STARTED,
+                DagsterRunStatus.STARTING,
+                DagsterRunStatus.STARTED,
+            ],
+        ),
+        limit=1,
+    )
+    if active_runs:
+        return SkipReason("Previous micro-batch run is still in progress.")
+    return RunRequest()
+
+# Catch-up after an outage: requests tuya_processing_job for hourly partitions
+# within Tuya's log retention whose raw logs were never materialized (oldest
+# first, at most CATCHUP_MAX_RUNS_PER_TICK at a time). The latest partition is
+# left to hourly_schedule. Each partition is requested once by the sensor (its
+# run key); a catch-up run that fails is retried by a manual backfill.
+# Stopped by default like the schedules; turn it on together with hourly_schedule.
+@sensor(
     job=tuya_processing_job,
-    cron_schedule="0 * * * *",  # Every hour at minute 0
+    minimum_interval_seconds=CATCHUP_INTERVAL_SECONDS,
+    default_status=DefaultSensorStatus.STOPPED,
+)
+def tuya_catchup_sensor(context: SensorEvaluationContext):
+    active_runs = context.instance.get_runs(
+        filters=RunsFilter(
+            job_name=tuya_processing_job.name,
+            statuses=[
+                DagsterRunStatus.QUEUED,
+                DagsterRunStatus.NOT_STARTED,
+                DagsterRunStatus.STARTING,
+                DagsterRunStatus.STARTED,
+            ],
+            tags={CATCHUP_RUN_TAG: "true"},
+        ),
+        limit=1,
+    )
+    if active_runs:
+        return SkipReason("Previous catch-up runs are still in progress.")
+
+    now = datetime.now(timezone.utc)
+    retention_start = now - timedelta(days=TUYA_LOG_RETENTION_DAYS)
+    partition_keys = [
+        key for key in hourly_partitions.get_partition_keys(current_time=now)[:-1]
+        if hourly_partitions.time_window_for_partition_key(key).start >= retention_start
+    ]
+    materialized = context.instance.get_materialized_partitions(raw_tuya_logs.key)
+    missing = [key for key in partition_keys if key not in materialized]
+    if not missing:
+        return SkipReason("No missed partitions within the log retention window.")
+    requested = missing[:CATCHUP_MAX_RUNS_PER_TICK]
+    context.log.info(f"{len(missing)} missed partitions; requesting {requested}")
+    return [
+        RunRequest(
+            run_key=f"catchup-{partition_key}",
+            partition_key=partition_key,
+            tags={CATCHUP_RUN_TAG: "true"},
+        )
+        for partition_key in requested
+    ]
+
+# Refreshes rollups after hours are (re)staged out of order (catch-up runs,
+# manual restages): the later hourly rollups carrying the restaged hours' state,
+# one hour after the other, and the daily rollups of the days they fall in
+# (see ROLLUP_REFRESH_CONDITION). Stopped by default; turn it on together with
+# tuya_catchup_sensor.
+rollup_refresh_sensor = AutomationConditionSensorDefinition(
+    "rollup_refresh_sensor",
+    target=[hourly_device_rollups, daily_device_rollups],
+    default_status=DefaultSensorStatus.STOPPED,
 )
 
 # --- Repository Definition ---
 defs = Definitions(
-    assets=[raw_tuya_logs, staging_tuya_logs],
+    assets=[
+        raw_tuya_logs,
+        staging_tuya_logs,
+        warehouse_device_logs,
+        hourly_device_rollups,
+        daily_device_rollups,
+        device_state_intervals,
+        compacted_staging_partitions,
+        archived_raw_logs,
+        microbatch_tuya_logs,
+    ],
     resources={
-        # Configure the DuckDB resource (can be customized further)
-        "duckdb": DuckDBResource(database=":memory:") # Use in-memory for now
+        # Tuya OpenAPI client with a persisted token and pooled connections
+        "tuya": TuyaOpenAPIResource(
+            access_id=EnvVar("ACCESS_ID"),
+            access_secret=EnvVar("ACCESS_SECRET"),
+            api_endpoint=EnvVar("API_ENDPOINT"),
+            token_cache_path=os.path.abspath(
+                os.path.join(os.path.dirname(__file__), TOKEN_CACHE_PATH)
+            ),
+        ),
+        # In-memory scratch DB for staging; spills to disk past the memory limit
+        "duckdb": TunedDuckDBResource(
+            database=":memory:",
+            memory_limit=DUCKDB_MEMORY_LIMIT,
+            threads=DUCKDB_THREADS,
+            temp_directory=os.path.abspath(
+                os.path.join(os.path.dirname(__file__), DUCKDB_TEMP_DIRECTORY)
+            ),
+            preserve_insertion_order=False,
+        ),
+        # Persistent warehouse (single writer; connections retry while it is locked)
+        "warehouse": TunedDuckDBResource(
+            database=os.path.abspath(
+                os.path.join(os.path.dirname(__file__), WAREHOUSE_DATABASE_PATH)
+            ),
+            memory_limit=DUCKDB_MEMORY_LIMIT,
+            threads=DUCKDB_THREADS,
+            temp_directory=os.path.abspath(
+                os.path.join(os.path.dirname(__file__), DUCKDB_TEMP_DIRECTORY)
+            ),
+        ),
     },
-    jobs=[tuya_processing_job],
-    schedules=[hourly_schedule],
+    jobs=[
+        tuya_processing_job,
+        warehouse_load_job,
+        daily_rollup_job,
+        staging_compaction_job,
+        raw_archive_job,
+        tuya_microbatch_job,
+    ],
+    schedules=[
+        hourly_schedule,
+        warehouse_load_schedule,
+        daily_rollup_schedule,
+        daily_compaction_schedule,
+        daily_raw_archive_schedule,
+    ],
+    sensors=[tuya_microbatch_sensor, tuya_catchup_sensor, rollup_refresh_sensor],
 )
@@ -0,0 +1,154 @@
+"""
+Local stand-in for the Tuya OpenAPI client, used by the offline benchmarks.
+
+FakeTuyaOpenAPI has the same interface as tuya_connector.TuyaOpenAPI
+(constructor, connect(), get(path, params)) and serves synthetic responses for
+the endpoints the pipeline uses:
+/v2.0/cloud/thing/<device_id>/shadow/properties
+/v2.0/cloud/thing/<device_id>/model
+/v2.0/cloud/thing/<device_id>/report-logs   (paginated with last_row_key)
+
+Every device reports `events_per_hour` events spread evenly over each hour,
+cycling through SYNTHETIC_CODES, so runs are repeatable. Each request sleeps
+`latency_ms`, and requests can fail with a rate-limit error either at random
+(`error_rate`) or when more than `max_qps` requests arrive within one second.
+FakeTuyaOpenAPIResource stands in for the pipeline's "tuya" resource.
+"""
+import json
+import random
+import threading
+import time
+from collections import Counter, deque
+
+# code -> (typeSpec, function producing the reported value for event i)
+SYNTHETIC_CODES = {
+    "switch_1": ({"type": "bool"}, lambda i: "true" if (i // 5) % 2 == 0 else "false"),
+    "cur_power": ({"type": "value", "scale": 1}, lambda i: str(800 + (i * 37) % 1200)),
+    "cur_voltage": ({"type": "value", "scale": 1}, lambda i: str(2180 + (i * 13) % 60)),
+    "add_ele": ({"type": "value", "scale": 3}, lambda i: str(i % 50)),
+    "relay_status": ({"type": "enum"}, lambda i: ("power_off", "power_on", "last")[i % 3]),
+}
+RATE_LIMIT_ERROR = {"success": False, "code": 40000309, "msg": "request frequency exceeded"}
+HOUR_MS = 3600 * 1000
+
+
+class FakeTuyaOpenAPI:
+    """Thread-safe fake Tuya OpenAPI client with request counters."""
+
+    def __init__(
+        self,
+        endpoint: str = "",
+        access_id: str = "",
+        access_secret: str = "",
+        events_per_hour: int = 360,
+        latency_ms: float = 0.0,
+        error_rate: float = 0.0,
+        max_qps: float = None,
+        seed: int = 0
+    ):
+        self.endpoint = endpoint
+        self.events_per_hour = events_per_hour
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.max_qps = max_qps
+        self.calls = Counter()
+        self.logs_served = 0
+        self.rate_limited = 0
+        self._random = random.Random(seed)
+        self._recent_calls = deque()
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def connect(self):
+        return {"success": True}
+
+    def get(self, path: str, params: dict = None):
+        """Serves one request, mirroring the response shape of the Tuya API."""
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        endpoint_name = path.rsplit("/", 1)[-1]
+        with self._lock:
+            self.calls[endpoint_name] += 1
+            if self._is_rate_limited():
+                self.rate_limited += 1
+                return dict(RATE_LIMIT_ERROR)
+
+        device_id = path.split("/")[4]
+        if endpoint_name == "properties":
+            return {"success": True, "result": {"properties": [
+                {"code": code, "dp_id": dp_id, "value": value_of(0), "time": 0}
+                for dp_id, (code, (_, value_of)) in enumerate(SYNTHETIC_CODES.items(), start=1)
+            ]}}
+        if endpoint_name == "model":
+            model = {"services": [{"properties": [
+                {"code": code, "typeSpec": spec} for code, (spec, _) in SYNTHETIC_CODES.items()
+            ]}]}
+            return {"success": True, "result": {"model": json.dumps(model)}}
+        if endpoint_name == "report-logs":
+            return self._report_logs_page(device_id, params or {})
+        return {"success": False, "code": 1108, "msg": f"uri path invalid: {path}"}
+
+    def _is_rate_limited(self) -> bool:
+        if self.error_rate and self._random.random() < self.error_rate:
+            return True
+        if self.max_qps:
+            now = time.monotonic()
+            while self._recent_calls and now - self._recent_calls[0] >= 1.0:
+                self._recent_calls.popleft()
+            if len(self._recent_calls) >= self.max_qps:
+                return True
+            self._recent_calls.append(now)
+        return False
+
+    def _report_logs_page(self, device_id: str, params: dict):
+        codes = tuple(c for c in str(params.get("codes", "")).split(",") if c)
+        window_key = (device_id, codes, int(params["start_time"]), int(params["end_time"]))
+        with self._lock:
+            logs = self._windows.get(window_key)
+            if logs is None:
+                logs = self._windows[window_key] = self._generate_logs(*window_key)
+        offset = int(params.get("last_row_key") or 0)
+        page = logs[offset:offset + int(params.get("size", 100))]
+        has_more = offset + len(page) < len(logs)
+        with self._lock:
+            self.logs_served += len(page)
+        return {"success": True, "result": {
+            "logs": page,
+            "has_more": has_more,
+            "last_row_key": str(offset + len(page)) if has_more else "",
+        }}
+
+    def _generate_logs(self, device_id: str, codes: tuple, start_ms: int, end_ms: int) -> list:
+        """All of a device's events in [start_ms, end_ms], newest first like the API."""
+        code_names = list(SYNTHETIC_CODES)
+        step_ms = HOUR_MS / self.events_per_hour
+        logs = []
+        hour_start = start_ms - start_ms % HOUR_MS
+        while hour_start <= end_ms:
+            for i in range(self.events_per_hour):
+                event_time = hour_start + int(i * step_ms)
+                code = code_names[i % len(code_names)]
+                if start_ms <= event_time <= end_ms and (not codes or code in codes):
+                    logs.append({
+                        "code": code,
+                        "value": SYNTHETIC_CODES[code][1](i),
+                        "event_time": event_time,
+                        "event_id": 7,
+                    })
+            hour_start += HOUR_MS
+        logs.reverse()
+        return logs
+
+    def total_calls(self) -> int:
+        with self._lock:
+            return sum(self.calls.values())
+
+
+class FakeTuyaOpenAPIResource:
+    """Drop-in for TuyaOpenAPIResource that always hands out the given fake client."""
+
+    def __init__(self, client: FakeTuyaOpenAPI):
+        self.client = client
+
+    def get_client(self) -> FakeTuyaOpenAPI:
+        return self.client
@@ -0,0 +1,276 @@
+"""
+Offline ingestion and staging benchmark.
+
+Drives fetch_status_logs, raw_tuya_logs and staging_tuya_logs end to end
+against FakeTuyaOpenAPI for a synthetic fleet, in a throwaway work directory,
+and reports wall time, rows, rows/s, API calls, and the peak RSS sampled
+during each stage with its growth over the stage.
+
+Usage (from the repository root):
+    python -m app.benchmarks.run_benchmark --devices 50 --events-per-hour 2000 \
+        --latency-ms 20 --error-rate 0.01 --json-output bench.json
+"""
+import os
+import sys
+import json
+import time
+import glob
+import argparse
+import resource
+import threading
+import tempfile
+import contextlib
+from datetime import datetime, timedelta, timezone
+
+import duckdb
+from dagster import DagsterInstance, materialize
+
+from app import assets as pipeline
+from app.benchmarks.fake_tuya_api import (
+    FakeTuyaOpenAPI,
+    FakeTuyaOpenAPIResource,
+    SYNTHETIC_CODES,
+)
+from app.data_ingestion.ingestion_utils import fetch_status_logs, TokenBucketRateLimiter
+from app.data_processing.duckdb_resource import TunedDuckDBResource
+
+
+# How often the RSS sampler looks at this process's memory during a stage
+RSS_SAMPLE_INTERVAL_SECONDS = 0.01
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MiB (ru_maxrss is KiB on Linux)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def current_rss_mb() -> float:
+    """Current resident set size of this process in MiB (None where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm", "r", encoding="utf-8") as statm:
+            resident_pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+class RssSampler:
+    """
+    Samples the process RSS in a background thread while a stage runs.
+    ru_maxrss only ever grows over the whole process, so it cannot tell the
+    stages apart; the sampled peak can (short spikes between samples may be
+    missed). Without /proc, falls back to the process-wide ru_maxrss.
+    """
+
+    def __init__(self):
+        self.start_mb = current_rss_mb()
+        self.peak_mb = self.start_mb
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL_SECONDS):
+            self._sample()
+
+    def _sample(self):
+        rss = current_rss_mb()
+        if rss is not None:
+            self.peak_mb = max(self.peak_mb, rss)
+
+    def __enter__(self):
+        if self.start_mb is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start_mb is None:
+            self.peak_mb = peak_rss_mb()
+            return
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--devices", type=int, default=20, help="Number of synthetic devices")
+    parser.add_argument("--events-per-hour", type=int, default=720, help="Events per device per hour")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Simulated latency per API request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with a rate-limit error")
+    parser.add_argument("--max-qps", type=float, default=None, help="Fake server QPS ceiling (rate-limit errors above it)")
+    parser.add_argument("--workers", type=int, default=pipeline.DEFAULT_FETCH_WORKERS, help="raw_tuya_logs fetch workers")
+    parser.add_argument("--api-qps", type=float, default=1000.0, help="Client-side rate limit (TUYA_API_QPS)")
+    parser.add_argument("--partition", default=None, help="Hourly partition key (default: the previous full UTC hour)")
+    parser.add_argument("--work-dir", default=None, help="Directory for benchmark data (default: a temporary directory)")
+    parser.add_argument("--json-output", default=None, help="Also write the report to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="Keep the pipeline's print output")
+    return parser.parse_args(argv)
+
+
+def configure_pipeline(work_dir: str, device_count: int) -> str:
+    """Points the pipeline's data paths at `work_dir`. Returns the device mapping path."""
+    mapping_path = os.path.join(work_dir, "device_mapping.json")
+    with open(mapping_path, "w", encoding="utf-8") as mapping_file:
+        json.dump({f"benchdevice{n:06d}": f"Bench device {n}" for n in range(device_count)}, mapping_file)
+
+    # Absolute paths win over the asset module's directory in os.path.join
+    pipeline.BASE_OUTPUT_DIR = os.path.join(work_dir, "raw")
+    pipeline.STAGING_DIR = os.path.join(work_dir, "staging")
+    pipeline.WATERMARK_STATE_PATH = os.path.join(work_dir, "state", "watermarks.json")
+    pipeline.CODES_CACHE_PATH = os.path.join(work_dir, "state", "supported_codes.json")
+    pipeline.API_RATE_LIMIT_STATE_PATH = os.path.join(work_dir, "state", "tuya_api_rate_limit.json")
+    pipeline.STAGING_MANIFEST_PATH = os.path.join(work_dir, "state", "staging_manifest.json")
+    pipeline.STAGING_FILE_INDEX_PATH = os.path.join(work_dir, "state", "staging_file_index.json")
+    pipeline.STAGING_WORK_DIR = os.path.join(work_dir, "staging_batches")
+    pipeline.DEFAULT_PROCESSING_MAPPING_PATH = mapping_path
+    return mapping_path
+
+
+def run_stage(name: str, fake_client: FakeTuyaOpenAPI, stage) -> dict:
+    """
+    Runs `stage()` (which returns its row count) and measures it. peak_rss_mb
+    is the highest RSS sampled during the stage and rss_growth_mb its rise
+    over the RSS at the stage's start.
+    """
+    calls_before = fake_client.total_calls()
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        rows = stage()
+        wall_seconds = time.perf_counter() - started
+    return {
+        "stage": name,
+        "wall_seconds": round(wall_seconds, 3),
+        "rows": rows,
+        "rows_per_second": round(rows / wall_seconds, 1) if wall_seconds else None,
+        "api_calls": fake_client.total_calls() - calls_before,
+        "peak_rss_mb": round(rss.peak_mb, 1),
+        "rss_growth_mb": round(rss.peak_mb - rss.start_mb, 1) if rss.start_mb is not None else None,
+    }
+
+
+def benchmark_resources(work_dir: str, fake_client: FakeTuyaOpenAPI) -> dict:
+    """
+    Resources for raw_tuya_logs and staging_tuya_logs: the fake Tuya client,
+    and a DuckDB resource that spills under `work_dir` instead of app/data.
+    """
+    return {
+        "tuya": FakeTuyaOpenAPIResource(fake_client),
+        "duckdb": TunedDuckDBResource(
+            database=":memory:",
+            memory_limit=pipeline.DUCKDB_MEMORY_LIMIT,
+            threads=pipeline.DUCKDB_THREADS,
+            temp_directory=os.path.join(work_dir, "duckdb_tmp"),
+            preserve_insertion_order=False,
+        ),
+    }
+
+
+def run_benchmark(args) -> dict:
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="tuya_benchmark_")
+    os.makedirs(work_dir, exist_ok=True)
+    fake_client = FakeTuyaOpenAPI(
+        events_per_hour=args.events_per_hour,
+        latency_ms=args.latency_ms,
+        error_rate=args.error_rate,
+        max_qps=args.max_qps,
+    )
+    mapping_path = configure_pipeline(work_dir, args.devices)
+    device_ids = [f"benchdevice{n:06d}" for n in range(args.devices)]
+
+    if args.partition:
+        partition_start = datetime.strptime(args.partition, "%Y-%m-%d-%H:%M").replace(tzinfo=timezone.utc)
+    else:
+        partition_start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) - timedelta(hours=1)
+    partition_key = partition_start.strftime("%Y-%m-%d-%H:%M")
+    start_ms = int(partition_start.timestamp() * 1000)
+    end_ms = start_ms + 3600 * 1000 - 1
+    codes_str = ",".join(SYNTHETIC_CODES)
+
+    def fetch_stage() -> int:
+        rate_limiter = TokenBucketRateLimiter(args.api_qps)
+        return sum(
+            len(fetch_status_logs(fake_client, device_id, codes_str, start_ms, end_ms, rate_limiter))
+            for device_id in device_ids
+        )
+
+    instance = DagsterInstance.ephemeral(tempdir=os.path.join(work_dir, "dagster"))
+    resources = benchmark_resources(work_dir, fake_client)
+    raw_config = {"ops": {"raw_tuya_logs": {"config": {
+        "device_mapping_path": mapping_path,
+        "max_workers": args.workers,
+        "api_qps": args.api_qps,
+    }}}}
+
+    def raw_stage() -> int:
+        logs_before = fake_client.logs_served
+        materialize(
+            [pipeline.raw_tuya_logs], run_config=raw_config, instance=instance,
+            resources=resources, partition_key=partition_key,
+        )
+        return fake_client.logs_served - logs_before
+
+    def staging_stage() -> int:
+        materialize(
+            [pipeline.raw_tuya_logs, pipeline.staging_tuya_logs],
+            selection=[pipeline.staging_tuya_logs], instance=instance,
+            resources=resources, partition_key=partition_key,
+        )
+        staged_files = glob.glob(os.path.join(pipeline.STAGING_DIR, "*", "*.parquet"))
+        if not staged_files:
+            return 0
+        file_list = ", ".join(f"'{f}'" for f in staged_files)
+        return duckdb.sql(f"SELECT count(*) FROM read_parquet([{file_list}])").fetchone()[0]
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with output:
+        stages = [
+            run_stage("fetch_status_logs", fake_client, fetch_stage),
+            run_stage("raw_tuya_logs", fake_client, raw_stage),
+            run_stage("staging_tuya_logs", fake_client, staging_stage),
+        ]
+    return {
+        "parameters": {
+            "devices": args.devices,
+            "events_per_hour": args.events_per_hour,
+            "latency_ms": args.latency_ms,
+            "error_rate": args.error_rate,
+            "max_qps": args.max_qps,
+            "workers": args.workers,
+            "api_qps": args.api_qps,
+            "partition": partition_key,
+            "work_dir": work_dir,
+        },
+        "stages": stages,
+        "api_calls_by_endpoint": dict(fake_client.calls),
+        "rate_limited_requests": fake_client.rate_limited,
+    }
+
+
+def print_report(report: dict):
+    print("Benchmark parameters: " + ", ".join(f"{k}={v}" for k, v in report["parameters"].items()))
+    print(
+        f"{'stage':<20}{'wall_s':>10}{'rows':>12}{'rows/s':>12}{'api_calls':>11}"
+        f"{'peak_rss_mb':>13}{'rss_growth_mb':>15}"
+    )
+    for stage in report["stages"]:
+        print(
+            f"{stage['stage']:<20}{stage['wall_seconds']:>10}{stage['rows']:>12}"
+            f"{str(stage['rows_per_second']):>12}{stage['api_calls']:>11}{stage['peak_rss_mb']:>13}"
+            f"{str(stage['rss_growth_mb']):>15}"
+        )
+    print(f"API calls by endpoint: {report['api_calls_by_endpoint']}")
+    print(f"Rate-limited requests: {report['rate_limited_requests']}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_benchmark(args)
+    print_report(report)
+    if args.json_output:
+        with open(args.json_output, "w", encoding="utf-8") as report_file:
+            json.dump(report, report_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
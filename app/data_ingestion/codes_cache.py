@@ -0,0 +1,95 @@
+"""
+On-disk TTL cache for the supported status codes of each Tuya device.
+
+The cache file is a JSON document of the form:
+{"<device_id>": {"codes": [...], "schema": {"<code>": {"type": ..., "scale": ...}},
+                 "cached_at": <unix seconds>}, ...}
+The schema (declared type and scale of each code) is used by staging to write
+typed value columns.
+"""
+import os
+import json
+import threading
+import time
+
+DEFAULT_CODES_CACHE_TTL_HOURS = 24.0
+
+
+class SupportedCodesCache:
+    """
+    Thread-safe cache of device code lists, persisted to a JSON file.
+    Entries older than `ttl_seconds` are treated as misses. Hit and miss counts
+    are tracked so callers can report how many API lookups were saved.
+    """
+
+    def __init__(self, file_path: str, ttl_seconds: float):
+        self.file_path = file_path
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.file_path, 'r', encoding='utf-8') as cache_file:
+                entries = json.load(cache_file)
+            print(f"Loaded supported codes cache with {len(entries)} devices from {self.file_path}")
+            return entries
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError:
+            print(f"Error: Could not decode codes cache at {self.file_path}. Starting empty.")
+            return {}
+
+    def get(self, device_id: str):
+        """
+        Returns the cached codes for a device, or None on a miss or expired entry.
+        Entries cached before code schemas were recorded count as misses.
+        """
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if (
+                entry is not None
+                and "schema" in entry
+                and time.time() - entry.get("cached_at", 0) < self.ttl_seconds
+            ):
+                self.hits += 1
+                return list(entry.get("codes", []))
+            self.misses += 1
+            return None
+
+    def put(self, device_id: str, codes: list, schema: dict = None):
+        """Stores a freshly fetched code list (and optional code schema) for a device."""
+        with self._lock:
+            self._entries[device_id] = {
+                "codes": list(codes),
+                "schema": schema or {},
+                "cached_at": time.time(),
+            }
+
+    def get_schemas(self) -> dict:
+        """Returns {device_id: {code: {"type", "scale"}}} for every cached device, ignoring TTL."""
+        with self._lock:
+            return {
+                device_id: dict(entry.get("schema", {}))
+                for device_id, entry in self._entries.items()
+            }
+
+    def invalidate(self, device_id: str = None):
+        """Drops one device's entry, or every entry when no device is given."""
+        with self._lock:
+            if device_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(device_id, None)
+
+    def save(self):
+        """Atomically writes the cache to disk (write to temp file, then rename)."""
+        with self._lock:
+            entries = dict(self._entries)
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        tmp_path = f"{self.file_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as cache_file:
+            json.dump(entries, cache_file, indent=4, sort_keys=True)
+        os.replace(tmp_path, self.file_path)
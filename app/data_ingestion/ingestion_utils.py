@@ -1,12 +1,119 @@
 import os
 import json
-from datetime import datetime, timedelta, timezone
+import fcntl
+import threading
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from tuya_connector import TuyaOpenAPI # Keep import here as it's used by helpers
 
 # --- Configuration (can be moved or passed as args if needed) ---
 LOG_PAGE_SIZE = 100
+# Tuya error codes for a request naming codes the device does not (or no longer)
+# support: 1109 "param is illegal", 2008 "command or value not support".
+# Other errors (e.g. 40000309 rate limit, 1010 token invalid) say nothing about
+# the code list.
+INVALID_CODES_ERROR_CODES = frozenset({1109, 2008})
+
+# --- Rate Limiting ---
+class TokenBucketRateLimiter:
+    """
+    Thread-safe token bucket shared by every worker talking to the Tuya API.
+
+    `rate` tokens are added per second up to `capacity`; each request consumes
+    one token and blocks until one is available, keeping the aggregate request
+    rate under the project's QPS quota regardless of the number of workers.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        if rate <= 0:
+            raise ValueError("Rate limiter rate must be positive.")
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available, then consumes it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                elapsed = now - self._last_refill
+                self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_seconds = (1 - self._tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+class SharedTokenBucketRateLimiter:
+    """
+    Token bucket shared by every process talking to the Tuya API.
+
+    Behaves like TokenBucketRateLimiter, but keeps the bucket in a small JSON
+    file ({"tokens": ..., "updated_at": <epoch seconds>}) updated under an
+    exclusive file lock, so concurrent runs (hourly, catch-up, backfills and
+    micro-batches) draw from one quota while each makes progress.
+    """
+
+    def __init__(self, state_path: str, rate: float, capacity: float = None):
+        if rate <= 0:
+            raise ValueError("Rate limiter rate must be positive.")
+        self.state_path = state_path
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+
+    def _take_token(self) -> float:
+        """Consumes a token if one is available. Returns 0, or the seconds to wait for one."""
+        # One open file per call: flock also excludes other threads of this process
+        with open(f"{self.state_path}.lock", 'a', encoding='utf-8') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.state_path, 'r', encoding='utf-8') as state_file:
+                        state = json.load(state_file)
+                    tokens, updated_at = float(state["tokens"]), float(state["updated_at"])
+                except (FileNotFoundError, json.JSONDecodeError, KeyError, TypeError, ValueError):
+                    tokens, updated_at = self.capacity, time.time()
+                now = time.time()
+                tokens = min(self.capacity, tokens + max(0.0, now - updated_at) * self.rate)
+                wait_seconds = 0.0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    wait_seconds = (1 - tokens) / self.rate
+                tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as state_file:
+                    json.dump({"tokens": tokens, "updated_at": now}, state_file)
+                os.replace(tmp_path, self.state_path)
+                return wait_seconds
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def acquire(self):
+        """Blocks until a token is available in the shared bucket, then consumes it."""
+        while True:
+            wait_seconds = self._take_token()
+            if not wait_seconds:
+                return
+            time.sleep(wait_seconds)
+
 
 # --- Helper Functions ---
+def is_invalid_codes_error(api_error) -> bool:
+    """True if a failed API response rejected the requested codes."""
+    if not api_error:
+        return False
+    try:
+        return int(api_error.get("code")) in INVALID_CODES_ERROR_CODES
+    except (TypeError, ValueError):
+        return False
+
+
 def load_device_mapping(file_path):
     """Loads the device ID to name mapping from a JSON file."""
     try:
@@ -28,52 +135,155 @@ def load_device_mapping(file_path):
         return None
 
 
-def get_device_supported_codes(openapi_client: TuyaOpenAPI, p_device_id: str):
-    """Queries the Tuya API to get the list of supported status codes for a device."""
-    print(f"  - Querying supported codes for device {p_device_id}...")
+def get_device_properties(
+    openapi_client: TuyaOpenAPI,
+    p_device_id: str,
+    rate_limiter: TokenBucketRateLimiter = None
+):
+    """
+    Queries the Tuya API for a device's shadow properties (code, dp_id, value, ...).
+    Returns the list of properties, or None if the query failed.
+    """
     endpoint = f"/v2.0/cloud/thing/{p_device_id}/shadow/properties"
     try:
+        if rate_limiter is not None:
+            rate_limiter.acquire()
         response = openapi_client.get(endpoint)
         if response.get("success", False):
-            properties = response.get("result", {}).get("properties", [])
-            codes = [prop.get("code") for prop in properties if prop.get("code")]
-            if codes:
-                print(f"  - Found supported codes: {', '.join(codes)}")
-                return codes
-            else:
-                print(f"  - No supported codes found in API response for {p_device_id}.")
-                return []
-        else:
-            print(f"  - Error querying codes for device {p_device_id}: {response}")
-            return None # Indicate error
+            return response.get("result", {}).get("properties", [])
+        print(f"  - Error querying properties for device {p_device_id}: {response}")
+        return None # Indicate error
     except ConnectionError as e: # More specific exception
-        print(f"  - Connection error querying codes for device {p_device_id}: {e}")
+        print(f"  - Connection error querying properties for device {p_device_id}: {e}")
         return None # Indicate error
     except Exception as e:
-        print(f"  - An unexpected error occurred querying codes for {p_device_id}: {e}")
+        print(f"  - An unexpected error occurred querying properties for {p_device_id}: {e}")
         return None
 
 
-def get_time_range_ms(hours_ago: int):
-    """Calculates the start and end time (in milliseconds) for a past time window."""
-    now = datetime.now(timezone.utc)
-    end_time = now
-    start_time = now - timedelta(hours=hours_ago)
-    _end_time_ms = int(end_time.timestamp() * 1000)
-    _start_time_ms = int(start_time.timestamp() * 1000)
-    print(f"Querying logs from {start_time} to {end_time} ({_start_time_ms}ms to {_end_time_ms}ms)")
-    return _start_time_ms, _end_time_ms
+def codes_from_properties(p_device_id: str, properties):
+    """Extracts the supported status codes from a device's shadow properties."""
+    if properties is None:
+        return None
+    codes = [prop.get("code") for prop in properties if prop.get("code")]
+    if codes:
+        print(f"  - Found supported codes: {', '.join(codes)}")
+    else:
+        print(f"  - No supported codes found in API response for {p_device_id}.")
+    return codes
 
 
-def fetch_status_logs(
+def get_device_model_specs(
+    openapi_client: TuyaOpenAPI,
+    p_device_id: str,
+    rate_limiter: TokenBucketRateLimiter = None
+):
+    """
+    Queries the device's thing data model and returns {code: typeSpec}, where
+    typeSpec holds the declared type ("bool", "value", "enum", ...) and, for
+    numeric codes, the scale. Returns an empty dict if the model is unavailable.
+    """
+    endpoint = f"/v2.0/cloud/thing/{p_device_id}/model"
+    try:
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        response = openapi_client.get(endpoint)
+        if not response.get("success", False):
+            print(f"  - Error querying data model for device {p_device_id}: {response}")
+            return {}
+        model = response.get("result", {}).get("model", {})
+        if isinstance(model, str):
+            model = json.loads(model)
+        specs = {}
+        for service in model.get("services", []):
+            for prop in service.get("properties", []):
+                if prop.get("code"):
+                    specs[prop["code"]] = prop.get("typeSpec", {})
+        return specs
+    except (ConnectionError, json.JSONDecodeError) as e:
+        print(f"  - Error querying data model for device {p_device_id}: {e}")
+        return {}
+    except Exception as e:
+        print(f"  - An unexpected error occurred querying data model for {p_device_id}: {e}")
+        return {}
+
+
+def build_code_schema(properties: list, model_specs: dict) -> dict:
+    """
+    Builds {code: {"type": ..., "scale": ...}} for a device from its shadow
+    properties and data model. The declared model type wins; otherwise the
+    type is taken from the property or inferred from its current value. Codes
+    whose type cannot be told (e.g. a string value while the model is
+    unavailable) are left out, so staging types each value by its content.
+    """
+    schema = {}
+    for prop in properties or []:
+        code = prop.get("code")
+        if not code:
+            continue
+        spec = model_specs.get(code, {})
+        value_type = spec.get("type") or prop.get("type")
+        if not value_type:
+            value = prop.get("value")
+            if isinstance(value, bool):
+                value_type = "bool"
+            elif isinstance(value, (int, float)):
+                value_type = "value"
+            else:
+                continue
+        schema[code] = {"type": value_type, "scale": int(spec.get("scale", 0) or 0)}
+    return schema
+
+
+def lookup_device_codes(
+    openapi_client: TuyaOpenAPI,
+    p_device_id: str,
+    codes_cache,
+    rate_limiter: TokenBucketRateLimiter = None
+):
+    """
+    Returns (codes, from_cache) for a device from a SupportedCodesCache,
+    querying the API (properties and data model) only on a cache miss.
+    codes is None if the API query failed.
+    """
+    cached_codes = codes_cache.get(p_device_id)
+    if cached_codes is not None:
+        return cached_codes, True
+    print(f"  - Querying supported codes for device {p_device_id}...")
+    properties = get_device_properties(openapi_client, p_device_id, rate_limiter)
+    supported_codes = codes_from_properties(p_device_id, properties)
+    if supported_codes is not None:
+        # The data model adds the declared type and scale used for typed columns
+        model_specs = get_device_model_specs(openapi_client, p_device_id, rate_limiter)
+        codes_cache.put(p_device_id, supported_codes, build_code_schema(properties, model_specs))
+    return supported_codes, False
+
+
+def iter_status_log_pages(
     openapi_client: TuyaOpenAPI,
     p_device_id: str,
     codes: str,
     p_start_time_ms: int,
-    p_end_time_ms: int
+    p_end_time_ms: int,
+    rate_limiter: TokenBucketRateLimiter = None,
+    stats: dict = None
 ):
-    """Fetches specified device status logs from the Tuya API, handling pagination."""
-    all_logs = []
+    """
+    Fetches specified device status logs from the Tuya API, handling pagination,
+    and yields each page of logs as it arrives so callers never need to hold
+    the whole window in memory. If a `stats` dict is given, it is filled once
+    the walk ends with the number of pages walked, whether the whole window was
+    fetched ("complete") or the walk stopped early, the failing API response
+    ("api_error") if the API rejected a request, the number of requests sent,
+    and the seconds spent waiting on the API ("api_seconds") and on the rate
+    limiter ("rate_limit_wait_seconds").
+    """
+    total_logs = 0
+    requests_sent = 0
+    api_seconds = 0.0
+    rate_limit_wait_seconds = 0.0
+    complete = False
+    api_error = None
     last_row_key = ""
     page_num = 1
     print(f"Fetching logs for device {p_device_id}...")
@@ -89,7 +299,16 @@ def fetch_status_logs(
         }
         print(f"  - Requesting page {page_num} for codes '{codes}' (last_row_key: '{last_row_key}')...")
         try:
-            response = openapi_client.get(endpoint, params)
+            if rate_limiter is not None:
+                wait_started = time.perf_counter()
+                rate_limiter.acquire()
+                rate_limit_wait_seconds += time.perf_counter() - wait_started
+            request_started = time.perf_counter()
+            requests_sent += 1
+            try:
+                response = openapi_client.get(endpoint, params)
+            finally:
+                api_seconds += time.perf_counter() - request_started
         except ConnectionError as e:
              print(f"  - Connection error during log fetch for device {p_device_id}, page {page_num}: {e}")
              break # Exit loop on connection error during fetch
@@ -99,6 +318,7 @@ def fetch_status_logs(
 
         if not response.get("success", False):
             print(f"  - Error fetching logs for device {p_device_id}: {response}")
+            api_error = response
             break # Exit loop on API error
 
         result = response.get("result", {})
@@ -108,15 +328,142 @@ def fetch_status_logs(
 
         if page_logs:
             print(f"  - Received {len(page_logs)} logs on page {page_num}.")
-            all_logs.extend(page_logs)
+            total_logs += len(page_logs)
+            yield page_logs
         else:
             print(f"  - Received 0 logs on page {page_num}.")
 
         if not has_more or not last_row_key:
             print(f"  - No more pages for device {p_device_id}.")
+            complete = True
             break
 
         page_num += 1
 
-    print(f"Finished fetching logs for device {p_device_id}. Total logs: {len(all_logs)}")
+    print(f"Finished fetching logs for device {p_device_id}. Total logs: {total_logs}")
+    if stats is not None:
+        stats["pages"] = page_num
+        stats["complete"] = complete
+        stats["api_error"] = api_error
+        stats["requests"] = requests_sent
+        stats["api_seconds"] = api_seconds
+        stats["rate_limit_wait_seconds"] = rate_limit_wait_seconds
+
+
+def plan_time_slices(
+    p_start_time_ms: int,
+    p_end_time_ms: int,
+    expected_records: float,
+    target_records_per_slice: int,
+    max_slices: int
+) -> list:
+    """
+    Splits the inclusive window [start, end] into equal, non-overlapping
+    inclusive sub-ranges so each is expected to hold about
+    `target_records_per_slice` logs (at most `max_slices` ranges). Devices with
+    no volume history or a small expected volume keep a single range.
+    """
+    slice_count = 1
+    if expected_records and target_records_per_slice > 0:
+        slice_count = int(min(max_slices, -(-expected_records // target_records_per_slice)))
+    slice_count = max(1, min(slice_count, p_end_time_ms - p_start_time_ms + 1))
+    span_ms = p_end_time_ms - p_start_time_ms + 1
+    bounds = [p_start_time_ms + span_ms * i // slice_count for i in range(slice_count + 1)]
+    return [(bounds[i], bounds[i + 1] - 1) for i in range(slice_count)]
+
+
+def iter_sliced_status_log_pages(
+    openapi_client: TuyaOpenAPI,
+    p_device_id: str,
+    codes: str,
+    time_slices: list,
+    rate_limiter: TokenBucketRateLimiter = None,
+    stats: dict = None
+):
+    """
+    Fetches a device's logs over several time slices (see plan_time_slices) at
+    the same time, one pagination cursor per slice, and yields the pages slice
+    by slice, in slice order. Each slice's pages are spooled to an anonymous
+    temporary file while it is fetched, so memory stays bounded by a few pages
+    whatever a slice's volume; within a slice, pages keep the API's order.
+    A single slice is simply paged like iter_status_log_pages.
+    `stats` is filled with the totals of all slices; the fetch is "complete"
+    only if every slice was fetched completely.
+    """
+    if len(time_slices) == 1:
+        yield from iter_status_log_pages(
+            openapi_client, p_device_id, codes, *time_slices[0], rate_limiter, stats
+        )
+        return
+
+    def fetch_slice(time_slice):
+        slice_stats = {}
+        spool_file = tempfile.TemporaryFile(mode='w+', encoding='utf-8')
+        try:
+            for page_logs in iter_status_log_pages(
+                openapi_client, p_device_id, codes, *time_slice, rate_limiter, slice_stats
+            ):
+                spool_file.write(json.dumps(page_logs, ensure_ascii=False) + "\n")
+            spool_file.seek(0)
+        except BaseException:
+            spool_file.close()
+            raise
+        return spool_file, slice_stats
+
+    print(f"Fetching logs for device {p_device_id} in {len(time_slices)} parallel time slices...")
+    totals = {"pages": 0, "requests": 0, "api_seconds": 0.0, "rate_limit_wait_seconds": 0.0}
+    complete = True
+    api_error = None
+    executor = ThreadPoolExecutor(max_workers=len(time_slices))
+    futures = [executor.submit(fetch_slice, time_slice) for time_slice in time_slices]
+    try:
+        # Slices are yielded in order, each as soon as it and its predecessors are done
+        for future in futures:
+            spool_file, slice_stats = future.result()
+            for field in totals:
+                totals[field] += slice_stats.get(field, 0)
+            complete = complete and slice_stats.get("complete", False)
+            api_error = api_error or slice_stats.get("api_error")
+            with spool_file:
+                for line in spool_file:
+                    yield json.loads(line)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        # Spool files of slices never consumed (the caller stopped early)
+        for future in futures:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                future.result()[0].close()
+    if stats is not None:
+        stats.update(totals)
+        stats["complete"] = complete
+        stats["api_error"] = api_error
+        stats["slices"] = len(time_slices)
+
+
+def fetch_status_logs(
+    openapi_client: TuyaOpenAPI,
+    p_device_id: str,
+    codes: str,
+    p_start_time_ms: int,
+    p_end_time_ms: int,
+    rate_limiter: TokenBucketRateLimiter = None,
+    stats: dict = None,
+    time_slices: list = None
+):
+    """
+    Fetches specified device status logs from the Tuya API, handling pagination,
+    and returns them as a single list. See iter_status_log_pages for `stats`.
+    If `time_slices` is given, the window is fetched as those parallel slices
+    instead (see iter_sliced_status_log_pages).
+    """
+    all_logs = []
+    for page_logs in iter_sliced_status_log_pages(
+        openapi_client,
+        p_device_id,
+        codes,
+        time_slices or [(p_start_time_ms, p_end_time_ms)],
+        rate_limiter,
+        stats
+    ):
+        all_logs.extend(page_logs)
     return all_logs
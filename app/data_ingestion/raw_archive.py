@@ -0,0 +1,116 @@
+"""
+Archival of closed device-days of the raw layer.
+
+All raw files of one device and day (data/raw/<device_id>/<YYYY-MM-DD>/) are
+rolled into a single ZSTD-compressed Parquet file in the same directory:
+<device_id>_<YYYYMMDD>_archive.parquet
+with every raw field plus `filename`, the raw file each row came from, so
+lineage survives and staging can still reprocess the day from the archive.
+The originals are deleted only after the archive's per-file row counts were
+verified against them.
+
+A day archived earlier can get new raw files (a re-fetched partition); the
+next archival merges them in, replacing the archived rows of any file with
+the same name. Readers combine both with raw_logs_source_sql.
+"""
+import os
+import glob
+
+from app.data_ingestion.raw_log_writer import RAW_FILE_SUFFIXES
+
+ARCHIVE_FILE_SUFFIX = "_archive.parquet"
+
+
+def archive_file_path(day_dir: str, device_id: str, date_str: str) -> str:
+    """Path of a device-day archive (date_str as YYYY-MM-DD)."""
+    return os.path.join(day_dir, f"{device_id}_{date_str.replace('-', '')}{ARCHIVE_FILE_SUFFIX}")
+
+
+def list_device_days(raw_dir: str) -> list:
+    """Returns (device_id, date_str, day_dir) for every device-day directory, sorted."""
+    device_days = []
+    for day_dir in glob.glob(os.path.join(raw_dir, "*", "*")):
+        if os.path.isdir(day_dir):
+            device_days.append(
+                (os.path.basename(os.path.dirname(day_dir)), os.path.basename(day_dir), day_dir)
+            )
+    return sorted(device_days, key=lambda device_day: (device_day[1], device_day[0]))
+
+
+def raw_files_in(day_dir: str) -> list:
+    """The (unarchived) raw log files of a device-day directory."""
+    return sorted(f for f in glob.glob(os.path.join(day_dir, "*")) if f.endswith(RAW_FILE_SUFFIXES))
+
+
+def _sql_list(items: list) -> str:
+    return "[" + ", ".join(f"'{item}'" for item in items) + "]"
+
+
+def raw_logs_source_sql(raw_files: list, archive_files: list, shadowed_files: list = None) -> str:
+    """
+    SELECT over raw files and device-day archives with the same columns
+    (raw fields, value as VARCHAR, filename). Archived rows of a file that is
+    also present as a raw file are dropped, so the raw file wins; pass
+    `shadowed_files` when the raw files are read in separate queries.
+    """
+    if shadowed_files is None:
+        shadowed_files = raw_files
+    parts = []
+    if raw_files:
+        parts.append(f"""
+            SELECT * REPLACE (CAST(value AS VARCHAR) AS value)
+            FROM read_json_auto({_sql_list(raw_files)}, format='auto', filename=true)
+        """)
+    if archive_files:
+        exclude = f"WHERE NOT list_contains({_sql_list(shadowed_files)}, filename)" if shadowed_files else ""
+        parts.append(f"""
+            SELECT *
+            FROM read_parquet({_sql_list(archive_files)}, hive_partitioning=false, union_by_name=true)
+            {exclude}
+        """)
+    if not parts:
+        raise ValueError("raw_logs_source_sql needs at least one raw or archive file.")
+    return " UNION ALL BY NAME ".join(parts)
+
+
+def _rows_per_file(conn, source_sql: str) -> dict:
+    return dict(conn.execute(
+        f"SELECT filename, count(*) FROM ({source_sql}) GROUP BY filename"
+    ).fetchall())
+
+
+def archive_device_day(conn, day_dir: str, device_id: str, date_str: str) -> tuple:
+    """
+    Rolls a device-day's raw files (and any existing archive) into its archive,
+    verifies it and deletes the archived raw files.
+    Returns (raw_files_archived, archive_rows, archive_bytes); (0, 0, 0) if the
+    day has no raw files left to archive.
+    """
+    raw_files = raw_files_in(day_dir)
+    if not raw_files:
+        return 0, 0, 0
+    archive_path = archive_file_path(day_dir, device_id, date_str)
+    existing = [archive_path] if os.path.exists(archive_path) else []
+    source_sql = raw_logs_source_sql(raw_files, existing)
+    expected_rows = _rows_per_file(conn, source_sql)
+
+    tmp_path = f"{archive_path}.{os.getpid()}.tmp"
+    conn.execute(f"""
+        COPY (
+            SELECT * FROM ({source_sql})
+            ORDER BY event_time, code
+        ) TO '{tmp_path}' (FORMAT PARQUET, COMPRESSION ZSTD);
+    """)
+    archived_rows = _rows_per_file(
+        conn, f"SELECT filename FROM read_parquet('{tmp_path}', hive_partitioning=false)"
+    )
+    if archived_rows != expected_rows:
+        os.remove(tmp_path)
+        raise RuntimeError(
+            f"Archive verification failed for {day_dir}: "
+            f"expected {expected_rows}, archived {archived_rows}."
+        )
+    os.replace(tmp_path, archive_path)
+    for raw_file in raw_files:
+        os.remove(raw_file)
+    return len(raw_files), sum(archived_rows.values()), os.path.getsize(archive_path)
@@ -0,0 +1,169 @@
+"""
+Incremental writer for raw Tuya log files.
+
+Records are appended page by page as they arrive from the API, so memory use
+does not grow with the number of rows fetched for a device.
+
+Supported raw formats:
+- "json": legacy JSON array (*.json)
+- "ndjson": one compact JSON record per line (*.ndjson), optionally
+  compressed with gzip (*.ndjson.gz) or zstd (*.ndjson.zst)
+"""
+import os
+import gzip
+import json
+from datetime import datetime, timezone
+
+RAW_FORMATS = ("json", "ndjson")
+RAW_COMPRESSIONS = ("none", "gzip", "zstd")
+# File name suffixes of every raw format the staging step can read
+RAW_FILE_SUFFIXES = (".json", ".ndjson", ".ndjson.gz", ".ndjson.zst")
+
+
+def raw_file_suffix(raw_format: str, compression: str) -> str:
+    """Returns the file name suffix for a raw format and compression."""
+    if raw_format not in RAW_FORMATS:
+        raise ValueError(f"Unsupported raw format '{raw_format}'. Expected one of {RAW_FORMATS}.")
+    if compression not in RAW_COMPRESSIONS:
+        raise ValueError(
+            f"Unsupported raw compression '{compression}'. Expected one of {RAW_COMPRESSIONS}."
+        )
+    if raw_format == "json":
+        if compression != "none":
+            raise ValueError("Compression is only supported for the 'ndjson' raw format.")
+        return ".json"
+    return {"none": ".ndjson", "gzip": ".ndjson.gz", "zstd": ".ndjson.zst"}[compression]
+
+
+def _raw_file_stem(file_path: str) -> str:
+    """The path of a raw file without its format suffix (<dir>/<device_id>_<timestamp>_logs)."""
+    for suffix in sorted(RAW_FILE_SUFFIXES, key=len, reverse=True):
+        if file_path.endswith(suffix):
+            return file_path[:-len(suffix)]
+    return file_path
+
+
+def newest_raw_files(file_paths: list) -> list:
+    """
+    Keeps the most recently written raw file of each device and timestamp.
+    A change of raw format or compression between runs could otherwise leave
+    two files for the same hour, whose rows would be read twice.
+    """
+    newest = {}
+    for file_path in file_paths:
+        stem = _raw_file_stem(file_path)
+        if stem not in newest or os.path.getmtime(file_path) > os.path.getmtime(newest[stem]):
+            newest[stem] = file_path
+    return sorted(newest.values())
+
+
+def _open_text(file_path: str, compression: str):
+    """Opens a file for text writing with the requested compression."""
+    if compression == "gzip":
+        return gzip.open(file_path, 'wt', encoding='utf-8')
+    if compression == "zstd":
+        try:
+            import zstandard # pylint: disable=import-outside-toplevel # Optional dependency
+        except ImportError as e:
+            raise ImportError(
+                "zstd raw compression requires the 'zstandard' package."
+            ) from e
+        return zstandard.open(file_path, 'wt', encoding='utf-8')
+    return open(file_path, 'w', encoding='utf-8')
+
+
+class RawLogWriter:
+    """
+    Streams enriched log records for one device into
+    <base_output_dir>/<device_id>/<YYYY-MM-DD>/<device_id>_<timestamp>_logs<suffix>
+    where <suffix> depends on the format and compression (see raw_file_suffix).
+
+    The file is opened lazily on the first record and written under a temporary
+    name, so readers globbing for raw files never see a half-written file;
+    closing it removes the same device and timestamp's files in other formats.
+    Its date folder and timestamp come from `file_time` when given (e.g. the
+    start of a partition, so a re-run replaces the same file), otherwise from
+    the first record's event_time.
+    """
+
+    def __init__(
+        self,
+        base_output_dir: str,
+        device_id: str,
+        extra_fields: dict,
+        raw_format: str = "json",
+        compression: str = "none",
+        file_time: datetime = None
+    ):
+        self.base_output_dir = base_output_dir
+        self.device_id = device_id
+        self.raw_format = raw_format
+        self.compression = compression
+        self.suffix = raw_file_suffix(raw_format, compression)
+        self.file_time = file_time
+        # Fields added to every record (device_id and lineage columns)
+        self.extra_fields = {"device_id": device_id, **extra_fields}
+        self.output_file_path = None
+        self.records_written = 0
+        self._tmp_path = None
+        self._file = None
+
+    def _open(self, first_log: dict):
+        dt_object = self.file_time
+        if dt_object is None:
+            first_log_time_sec = first_log.get('event_time', 0) / 1000
+            dt_object = datetime.fromtimestamp(first_log_time_sec, timezone.utc)
+        date_folder_str = dt_object.strftime('%Y-%m-%d')
+        timestamp_str = dt_object.strftime('%Y%m%d%H%M%S')
+
+        # Path: data/raw/<device_id>/<YYYY-MM-DD>/
+        date_specific_output_dir = os.path.join(
+            self.base_output_dir, self.device_id, date_folder_str
+        )
+        os.makedirs(date_specific_output_dir, exist_ok=True)
+
+        file_name = f"{self.device_id}_{timestamp_str}_logs{self.suffix}"
+        self.output_file_path = os.path.join(date_specific_output_dir, file_name)
+        self._tmp_path = f"{self.output_file_path}.tmp"
+        self._file = _open_text(self._tmp_path, self.compression)
+        if self.raw_format == "json":
+            self._file.write("[")
+
+    def write(self, logs: list):
+        """Appends a page of logs, enriched with the extra fields."""
+        if not logs:
+            return
+        if self._file is None:
+            self._open(logs[0])
+        for log in logs:
+            record = json.dumps({**log, **self.extra_fields}, ensure_ascii=False)
+            if self.raw_format == "json":
+                separator = "\n" if self.records_written == 0 else ",\n"
+                self._file.write(separator + record)
+            else:
+                self._file.write(record + "\n")
+            self.records_written += 1
+
+    def close(self):
+        """Finalizes the file and moves it into place. Returns its path, or None if empty."""
+        if self._file is None:
+            return None
+        if self.raw_format == "json":
+            self._file.write("\n]\n")
+        self._file.close()
+        self._file = None
+        os.replace(self._tmp_path, self.output_file_path)
+        # A previous run with another raw format or compression wrote the same rows
+        stem = _raw_file_stem(self.output_file_path)
+        for suffix in RAW_FILE_SUFFIXES:
+            if suffix != self.suffix and os.path.exists(stem + suffix):
+                os.remove(stem + suffix)
+        return self.output_file_path
+
+    def abort(self):
+        """Discards a partially written file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._tmp_path and os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
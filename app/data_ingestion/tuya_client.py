@@ -0,0 +1,142 @@
+"""
+Dagster resource owning the Tuya OpenAPI client.
+
+Building a TuyaOpenAPI and calling connect() costs a token handshake on every
+run. TuyaOpenAPIResource instead hands out one client per process (per
+endpoint and access id) whose HTTP session keeps pooled keep-alive connections,
+and persists the access token to a JSON file. Dagster's default executor runs
+each step in its own process, so the file (not the in-process client) is what
+later runs reuse.
+
+A token is only handed out if it stays valid for at least
+`min_token_lifetime_seconds` (longer than a run takes); otherwise a new token
+is requested up front, under the clients lock. tuya_connector refreshes a
+token itself 60 s before it expires, but not safely while many fetch threads
+share the client, so that refresh must not be needed during a run. Tokens the
+client still refreshed during a run are written back when the run ends.
+
+The token file is a JSON document of the form:
+{"endpoint": ..., "access_id": ..., "access_token": ..., "refresh_token": ...,
+ "expire_time": <unix ms>, "uid": ...}
+"""
+import os
+import json
+import threading
+import time
+from dagster import ConfigurableResource, InitResourceContext
+from requests.adapters import HTTPAdapter
+from tuya_connector import TuyaOpenAPI
+from tuya_connector.openapi import TuyaTokenInfo
+
+DEFAULT_TOKEN_CACHE_PATH = "data/state/tuya_token.json"
+# Enough pooled connections for the concurrent fetch workers (requests defaults to 10)
+DEFAULT_POOL_MAXSIZE = 32
+# Tokens with less validity left than this are replaced before a run starts
+# (Tuya tokens last 2 hours; an hourly run must finish well within this)
+DEFAULT_MIN_TOKEN_LIFETIME_SECONDS = 30 * 60
+
+# One client per (endpoint, access_id) in this process, shared across runs
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _token_is_fresh(token_info, min_lifetime_seconds: float) -> bool:
+    return (
+        token_info is not None
+        and bool(token_info.access_token)
+        and token_info.expire_time - min_lifetime_seconds * 1000 > time.time() * 1000
+    )
+
+
+def load_token_info(file_path: str, endpoint: str, access_id: str):
+    """Returns the persisted TuyaTokenInfo for this endpoint/access id, or None."""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as token_file:
+            stored = json.load(token_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if stored.get("endpoint") != endpoint or stored.get("access_id") != access_id:
+        return None
+    token_info = TuyaTokenInfo({"result": {}})
+    token_info.access_token = stored.get("access_token", "")
+    token_info.refresh_token = stored.get("refresh_token", "")
+    token_info.expire_time = stored.get("expire_time", 0)
+    token_info.uid = stored.get("uid", "")
+    return token_info
+
+
+def save_token_info(file_path: str, endpoint: str, access_id: str, token_info):
+    """Atomically writes the token to a file readable only by the current user."""
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    file_descriptor = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(file_descriptor, 'w', encoding='utf-8') as token_file:
+        json.dump({
+            "endpoint": endpoint,
+            "access_id": access_id,
+            "access_token": token_info.access_token,
+            "refresh_token": token_info.refresh_token,
+            "expire_time": token_info.expire_time,
+            "uid": token_info.uid,
+        }, token_file, indent=4)
+    os.replace(tmp_path, file_path)
+
+
+class TuyaOpenAPIResource(ConfigurableResource):
+    """Provides a connected, pooled TuyaOpenAPI client with a persisted token."""
+
+    access_id: str
+    access_secret: str
+    api_endpoint: str
+    token_cache_path: str = DEFAULT_TOKEN_CACHE_PATH
+    pool_maxsize: int = DEFAULT_POOL_MAXSIZE
+    # Validity a token must have left when a run starts (see module docstring)
+    min_token_lifetime_seconds: int = DEFAULT_MIN_TOKEN_LIFETIME_SECONDS
+
+    def _new_client(self) -> TuyaOpenAPI:
+        client = TuyaOpenAPI(self.api_endpoint, self.access_id, self.access_secret)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+        client.session.mount("https://", adapter)
+        client.session.mount("http://", adapter)
+        return client
+
+    def get_client(self) -> TuyaOpenAPI:
+        """
+        Returns the process-wide client, reusing its current token, a persisted
+        token, or (if neither stays valid for min_token_lifetime_seconds)
+        performing a new token handshake. Raises ConnectionError if the
+        handshake fails.
+        """
+        key = (self.api_endpoint, self.access_id)
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = self._new_client()
+            if _token_is_fresh(client.token_info, self.min_token_lifetime_seconds):
+                return client
+            stored_token = load_token_info(self.token_cache_path, *key)
+            if _token_is_fresh(stored_token, self.min_token_lifetime_seconds):
+                print("Reusing persisted Tuya access token.")
+                client.token_info = stored_token
+                return client
+            print("Requesting a new Tuya access token...")
+            # The token request is signed with any access token still set, as in
+            # tuya_connector's own re-connect path, which clears it first
+            client.token_info = None
+            response = client.connect()
+            if not response or not response.get("success", False):
+                raise ConnectionError(f"Tuya token request failed: {response}")
+            save_token_info(self.token_cache_path, *key, client.token_info)
+            return client
+
+    def teardown_after_execution(self, context: InitResourceContext) -> None:
+        # Persist a token the client refreshed on its own during the run
+        with _clients_lock:
+            client = _clients.get((self.api_endpoint, self.access_id))
+        if client is None or not _token_is_fresh(client.token_info, 0):
+            return
+        stored_token = load_token_info(self.token_cache_path, self.api_endpoint, self.access_id)
+        if stored_token is None or stored_token.access_token != client.token_info.access_token:
+            save_token_info(
+                self.token_cache_path, self.api_endpoint, self.access_id, client.token_info
+            )
@@ -0,0 +1,128 @@
+"""
+Persisted per-device fetch state for Tuya log ingestion.
+
+The state file is a JSON document of the form:
+{
+    "<device_id>": {
+        "fetched_until_ms": <end of the last fully fetched window>,
+        "codes": {"<code>": <last ingested event_time in ms>, ...},
+        "records_per_hour": <smoothed log volume of complete fetches>
+    },
+    ...
+}
+The micro-batch cursor uses the high-water marks (fetched_until_ms and codes)
+to fetch only what is new. The hourly path fetches whole partitions, so its
+state file only keeps records_per_hour (for adaptive time slicing); hours it
+missed are requested again by the catch-up sensor.
+"""
+import os
+import json
+
+# Weight of the latest fetch in the smoothed records_per_hour estimate
+VOLUME_SMOOTHING = 0.5
+
+
+def load_watermarks(file_path: str) -> dict:
+    """Loads the watermark state, returning an empty state if none exists yet."""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as state_file:
+            state = json.load(state_file)
+        print(f"Loaded watermarks for {len(state)} devices from {file_path}")
+        return state
+    except FileNotFoundError:
+        print(f"No watermark state found at {file_path}. Starting fresh.")
+        return {}
+    except json.JSONDecodeError:
+        print(f"Error: Could not decode watermark state at {file_path}. Starting fresh.")
+        return {}
+
+
+def _merge_watermarks(state: dict, other: dict):
+    """Merges `other` into `state`, keeping the most advanced mark of each entry."""
+    for device_id, other_device in other.items():
+        device_state = state.setdefault(device_id, {})
+        if "codes" in other_device:
+            code_marks = device_state.setdefault("codes", {})
+            for code, event_time in other_device["codes"].items():
+                code_marks[code] = max(event_time, code_marks.get(code, -1))
+        if "fetched_until_ms" in other_device:
+            device_state["fetched_until_ms"] = max(
+                other_device["fetched_until_ms"], device_state.get("fetched_until_ms", 0)
+            )
+        if "records_per_hour" in other_device:
+            # Keep this run's estimate when it has one
+            device_state.setdefault("records_per_hour", other_device["records_per_hour"])
+
+
+def save_watermarks(file_path: str, state: dict):
+    """
+    Atomically writes the watermark state (write to temp file, then rename).
+    The state on disk is merged in first, so concurrent runs (e.g. partitions of
+    a backfill) never move a watermark backwards.
+    """
+    try:
+        with open(file_path, 'r', encoding='utf-8') as state_file:
+            _merge_watermarks(state, json.load(state_file))
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as state_file:
+        json.dump(state, state_file, indent=4, sort_keys=True)
+        state_file.flush()
+        os.fsync(state_file.fileno())
+    os.replace(tmp_path, file_path)
+
+
+def get_fetch_start_ms(state: dict, device_id: str, default_start_ms: int) -> int:
+    """
+    Returns the start of the fetch window for a device: its last fully fetched
+    point, or `default_start_ms` for devices never fetched before.
+    """
+    fetched_until_ms = state.get(device_id, {}).get("fetched_until_ms")
+    return fetched_until_ms if fetched_until_ms is not None else default_start_ms
+
+
+def filter_new_logs(state: dict, device_id: str, logs: list) -> list:
+    """Drops logs at or before the per-code watermark (window boundary overlap)."""
+    code_marks = state.get(device_id, {}).get("codes", {})
+    return [
+        log for log in logs
+        if log.get("event_time", 0) > code_marks.get(log.get("code"), -1)
+    ]
+
+
+def advance_watermark(state: dict, device_id: str, fetched_until_ms: int, logs: list):
+    """Advances a device's watermarks in `state` after its logs were persisted."""
+    device_state = state.setdefault(device_id, {"codes": {}})
+    code_marks = device_state.setdefault("codes", {})
+    for log in logs:
+        code = log.get("code")
+        event_time = log.get("event_time", 0)
+        if code and event_time > code_marks.get(code, -1):
+            code_marks[code] = event_time
+    device_state["fetched_until_ms"] = max(
+        fetched_until_ms, device_state.get("fetched_until_ms", 0)
+    )
+
+
+def expected_records(state: dict, device_id: str, window_ms: int) -> float:
+    """Expected number of logs of a device over a window, from its volume history."""
+    records_per_hour = state.get(device_id, {}).get("records_per_hour")
+    if records_per_hour is None:
+        return 0.0
+    return records_per_hour * window_ms / (3600 * 1000)
+
+
+def record_fetch_volume(state: dict, device_id: str, records: int, window_ms: int):
+    """Folds a complete fetch's log count into the device's records_per_hour estimate."""
+    if window_ms <= 0:
+        return
+    device_state = state.setdefault(device_id, {})
+    observed = records * 3600 * 1000 / window_ms
+    previous = device_state.get("records_per_hour")
+    device_state["records_per_hour"] = round(
+        observed if previous is None
+        else VOLUME_SMOOTHING * observed + (1 - VOLUME_SMOOTHING) * previous,
+        1,
+    )
@@ -0,0 +1,2 @@
+
+# This file is intentionally left blank to mark the directory as a Python package.
\ No newline at end of file
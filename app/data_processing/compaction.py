@@ -0,0 +1,147 @@
+"""
+Small-file compaction for the Hive-partitioned staging Parquet dataset.
+
+Each closed data/staging/event_date=<YYYY-MM-DD>/ directory is rewritten into a
+single file (COMPACTED_FILE_NAME) sorted by device_id, code, event_time. The
+compacted file is written next to the files it replaces and renamed into
+place; afterwards exactly the input files the rewrite read are deleted, so the
+partition directory itself never disappears. Writers of a partition (hourly
+staging, micro-batches, compaction) serialize through partition_lock, so no
+file can be replaced between the rewrite reading it and its deletion.
+
+A swap replaces several files one after the other, so readers hold shared
+locks on the partitions they list and read (read_partitions): a reader
+otherwise listing a partition mid-swap reads the compacted rows next to the
+files they replace, or fails on a file deleted under it. Ad-hoc readers of
+event_date=*/*.parquet should do the same, e.g.
+    with read_partitions(glob.glob("app/data/staging/event_date=*")):
+        duckdb.sql("SELECT ... FROM 'app/data/staging/event_date=*/*.parquet'")
+"""
+import os
+import re
+import glob
+import fcntl
+from contextlib import contextmanager, ExitStack
+
+COMPACTED_FILE_NAME = "data_compacted.parquet"
+DEFAULT_ROW_GROUP_SIZE = 250_000
+# Lock file serializing the writers of one partition against each other and
+# against its readers (not a .parquet file, so readers and compaction ignore it)
+PARTITION_LOCK_FILE_NAME = ".partition.lock"
+# data_<YYYYMMDDHHMMSS>.parquet and microbatch_<YYYYMMDDHHMMSS>_<batch>.parquet
+_HOUR_FILE_PATTERN = re.compile(r"^data_(\d{14})\.parquet$")
+_MICROBATCH_FILE_PATTERN = re.compile(r"^microbatch_(\d{14})_\d+\.parquet$")
+
+
+@contextmanager
+def partition_lock(partition_dir: str, shared: bool = False):
+    """
+    Inter-process lock on a staging partition's files: exclusive for writers,
+    shared (`shared=True`) for readers of an existing partition.
+    """
+    if not shared:
+        os.makedirs(partition_dir, exist_ok=True)
+    with open(os.path.join(partition_dir, PARTITION_LOCK_FILE_NAME), 'a', encoding='utf-8') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def read_partitions(partition_dirs):
+    """
+    Holds shared locks on the existing partitions among `partition_dirs` (in
+    sorted order), so no writer swaps their files while the caller lists and
+    reads them. Must not be nested with partition_lock in the same process.
+    """
+    with ExitStack() as stack:
+        for partition_dir in sorted(set(partition_dirs)):
+            if os.path.isdir(partition_dir):
+                stack.enter_context(partition_lock(partition_dir, shared=True))
+        yield
+
+
+def list_partition_dirs(staging_dir: str) -> list:
+    """Returns (event_date, path) for every event_date partition, sorted by date."""
+    partitions = []
+    for path in glob.glob(os.path.join(staging_dir, "event_date=*")):
+        if os.path.isdir(path):
+            partitions.append((os.path.basename(path).split("=", 1)[1], path))
+    return sorted(partitions)
+
+
+def partition_file_stats(partition_dir: str) -> tuple:
+    """Returns (file_count, total_bytes) of the Parquet files in a partition."""
+    files = glob.glob(os.path.join(partition_dir, "*.parquet"))
+    return len(files), sum(os.path.getsize(f) for f in files)
+
+
+def superseded_microbatch_files(partition_dir: str) -> list:
+    """Micro-batch files of hours that already have their hourly data_<hour> file."""
+    names = os.listdir(partition_dir)
+    staged_hours = {m.group(1) for m in map(_HOUR_FILE_PATTERN.match, names) if m}
+    return sorted(
+        os.path.join(partition_dir, name) for name in names
+        if (m := _MICROBATCH_FILE_PATTERN.match(name)) and m.group(1) in staged_hours
+    )
+
+
+def compact_partition(conn, partition_dir: str, row_group_size: int) -> tuple:
+    """
+    Rewrites one partition into a single sorted Parquet file in place.
+    Micro-batch files of hours with an hourly file are dropped, not compacted.
+    Must be called under partition_lock(partition_dir).
+    Returns ((files_before, bytes_before), (files_after, bytes_after)).
+    """
+    before = partition_file_stats(partition_dir)
+    for file_path in superseded_microbatch_files(partition_dir):
+        os.remove(file_path)
+    input_files = sorted(glob.glob(os.path.join(partition_dir, "*.parquet")))
+    compacted_path = os.path.join(partition_dir, COMPACTED_FILE_NAME)
+    tmp_path = f"{compacted_path}.{os.getpid()}.tmp"
+    file_list = ", ".join(f"'{f}'" for f in input_files)
+    conn.execute(f"""
+        COPY (
+            SELECT *
+            FROM read_parquet([{file_list}], hive_partitioning=false, union_by_name=true)
+            ORDER BY device_id, code, event_time
+        ) TO '{tmp_path}' (
+            FORMAT PARQUET,
+            COMPRESSION ZSTD,
+            ROW_GROUP_SIZE {row_group_size}
+        );
+    """)
+
+    # Swap the compacted file in, then delete exactly the files it replaces
+    os.replace(tmp_path, compacted_path)
+    for file_path in input_files:
+        if file_path != compacted_path:
+            os.remove(file_path)
+    return before, partition_file_stats(partition_dir)
+
+
+def remove_range_from_compacted(conn, partition_dir: str, start_time_ms: int, end_time_ms: int):
+    """
+    Drops the rows in [start_time_ms, end_time_ms) from a partition's compacted
+    file, so a re-staged hour can be written next to it without duplicates.
+    Does nothing if the partition was never compacted. Must be called under
+    partition_lock(partition_dir).
+    """
+    compacted_path = os.path.join(partition_dir, COMPACTED_FILE_NAME)
+    if not os.path.exists(compacted_path):
+        return
+    tmp_path = f"{compacted_path}.tmp"
+    conn.execute(f"""
+        COPY (
+            SELECT *
+            FROM read_parquet('{compacted_path}', hive_partitioning=false)
+            WHERE NOT (
+                event_time >= to_timestamp({start_time_ms} / 1000)::TIMESTAMP
+                AND event_time < to_timestamp({end_time_ms} / 1000)::TIMESTAMP
+            )
+            ORDER BY device_id, code, event_time
+        ) TO '{tmp_path}' (FORMAT PARQUET, COMPRESSION ZSTD);
+    """)
+    os.replace(tmp_path, compacted_path)
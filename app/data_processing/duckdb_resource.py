@@ -0,0 +1,49 @@
+"""
+DuckDB resource with memory, thread and spill settings.
+
+TunedDuckDBResource is a DuckDBResource whose connections are configured with
+a memory limit, a thread count and a temp directory that DuckDB spills to when
+a query outgrows the memory limit, so large stagings and backfills stay within
+a small machine's RAM. Empty settings keep DuckDB's defaults (80% of RAM, one
+thread per core, no spilling for in-memory databases).
+
+Each process spills into its own subdirectory of `temp_directory`: DuckDB's
+temp files are not safe to share between processes.
+"""
+import os
+from contextlib import contextmanager
+from dagster_duckdb import DuckDBResource
+
+
+class TunedDuckDBResource(DuckDBResource):
+    """DuckDBResource applying memory_limit, threads and temp_directory to every connection."""
+    # DuckDB memory size, e.g. "2GB"; empty for DuckDB's default
+    memory_limit: str = ""
+    # Worker threads per connection; 0 for one per core
+    threads: int = 0
+    # Base directory for spill files; empty disables spilling of in-memory databases
+    temp_directory: str = ""
+    # Allows streaming writes without keeping rows in input order (lower memory)
+    preserve_insertion_order: bool = True
+
+    def duckdb_settings(self) -> dict:
+        """The settings applied to each connection (only those that are set)."""
+        settings = {"preserve_insertion_order": self.preserve_insertion_order}
+        if self.memory_limit:
+            settings["memory_limit"] = self.memory_limit
+        if self.threads > 0:
+            settings["threads"] = self.threads
+        if self.temp_directory:
+            settings["temp_directory"] = os.path.join(self.temp_directory, str(os.getpid()))
+        return settings
+
+    @contextmanager
+    def get_connection(self):
+        if self.temp_directory:
+            # DuckDB creates (and removes) the per-process directory, not its parents
+            os.makedirs(self.temp_directory, exist_ok=True)
+        with super().get_connection() as conn:
+            for name, value in self.duckdb_settings().items():
+                literal = f"'{value}'" if isinstance(value, str) else str(value).lower()
+                conn.execute(f"SET {name} = {literal}")
+            yield conn
@@ -0,0 +1,181 @@
+"""
+One-off migration of data written before hourly partitioning.
+
+The first version of the pipeline wrote
+- raw files named after their first event, spanning any number of hours:
+  data/raw/<device_id>/<YYYY-MM-DD>/<device_id>_<first-event-ts>_logs.json
+  (the hourly staging only globs <device_id>_<partition_start>_logs*, so these
+  are never staged again), and
+- staging files named by DuckDB's PARTITION_BY, holding a whole day:
+  data/staging/event_date=<YYYY-MM-DD>/data_0.parquet (or data_<uuid>.parquet)
+  (next to the hourly data_<YYYYMMDDHHMMSS>.parquet files they duplicate rows).
+
+This script splits each device's legacy raw files into one raw file per event
+hour (deduplicated; hours that already have an hourly raw file are left to
+it), deletes the legacy raw files and their staging manifest entries, deletes
+the legacy staging files, and prints the hourly partitions to restage. Legacy
+files already rolled into a device-day archive are not split.
+
+Restage the printed partitions with a backfill of tuya_processing_job: hours
+past Tuya's log retention fetch nothing, which keeps the migrated raw files.
+
+Usage (from the repository root, with Dagster stopped):
+    python -m app.data_processing.legacy_layout --dry-run
+    python -m app.data_processing.legacy_layout
+"""
+import os
+import re
+import json
+import glob
+import argparse
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from app import assets as pipeline
+from app.data_ingestion.raw_log_writer import RawLogWriter, RAW_FILE_SUFFIXES
+from app.data_processing.compaction import list_partition_dirs, partition_lock
+from app.data_processing.staging_manifest import forget_files
+
+# Files written by the hourly pipeline (see raw_tuya_logs, staging and compaction)
+_CURRENT_STAGING_FILE_PATTERN = re.compile(
+    r"^(data_\d{14}|data_compacted|microbatch_\d{14}_\d+)\.parquet$"
+)
+_RAW_FILE_STAMP_PATTERN = re.compile(r"_(\d{14})_logs\.")
+
+
+def _hour_of(event_time_ms: int) -> datetime:
+    return datetime.fromtimestamp(event_time_ms / 1000, timezone.utc).replace(
+        minute=0, second=0, microsecond=0
+    )
+
+
+def _load_json_logs(file_path: str) -> list:
+    with open(file_path, 'r', encoding='utf-8') as raw_file:
+        return json.load(raw_file)
+
+
+def is_legacy_raw_file(file_path: str, logs: list) -> bool:
+    """A .json raw file is legacy unless it is named after one hour holding all its logs."""
+    match = _RAW_FILE_STAMP_PATTERN.search(os.path.basename(file_path))
+    if not match:
+        return True
+    stamp = datetime.strptime(match.group(1), '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
+    return any(_hour_of(log.get("event_time", 0)) != stamp for log in logs)
+
+
+def hourly_raw_files(raw_dir: str, device_id: str, hour_start: datetime) -> list:
+    """The hourly raw files of a device and hour, in any raw format."""
+    pattern = os.path.join(
+        raw_dir, device_id, hour_start.strftime('%Y-%m-%d'),
+        f"{device_id}_{pipeline.partition_hour_stamp(hour_start)}_logs*",
+    )
+    return [f for f in glob.glob(pattern) if f.endswith(RAW_FILE_SUFFIXES)]
+
+
+def split_legacy_raw_files(raw_dir: str, raw_format: str, compression: str, dry_run: bool) -> tuple:
+    """
+    Splits every device's legacy raw files into hourly raw files.
+    Returns (legacy files, number of device-hours written, their hours as datetimes).
+    """
+    legacy_files, device_hours, hours_written = [], 0, set()
+    for device_dir in sorted(glob.glob(os.path.join(raw_dir, "*"))):
+        if not os.path.isdir(device_dir):
+            continue
+        device_id = os.path.basename(device_dir)
+        device_legacy_files = []
+        logs_by_hour = defaultdict(dict)
+        for file_path in sorted(glob.glob(os.path.join(device_dir, "*", "*.json"))):
+            logs = _load_json_logs(file_path)
+            if not is_legacy_raw_file(file_path, logs):
+                continue
+            device_legacy_files.append(file_path)
+            for log in logs:
+                # Overlapping fetch windows stored the same event more than once
+                key = (log.get("code"), log.get("event_time"), json.dumps(log.get("value")))
+                logs_by_hour[_hour_of(log.get("event_time", 0))].setdefault(key, log)
+
+        for hour_start, logs in sorted(logs_by_hour.items()):
+            existing = [
+                f for f in hourly_raw_files(raw_dir, device_id, hour_start)
+                if f not in device_legacy_files
+            ]
+            if existing:
+                continue # The hourly pipeline already fetched this hour
+            device_hours += 1
+            hours_written.add(hour_start)
+            if dry_run:
+                continue
+            writer = RawLogWriter(raw_dir, device_id, {}, raw_format, compression, hour_start)
+            writer.write(sorted(logs.values(), key=lambda log: log.get("event_time", 0)))
+            writer.close()
+
+        if not dry_run:
+            for file_path in device_legacy_files:
+                os.remove(file_path)
+        legacy_files.extend(device_legacy_files)
+    return legacy_files, device_hours, hours_written
+
+
+def remove_legacy_staging_files(staging_dir: str, dry_run: bool) -> list:
+    """Deletes the whole-day staging files of the first pipeline version. Returns their paths."""
+    removed = []
+    for _, partition_dir in list_partition_dirs(staging_dir):
+        legacy_files = sorted(
+            f for f in glob.glob(os.path.join(partition_dir, "*.parquet"))
+            if not _CURRENT_STAGING_FILE_PATTERN.match(os.path.basename(f))
+        )
+        if legacy_files and not dry_run:
+            with partition_lock(partition_dir):
+                for file_path in legacy_files:
+                    os.remove(file_path)
+        removed.extend(legacy_files)
+    return removed
+
+
+def parse_args(argv=None):
+    app_dir = os.path.dirname(os.path.abspath(pipeline.__file__))
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--raw-dir", default=os.path.join(app_dir, pipeline.BASE_OUTPUT_DIR), help="Raw layer directory")
+    parser.add_argument("--staging-dir", default=os.path.join(app_dir, pipeline.STAGING_DIR), help="Staging layer directory")
+    parser.add_argument("--manifest-path", default=os.path.join(app_dir, pipeline.STAGING_MANIFEST_PATH), help="Staging manifest file")
+    parser.add_argument("--raw-format", default=pipeline.DEFAULT_RAW_FORMAT, help="Format of the hourly raw files written")
+    parser.add_argument("--raw-compression", default=pipeline.DEFAULT_RAW_COMPRESSION, help="Compression of the hourly raw files written")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    legacy_raw_files, device_hours, hours_written = split_legacy_raw_files(
+        args.raw_dir, args.raw_format, args.raw_compression, args.dry_run
+    )
+    if legacy_raw_files and not args.dry_run:
+        forget_files(args.manifest_path, args.raw_dir, legacy_raw_files)
+    legacy_staging_files = remove_legacy_staging_files(args.staging_dir, args.dry_run)
+
+    # Hours to restage: those with new raw files, and every hour of the days whose
+    # legacy staging file went away (their raw data may sit in archives)
+    candidate_hours = set(hours_written)
+    for file_path in legacy_staging_files:
+        day_start = datetime.strptime(
+            os.path.basename(os.path.dirname(file_path))[len("event_date="):], '%Y-%m-%d'
+        ).replace(tzinfo=timezone.utc)
+        candidate_hours.update(day_start + timedelta(hours=hour) for hour in range(24))
+    restage_hours = {
+        hour_start for hour_start in candidate_hours
+        if hour_start < datetime.now(timezone.utc)
+        and not pipeline.hour_is_staged(args.staging_dir, hour_start)
+    }
+
+    action = "Would migrate" if args.dry_run else "Migrated"
+    print(f"{action} {len(legacy_raw_files)} legacy raw files into {device_hours} device-hours.")
+    print(f"{action} {len(legacy_staging_files)} legacy staging files (deleted).")
+    partition_keys = sorted(hour_start.strftime('%Y-%m-%d-%H:%M') for hour_start in restage_hours)
+    if partition_keys:
+        print(f"Backfill tuya_processing_job for these {len(partition_keys)} partitions:")
+        for partition_key in partition_keys:
+            print(f"  {partition_key}")
+
+
+if __name__ == "__main__":
+    main()
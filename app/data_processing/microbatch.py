@@ -0,0 +1,99 @@
+"""
+Near-real-time micro-batches appended to the staging dataset.
+
+Each micro-batch writes the new logs of one hour to its own small file next
+to the hourly files:
+data/staging/event_date=<YYYY-MM-DD>/microbatch_<hour_start>_<batch_time>.parquet
+with the same columns as the hourly staging files. Micro-batch files are
+provisional: when the hourly staging asset stages an hour it removes that
+hour's micro-batch files, as the hourly file holds the same (complete) data.
+"""
+import os
+import glob
+import json
+from datetime import datetime, timezone
+import pandas as pd
+
+from app.data_processing.staging_schema import staged_columns_sql, code_schema_join_sql
+
+MICROBATCH_FILE_PREFIX = "microbatch_"
+MICROBATCH_LOGS_VIEW = "microbatch_logs_view"
+
+
+def microbatch_files(partition_dir: str, hour_stamp: str) -> list:
+    """Returns the micro-batch files of one hour (hour_stamp as in the hourly file name)."""
+    return sorted(glob.glob(os.path.join(partition_dir, f"{MICROBATCH_FILE_PREFIX}{hour_stamp}_*.parquet")))
+
+
+def remove_microbatch_files(partition_dir: str, hour_stamp: str) -> int:
+    """Deletes one hour's micro-batch files. Returns the number removed."""
+    removed = 0
+    for file_path in microbatch_files(partition_dir, hour_stamp):
+        try:
+            os.remove(file_path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def microbatch_logs_frame(logs_by_device: dict, lineage_fields: dict) -> pd.DataFrame:
+    """Flattens {device_id: [log, ...]} into raw-log rows with the lineage fields."""
+    rows = [
+        {
+            "code": log.get("code"),
+            "value": log.get("value") if isinstance(log.get("value"), str) else json.dumps(log.get("value")),
+            "device_id": device_id,
+            "event_time": int(log.get("event_time", 0)),
+            **lineage_fields,
+        }
+        for device_id, logs in logs_by_device.items()
+        for log in logs
+    ]
+    columns = ["code", "value", "device_id", "event_time", *lineage_fields]
+    return pd.DataFrame(rows, columns=columns).astype({"event_time": "int64"})
+
+
+def write_microbatch_files(
+    conn,
+    staging_dir: str,
+    logs_df: pd.DataFrame,
+    device_name_sql: str,
+    device_map_join_sql: str,
+    batch_time: datetime
+) -> list:
+    """
+    Writes the logs (a microbatch_logs_frame) to one micro-batch file per hour
+    they fall in. The code schema view, and the device map view if
+    `device_map_join_sql` joins it, must already be registered on `conn`.
+    Returns the (hour_start, path, rows) of each file written.
+    """
+    if logs_df.empty:
+        return []
+    conn.register(MICROBATCH_LOGS_VIEW, logs_df)
+    hour_ms = 3600 * 1000
+    batch_stamp = batch_time.strftime('%Y%m%d%H%M%S%f')
+    written = []
+    for hour_start_ms in sorted({t - t % hour_ms for t in logs_df["event_time"]}):
+        hour_start = datetime.fromtimestamp(hour_start_ms / 1000, tz=timezone.utc)
+        partition_dir = os.path.join(staging_dir, f"event_date={hour_start.strftime('%Y-%m-%d')}")
+        os.makedirs(partition_dir, exist_ok=True)
+        output_path = os.path.join(
+            partition_dir,
+            f"{MICROBATCH_FILE_PREFIX}{hour_start.strftime('%Y%m%d%H%M%S')}_{batch_stamp}.parquet",
+        )
+        tmp_path = f"{output_path}.tmp"
+        conn.execute(f"""
+            COPY (
+                SELECT {staged_columns_sql(device_name_sql)}
+                FROM {MICROBATCH_LOGS_VIEW} rl
+                {device_map_join_sql}
+                {code_schema_join_sql()}
+                WHERE rl.event_time >= {hour_start_ms} AND rl.event_time < {hour_start_ms + hour_ms}
+            ) TO '{tmp_path}' (FORMAT PARQUET);
+        """)
+        rows = conn.execute(f"SELECT count(*) FROM read_parquet('{tmp_path}')").fetchone()[0]
+        os.replace(tmp_path, output_path)
+        written.append((hour_start, output_path, rows))
+    conn.unregister(MICROBATCH_LOGS_VIEW)
+    return written
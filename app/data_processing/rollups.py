@@ -0,0 +1,219 @@
+"""
+Per-device, per-code hourly and daily rollups of the staged Tuya logs.
+
+Hourly rollups are computed from one hour of staged data; daily rollups are
+merged from the day's hourly rollups, so every run only recomputes the
+buckets it touches. Each bucket is written to its own Parquet file:
+data/rollups/hourly/event_date=<YYYY-MM-DD>/rollup_<YYYYMMDDHHMMSS>.parquet
+data/rollups/daily/event_month=<YYYY-MM>/rollup_<YYYY-MM-DD>.parquet
+
+Rollup columns:
+device_id, code, bucket_start, event_count, numeric_count, min_value,
+max_value, sum_value, mean_value, last_value, last_event_time, on_seconds
+(on_seconds is only set for boolean codes such as switch_1).
+The numeric columns aggregate the scaled value_double (e.g. cur_power in W)
+and on_seconds follows value_bool; files staged before the typed columns
+existed fall back to parsing `value` (see typed_values).
+"""
+from app.data_processing.typed_values import (
+    has_typed_value_columns,
+    value_double_sql,
+    value_bool_sql,
+)
+
+
+def _ms_to_timestamp_sql(time_ms: int) -> str:
+    """SQL expression matching how staging converts event_time (ms) to TIMESTAMP."""
+    return f"to_timestamp({time_ms} / 1000)::TIMESTAMP"
+
+
+def _files_sql(file_paths: list) -> str:
+    return "[" + ", ".join(f"'{f}'" for f in file_paths) + "]"
+
+
+def compute_hourly_rollup(
+    conn,
+    source_path: str,
+    start_time_ms: int,
+    end_time_ms: int,
+    previous_rollup_paths: list,
+    output_path: str,
+    previous_staging_files: list = None,
+    state_since_ms: int = None
+):
+    """
+    Aggregates the events in [start_time_ms, end_time_ms) of a staged Parquet
+    file (None if the hour has no staged data) into one row per device and
+    code, written to `output_path`.
+
+    Boolean codes also get on_seconds: the time within the hour their value was
+    true. The state at the start of the hour is the latest boolean event in
+    `previous_staging_files` (staged files covering the hours since
+    `state_since_ms`), or, for codes with no event in that window, the latest
+    last_value found in `previous_rollup_paths` (earlier hourly rollups). The
+    staged events make the state independent of the order in which hours are
+    materialized. Codes whose state is known but that had no events this hour
+    are carried forward with event_count 0.
+    """
+    bucket_start = _ms_to_timestamp_sql(start_time_ms)
+    bucket_end = _ms_to_timestamp_sql(end_time_ms)
+    state_sources = []
+    if previous_rollup_paths:
+        state_sources.append(f"""
+            SELECT device_id, code, last_value, last_event_time
+            FROM read_parquet({_files_sql(previous_rollup_paths)}, hive_partitioning=false)
+            WHERE on_seconds IS NOT NULL
+        """)
+    if previous_staging_files:
+        typed = has_typed_value_columns(conn, previous_staging_files)
+        since_filter = (
+            f"AND event_time >= {_ms_to_timestamp_sql(state_since_ms)}"
+            if state_since_ms is not None else ""
+        )
+        state_sources.append(f"""
+            SELECT
+                device_id,
+                code,
+                CAST({value_bool_sql(typed)} AS VARCHAR) AS last_value,
+                event_time AS last_event_time
+            FROM read_parquet(
+                {_files_sql(previous_staging_files)}, hive_partitioning=false, union_by_name=true
+            )
+            WHERE event_time < {bucket_start} {since_filter}
+                AND {value_bool_sql(typed)} IS NOT NULL
+        """)
+    if state_sources:
+        previous_state_sql = f"""
+            SELECT
+                device_id,
+                code,
+                arg_max(last_value, last_event_time) AS last_value,
+                max(last_event_time) AS last_event_time
+            FROM ({" UNION ALL ".join(state_sources)})
+            GROUP BY device_id, code
+        """
+    else:
+        previous_state_sql = """
+            SELECT NULL::VARCHAR AS device_id, NULL::VARCHAR AS code,
+                   NULL::VARCHAR AS last_value, NULL::TIMESTAMP AS last_event_time
+            WHERE false
+        """
+
+    if source_path is not None:
+        typed = has_typed_value_columns(conn, [source_path])
+        events_sql = f"""
+            SELECT
+                device_id,
+                code,
+                event_time,
+                CAST(value AS VARCHAR) AS value,
+                {value_double_sql(typed)} AS value_double,
+                {value_bool_sql(typed)} AS value_bool
+            FROM read_parquet('{source_path}', hive_partitioning=false)
+            WHERE event_time >= {bucket_start} AND event_time < {bucket_end}
+        """
+    else:
+        events_sql = """
+            SELECT NULL::VARCHAR AS device_id, NULL::VARCHAR AS code,
+                   NULL::TIMESTAMP AS event_time, NULL::VARCHAR AS value,
+                   NULL::DOUBLE AS value_double, NULL::BOOLEAN AS value_bool
+            WHERE false
+        """
+
+    conn.execute(f"""
+        COPY (
+            WITH events AS ({events_sql}),
+            previous_state AS ({previous_state_sql}),
+            stats AS (
+                SELECT
+                    device_id,
+                    code,
+                    count(*) AS event_count,
+                    count(value_double) AS numeric_count,
+                    min(value_double) AS min_value,
+                    max(value_double) AS max_value,
+                    sum(value_double) AS sum_value,
+                    avg(value_double) AS mean_value,
+                    arg_max(value, event_time) AS last_value,
+                    max(event_time) AS last_event_time
+                FROM events
+                GROUP BY device_id, code
+            ),
+            bool_points AS (
+                SELECT device_id, code, event_time, value_bool AS state
+                FROM events
+                WHERE value_bool IS NOT NULL
+                UNION ALL
+                SELECT device_id, code, {bucket_start} AS event_time, lower(last_value) = 'true' AS state
+                FROM previous_state
+                WHERE lower(last_value) IN ('true', 'false')
+            ),
+            bool_segments AS (
+                SELECT
+                    device_id,
+                    code,
+                    state,
+                    event_time,
+                    lead(event_time, 1, {bucket_end}) OVER (
+                        PARTITION BY device_id, code ORDER BY event_time
+                    ) AS next_time
+                FROM bool_points
+            ),
+            on_time AS (
+                SELECT
+                    device_id,
+                    code,
+                    sum(
+                        CASE WHEN state
+                        THEN epoch(next_time) - epoch(event_time) ELSE 0 END
+                    ) AS on_seconds
+                FROM bool_segments
+                GROUP BY device_id, code
+            )
+            SELECT
+                coalesce(s.device_id, p.device_id) AS device_id,
+                coalesce(s.code, p.code) AS code,
+                {bucket_start} AS bucket_start,
+                coalesce(s.event_count, 0) AS event_count,
+                coalesce(s.numeric_count, 0) AS numeric_count,
+                s.min_value,
+                s.max_value,
+                s.sum_value,
+                s.mean_value,
+                coalesce(s.last_value, p.last_value) AS last_value,
+                coalesce(s.last_event_time, p.last_event_time) AS last_event_time,
+                o.on_seconds
+            FROM stats s
+            FULL OUTER JOIN previous_state p
+                ON s.device_id = p.device_id AND s.code = p.code
+            LEFT JOIN on_time o
+                ON o.device_id = coalesce(s.device_id, p.device_id)
+                AND o.code = coalesce(s.code, p.code)
+            ORDER BY device_id, code
+        ) TO '{output_path}' (FORMAT PARQUET);
+    """)
+
+
+def compute_daily_rollup(conn, hourly_rollup_paths: list, output_path: str):
+    """Merges a day's hourly rollups into one row per device and code."""
+    conn.execute(f"""
+        COPY (
+            SELECT
+                device_id,
+                code,
+                date_trunc('day', min(bucket_start)) AS bucket_start,
+                sum(event_count)::BIGINT AS event_count,
+                sum(numeric_count)::BIGINT AS numeric_count,
+                min(min_value) AS min_value,
+                max(max_value) AS max_value,
+                sum(sum_value) AS sum_value,
+                sum(sum_value) / nullif(sum(numeric_count), 0) AS mean_value,
+                arg_max(last_value, last_event_time) AS last_value,
+                max(last_event_time) AS last_event_time,
+                sum(on_seconds) AS on_seconds
+            FROM read_parquet({_files_sql(hourly_rollup_paths)}, hive_partitioning=false)
+            GROUP BY device_id, code
+            ORDER BY device_id, code
+        ) TO '{output_path}' (FORMAT PARQUET);
+    """)
+
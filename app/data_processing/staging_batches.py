@@ -0,0 +1,102 @@
+"""
+Bounded batches for staging many raw files, with a resumable checkpoint.
+
+Instead of reading all of a partition's raw files in one query, the staging
+asset splits them into batches of at most `max_files` files and `max_bytes`
+bytes (a single larger file forms its own batch) and writes each batch to its
+own part file in a per-partition work directory:
+<work_dir>/part_<NNNN>.parquet
+The parts are then merged into the partition's staging file and the work
+directory is removed. Progress is recorded in <work_dir>/checkpoint.json:
+{"plan_id": "<hash of the batches' files, signatures and window>",
+ "parts": {"<NNNN>": <rows>, ...}}
+A run that failed midway resumes from the recorded parts, as long as the plan
+(the files, their size and mtime, and the time window) is unchanged.
+"""
+import os
+import json
+import shutil
+import hashlib
+
+from app.data_processing.staging_manifest import file_signature
+
+CHECKPOINT_FILE_NAME = "checkpoint.json"
+
+
+def plan_batches(file_paths: list, max_files: int, max_bytes: int) -> list:
+    """Splits the files, in order, into batches bounded by file count and total bytes."""
+    batches, batch, batch_bytes = [], [], 0
+    for file_path in file_paths:
+        size = os.path.getsize(file_path)
+        if batch and (len(batch) >= max_files or batch_bytes + size > max_bytes):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(file_path)
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def batch_plan_id(batches: list, *extra) -> str:
+    """Identifies a batch plan by its files, their signatures and any extra values."""
+    plan = [
+        [[file_path, file_signature(file_path)] for file_path in batch]
+        for batch in batches
+    ]
+    return hashlib.sha1(json.dumps([plan, list(extra)], sort_keys=True).encode()).hexdigest()
+
+
+def part_file_path(work_dir: str, batch_index: int) -> str:
+    return os.path.join(work_dir, f"part_{batch_index:04d}.parquet")
+
+
+def load_checkpoint(work_dir: str, plan_id: str) -> dict:
+    """
+    Returns the {batch_index: rows} of parts completed under this plan, or an
+    empty dict (after clearing stale parts) if the plan changed.
+    """
+    try:
+        with open(os.path.join(work_dir, CHECKPOINT_FILE_NAME), 'r', encoding='utf-8') as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        checkpoint = {}
+    if checkpoint.get("plan_id") != plan_id:
+        clear_work_dir(work_dir)
+        return {}
+    return {
+        int(batch_index): rows
+        for batch_index, rows in checkpoint.get("parts", {}).items()
+        if os.path.exists(part_file_path(work_dir, int(batch_index)))
+    }
+
+
+def save_checkpoint(work_dir: str, plan_id: str, parts: dict):
+    """Atomically records the completed parts (write to temp file, then rename)."""
+    os.makedirs(work_dir, exist_ok=True)
+    file_path = os.path.join(work_dir, CHECKPOINT_FILE_NAME)
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as checkpoint_file:
+        json.dump(
+            {"plan_id": plan_id, "parts": {str(index): rows for index, rows in sorted(parts.items())}},
+            checkpoint_file,
+        )
+    os.replace(tmp_path, file_path)
+
+
+def clear_work_dir(work_dir: str):
+    """Removes a partition's parts and checkpoint."""
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def merge_parts(conn, part_paths: list, output_path: str):
+    """Writes the parts into one Parquet file (a single part is just moved)."""
+    if len(part_paths) == 1:
+        os.replace(part_paths[0], output_path)
+        return
+    part_list = ", ".join(f"'{p}'" for p in part_paths)
+    conn.execute(f"""
+        COPY (
+            SELECT * FROM read_parquet([{part_list}], union_by_name=true)
+        ) TO '{output_path}' (FORMAT PARQUET);
+    """)
@@ -0,0 +1,92 @@
+"""
+Manifest of raw files already loaded into the staging layer.
+
+The manifest is a JSON document keyed by the raw file path relative to the
+raw directory:
+{"<relative_path>": {"size": <bytes>, "mtime": <unix seconds>, "staged_at": "<iso ts>"}, ...}
+
+A raw file is (re)staged when it is missing from the manifest or when its size
+or modification time changed since it was last staged.
+"""
+import os
+import json
+from datetime import datetime, timezone
+
+
+def load_manifest(file_path: str) -> dict:
+    """Loads the staging manifest, returning an empty manifest if none exists yet."""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as manifest_file:
+            manifest = json.load(manifest_file)
+        print(f"Loaded staging manifest with {len(manifest)} files from {file_path}")
+        return manifest
+    except FileNotFoundError:
+        print(f"No staging manifest found at {file_path}. All raw files will be staged.")
+        return {}
+    except json.JSONDecodeError:
+        print(f"Error: Could not decode staging manifest at {file_path}. Restaging all files.")
+        return {}
+
+
+def save_manifest(file_path: str, manifest: dict):
+    """
+    Atomically writes the staging manifest (write to temp file, then rename).
+    Entries written by concurrent runs since the manifest was loaded are kept.
+    """
+    try:
+        with open(file_path, 'r', encoding='utf-8') as manifest_file:
+            for key, entry in json.load(manifest_file).items():
+                manifest.setdefault(key, entry)
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=4, sort_keys=True)
+    os.replace(tmp_path, file_path)
+
+
+def file_signature(file_path: str) -> dict:
+    """Returns the size and modification time used to detect changed files."""
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def find_unstaged_files(manifest: dict, raw_dir: str, file_paths: list) -> list:
+    """Returns the files that are new or changed since they were last staged."""
+    unstaged = []
+    for file_path in file_paths:
+        entry = manifest.get(os.path.relpath(file_path, raw_dir))
+        signature = file_signature(file_path)
+        if (
+            entry is None
+            or entry.get("size") != signature["size"]
+            or entry.get("mtime") != signature["mtime"]
+        ):
+            unstaged.append(file_path)
+    return unstaged
+
+
+def mark_staged(manifest: dict, raw_dir: str, file_paths: list):
+    """Records files as staged in `manifest` with their current signature."""
+    staged_at = datetime.now(timezone.utc).isoformat()
+    for file_path in file_paths:
+        manifest[os.path.relpath(file_path, raw_dir)] = {
+            **file_signature(file_path),
+            "staged_at": staged_at,
+        }
+
+
+def forget_files(file_path: str, raw_dir: str, file_paths: list):
+    """
+    Removes deleted raw files (e.g. archived ones) from the manifest on disk.
+    Unlike save_manifest this does not merge, so the entries are really dropped.
+    """
+    manifest = load_manifest(file_path)
+    for raw_file in file_paths:
+        manifest.pop(os.path.relpath(raw_file, raw_dir), None)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=4, sort_keys=True)
+    os.replace(tmp_path, file_path)
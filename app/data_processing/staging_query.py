@@ -0,0 +1,339 @@
+"""
+Query API over the staging Parquet dataset.
+
+StagingQuery answers device / code / time-range queries by opening only the
+staging files that can hold matching rows. It keeps a file index (persisted as
+JSON) with each file's event_time range and device and code sets:
+{"<path relative to staging dir>": {"size": ..., "mtime": ..., "rows": ...,
+ "min_event_time_ms": ..., "max_event_time_ms": ..., "device_ids": [...],
+ "codes": [...]}, ...}
+The index is refreshed incrementally: only new or changed files (by size and
+mtime) are scanned, and deleted files are dropped.
+
+A query first prunes the event_date=<YYYY-MM-DD> partitions by its time range
+(by directory name, without touching the files), then looks at the
+modification time of just those partition directories. Writers replace staging
+files by renaming them into place, which updates the directory's mtime, so a
+partition whose directory mtime is unchanged needs no per-file stat at all.
+Query results are kept in an LRU cache together with the directory mtimes they
+were read under, and are served only while those still match. Files are
+planned and read under shared partition locks (see compaction.read_partitions),
+so a compaction or restage swap is never seen half done.
+
+Example:
+    staging = StagingQuery("app/data/staging", "app/data/state/staging_file_index.json")
+    df = staging.query(device_ids=["eb47..."], codes=["cur_power"],
+                       start="2025-05-01", end="2025-05-02")
+"""
+import os
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+import duckdb
+import pandas as pd
+
+from app.data_processing.staging_manifest import file_signature
+from app.data_processing.compaction import read_partitions
+
+DEFAULT_RESULT_CACHE_SIZE = 128
+PARTITION_PREFIX = "event_date="
+
+
+def _to_epoch_ms(value) -> int:
+    """Converts a datetime, ISO string or epoch milliseconds to epoch ms (naive = UTC)."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def _ms_to_date_str(time_ms: int) -> str:
+    return datetime.fromtimestamp(time_ms / 1000, timezone.utc).strftime('%Y-%m-%d')
+
+
+def list_partitions(staging_dir: str, start_ms: int = None, end_ms: int = None) -> list:
+    """
+    Returns the names of the event_date=<YYYY-MM-DD> partitions that can hold
+    rows in [start_ms, end_ms), judged by name only (no stat of their files).
+    """
+    if not os.path.isdir(staging_dir):
+        return []
+    first_date = _ms_to_date_str(start_ms) if start_ms is not None else None
+    last_date = _ms_to_date_str(end_ms - 1) if end_ms is not None else None
+    partitions = []
+    for name in os.listdir(staging_dir):
+        if not name.startswith(PARTITION_PREFIX):
+            continue
+        date_str = name[len(PARTITION_PREFIX):]
+        if first_date is not None and date_str < first_date:
+            continue
+        if last_date is not None and date_str > last_date:
+            continue
+        partitions.append(name)
+    return sorted(partitions)
+
+
+def list_staging_files(staging_dir: str, partitions: list = None) -> list:
+    """Returns the Parquet files of the given partitions (default: every event_date=*/ partition)."""
+    if partitions is None:
+        partitions = list_partitions(staging_dir)
+    files = []
+    for partition in partitions:
+        try:
+            files.extend(
+                entry.path for entry in os.scandir(os.path.join(staging_dir, partition))
+                if entry.is_file() and entry.name.endswith(".parquet")
+            )
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+    return sorted(files)
+
+
+def partition_mtimes(staging_dir: str, partitions: list) -> dict:
+    """Returns {partition: directory mtime in ns} of the partitions that exist."""
+    mtimes = {}
+    for partition in partitions:
+        try:
+            mtimes[partition] = os.stat(os.path.join(staging_dir, partition)).st_mtime_ns
+        except FileNotFoundError:
+            continue
+    return mtimes
+
+
+def scan_file_stats(conn, file_path: str) -> dict:
+    """Computes a file's index entry (row count, event_time range, device and code sets)."""
+    rows, min_ms, max_ms, device_ids, codes = conn.execute(f"""
+        SELECT
+            count(*),
+            min(epoch_ms(event_time)),
+            max(epoch_ms(event_time)),
+            list(DISTINCT device_id),
+            list(DISTINCT code)
+        FROM read_parquet('{file_path}', hive_partitioning=false)
+    """).fetchone()
+    return {
+        "rows": rows,
+        "min_event_time_ms": min_ms,
+        "max_event_time_ms": max_ms,
+        "device_ids": sorted(d for d in device_ids or [] if d is not None),
+        "codes": sorted(c for c in codes or [] if c is not None),
+    }
+
+
+def load_file_index(file_path: str) -> dict:
+    """Loads the staging file index, returning an empty index if none exists yet."""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as index_file:
+            return json.load(index_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_file_index(file_path: str, index: dict):
+    """Atomically writes the staging file index (write to temp file, then rename)."""
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as index_file:
+        json.dump(index, index_file, sort_keys=True)
+    os.replace(tmp_path, file_path)
+
+
+def refresh_file_index(conn, staging_dir: str, index: dict, partitions: list = None) -> bool:
+    """
+    Brings `index` in line with the files on disk, scanning only new or
+    changed files. With `partitions`, only those partitions' entries are
+    refreshed. Returns True if anything changed.
+    """
+    changed = False
+    current = set()
+    for file_path in list_staging_files(staging_dir, partitions):
+        key = os.path.relpath(file_path, staging_dir)
+        current.add(key)
+        try:
+            signature = file_signature(file_path)
+        except FileNotFoundError:
+            current.discard(key)
+            continue
+        entry = index.get(key)
+        if entry and entry.get("size") == signature["size"] and entry.get("mtime") == signature["mtime"]:
+            continue
+        try:
+            index[key] = {**signature, **scan_file_stats(conn, file_path)}
+        except duckdb.IOException:
+            # Replaced or removed while scanning (e.g. compaction swap); picked up next refresh
+            current.discard(key)
+            index.pop(key, None)
+        changed = True
+    refreshed = set(partitions) if partitions is not None else None
+    for key in list(index):
+        if key in current:
+            continue
+        if refreshed is not None and key.split(os.sep, 1)[0] not in refreshed:
+            continue
+        del index[key]
+        changed = True
+    return changed
+
+
+def update_staging_file_index(conn, staging_dir: str, index_path: str) -> bool:
+    """Refreshes the persisted index after writers changed the staging layer."""
+    index = load_file_index(index_path)
+    changed = refresh_file_index(conn, staging_dir, index)
+    if changed:
+        save_file_index(index_path, index)
+    return changed
+
+
+class StagingQuery:
+    """
+    Filtered reads of the staging dataset with file pruning and an LRU result
+    cache. Thread-safe; results are returned as pandas DataFrames (copies of
+    the cached frames, so callers may modify them).
+    """
+
+    def __init__(
+        self,
+        staging_dir: str,
+        index_path: str,
+        cache_size: int = DEFAULT_RESULT_CACHE_SIZE,
+        conn=None
+    ):
+        self.staging_dir = os.path.abspath(staging_dir)
+        self.index_path = os.path.abspath(index_path)
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._conn = conn if conn is not None else duckdb.connect()
+        self._index = load_file_index(self.index_path)
+        # Directory mtime of each partition when its index entries were last refreshed
+        self._partition_mtimes = {}
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+
+    def refresh(self) -> bool:
+        """Syncs the whole file index with the staging directory; clears the cache on change."""
+        with self._lock:
+            partitions = list_partitions(self.staging_dir)
+            mtimes = partition_mtimes(self.staging_dir, partitions)
+            changed = refresh_file_index(self._conn, self.staging_dir, self._index)
+            self._partition_mtimes = mtimes
+            if changed:
+                save_file_index(self.index_path, self._index)
+                self._cache.clear()
+            return changed
+
+    def _refresh_partitions(self, mtimes: dict, partitions: list):
+        """Refreshes the index entries of the partitions whose directory changed."""
+        stale = [
+            partition for partition in partitions
+            if partition not in mtimes or self._partition_mtimes.get(partition) != mtimes[partition]
+        ]
+        if not stale:
+            return
+        if refresh_file_index(self._conn, self.staging_dir, self._index, stale):
+            save_file_index(self.index_path, self._index)
+        for partition in stale:
+            if partition in mtimes:
+                self._partition_mtimes[partition] = mtimes[partition]
+            else:
+                self._partition_mtimes.pop(partition, None)
+
+    def _select_files(self, partitions, device_ids, codes, start_ms, end_ms) -> list:
+        device_set = set(device_ids) if device_ids else None
+        code_set = set(codes) if codes else None
+        selected = []
+        for partition in partitions:
+            prefix = partition + os.sep
+            for key, entry in self._index.items():
+                if not key.startswith(prefix) or not entry.get("rows"):
+                    continue
+                if start_ms is not None and entry["max_event_time_ms"] < start_ms:
+                    continue
+                if end_ms is not None and entry["min_event_time_ms"] >= end_ms:
+                    continue
+                if device_set and device_set.isdisjoint(entry["device_ids"]):
+                    continue
+                if code_set and code_set.isdisjoint(entry["codes"]):
+                    continue
+                selected.append(os.path.join(self.staging_dir, key))
+        return sorted(selected)
+
+    def files_for(self, device_ids=None, codes=None, start=None, end=None) -> list:
+        """
+        Returns the staging files that may hold rows matching the filters.
+        Read them under compaction.read_partitions, as query() does.
+        """
+        start_ms, end_ms = _to_epoch_ms(start), _to_epoch_ms(end)
+        with self._lock:
+            partitions = list_partitions(self.staging_dir, start_ms, end_ms)
+            self._refresh_partitions(partition_mtimes(self.staging_dir, partitions), partitions)
+            return self._select_files(partitions, device_ids, codes, start_ms, end_ms)
+
+    def query(self, device_ids=None, codes=None, start=None, end=None, columns=None) -> pd.DataFrame:
+        """
+        Returns the staged rows matching all given filters, ordered by
+        device_id, code and event_time. `start` (inclusive) and `end`
+        (exclusive) are datetimes, ISO strings or epoch ms, in UTC.
+        `columns` restricts the returned columns (default: all).
+        """
+        start_ms, end_ms = _to_epoch_ms(start), _to_epoch_ms(end)
+        cache_key = (
+            tuple(sorted(device_ids)) if device_ids else None,
+            tuple(sorted(codes)) if codes else None,
+            start_ms,
+            end_ms,
+            tuple(columns) if columns else None,
+        )
+        with self._lock:
+            # Only the directories of the partitions in range are stat'ed for a hit
+            partitions = list_partitions(self.staging_dir, start_ms, end_ms)
+            mtimes = partition_mtimes(self.staging_dir, partitions)
+            cached = self._cache.get(cache_key)
+            if cached is not None and cached[0] == mtimes:
+                self._cache.move_to_end(cache_key)
+                self.cache_hits += 1
+                return cached[1].copy()
+            self.cache_misses += 1
+            # Shared locks keep writers from swapping files between planning and reading
+            with read_partitions(os.path.join(self.staging_dir, p) for p in partitions):
+                mtimes = partition_mtimes(self.staging_dir, partitions)
+                self._refresh_partitions(mtimes, partitions)
+                files = self._select_files(partitions, *cache_key[:4])
+                result = self._read(files, *cache_key)
+            self._cache[cache_key] = (mtimes, result)
+            self._cache.move_to_end(cache_key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return result.copy()
+
+    def _read(self, files, device_ids, codes, start_ms, end_ms, columns) -> pd.DataFrame:
+        select_list = ", ".join(f'"{c}"' for c in columns) if columns else "*"
+        if not files:
+            # No candidate file: return an empty frame with the requested columns
+            return pd.DataFrame(columns=list(columns) if columns else [])
+        conditions, params = [], []
+        if device_ids:
+            conditions.append("list_contains(?, device_id)")
+            params.append(list(device_ids))
+        if codes:
+            conditions.append("list_contains(?, code)")
+            params.append(list(codes))
+        if start_ms is not None:
+            conditions.append("event_time >= make_timestamp(? * 1000)")
+            params.append(start_ms)
+        if end_ms is not None:
+            conditions.append("event_time < make_timestamp(? * 1000)")
+            params.append(end_ms)
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self._conn.execute(f"""
+            SELECT {select_list}
+            FROM read_parquet(?, hive_partitioning=false, union_by_name=true)
+            {where_clause}
+            ORDER BY device_id, code, event_time
+        """, [files, *params]).df()
@@ -0,0 +1,27 @@
+"""
+Column layout of the staging Parquet dataset, shared by the hourly staging
+asset and the micro-batch path so both write identical files.
+
+Raw logs are read under the alias `rl` (code, value, device_id, event_time in
+ms, ingestion_timestamp_utc, ingested_by, filename), with the code schemas
+joined as `cs` (see typed_values).
+"""
+from app.data_processing.typed_values import CODE_SCHEMA_VIEW, typed_value_columns_sql
+
+
+def staged_columns_sql(device_name_sql: str) -> str:
+    """SELECT list producing the staged columns; `device_name_sql` yields device_name."""
+    return f"""
+        rl.code,
+        CAST(rl.value AS VARCHAR) AS value,{typed_value_columns_sql("CAST(rl.value AS VARCHAR)", "cs")},
+        rl.device_id,
+        CAST(rl.ingestion_timestamp_utc AS TIMESTAMP) AS ingestion_timestamp_utc,
+        rl.ingested_by,
+        rl.filename,
+        to_timestamp(rl.event_time / 1000)::TIMESTAMP AS event_time,
+        {device_name_sql}"""
+
+
+def code_schema_join_sql() -> str:
+    """LEFT JOIN of the registered code schema view onto the raw logs."""
+    return f"LEFT JOIN {CODE_SCHEMA_VIEW} cs ON rl.device_id = cs.device_id AND rl.code = cs.code"
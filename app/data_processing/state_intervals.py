@@ -0,0 +1,207 @@
+"""
+State intervals (sessions) of switch and power codes, with energy integration.
+
+Tuya logs are change events: switch_1=true/false, a cur_power sample, etc.
+The intervals turn them into rows of
+device_id, code, value, value_double, start_time, end_time, duration_seconds,
+energy_kwh, is_open
+where consecutive events with the same value are merged into one interval
+lasting until the next change. Boolean codes (value true/false) and the given
+power codes get intervals; for power codes (value_double in W) energy_kwh
+integrates the power over the interval (sample-and-hold).
+
+Intervals are computed per device and day, in one vectorized DuckDB query over
+the day's staged files, and written to one Parquet file per device-day:
+data/intervals/event_date=<YYYY-MM-DD>/intervals_<device_id>.parquet
+A day's first interval starts at midnight with the device's last state before
+it: its last event in the staged files of the preceding days, or, for codes
+with no such event, the last state of its nearest earlier interval file. Its
+last interval ends at midnight, or
+where the day's staged data ends while later hours are still missing
+(is_open = true).
+
+Example (kWh per plug per day):
+    SELECT device_id, date_trunc('day', start_time) AS day, sum(energy_kwh)
+    FROM read_parquet('app/data/intervals/*/*.parquet') GROUP BY ALL
+"""
+import os
+
+from app.data_processing.typed_values import has_typed_value_columns, value_double_sql
+
+INTERVAL_FILE_PREFIX = "intervals_"
+
+
+def interval_file_path(intervals_dir: str, date_str: str, device_id: str) -> str:
+    """Path of a device-day's interval file (date_str as YYYY-MM-DD)."""
+    return os.path.join(
+        intervals_dir, f"event_date={date_str}", f"{INTERVAL_FILE_PREFIX}{device_id}.parquet"
+    )
+
+
+def _sql_list(items: list) -> str:
+    return "[" + ", ".join(f"'{item}'" for item in items) + "]"
+
+
+def _ms_to_timestamp_sql(time_ms: int) -> str:
+    """SQL expression matching how staging converts event_time (ms) to TIMESTAMP."""
+    return f"to_timestamp({time_ms} / 1000)::TIMESTAMP"
+
+
+def compute_state_intervals(
+    conn,
+    staging_files: list,
+    device_ids: list,
+    power_codes: list,
+    day_start_ms: int,
+    day_end_ms: int,
+    bound_ms: int,
+    previous_interval_paths: list,
+    table_name: str,
+    previous_staging_files: list = None
+) -> int:
+    """
+    Computes the intervals of `device_ids` in [day_start_ms, bound_ms) from the
+    day's staged files into the temporary table `table_name`.
+    The state at the start of the day is the latest of each code's last event
+    in `previous_staging_files` (staged files of earlier days) and its last
+    state in `previous_interval_paths` (earlier interval files).
+    Returns the number of intervals.
+    """
+    day_start = _ms_to_timestamp_sql(day_start_ms)
+    bound = _ms_to_timestamp_sql(bound_ms)
+    value_double = value_double_sql(has_typed_value_columns(conn, staging_files))
+    power_codes_sql = f"CAST({_sql_list(power_codes)} AS VARCHAR[])"
+
+    state_sources = []
+    if previous_interval_paths:
+        state_sources.append(f"""
+            SELECT device_id, code, value, value_double, start_time AS known_at
+            FROM read_parquet({_sql_list(previous_interval_paths)}, hive_partitioning=false)
+        """)
+    if previous_staging_files:
+        previous_value_double = value_double_sql(has_typed_value_columns(conn, previous_staging_files))
+        state_sources.append(f"""
+            SELECT
+                device_id,
+                code,
+                CAST(value AS VARCHAR) AS value,
+                {previous_value_double} AS value_double,
+                event_time AS known_at
+            FROM read_parquet(
+                {_sql_list(previous_staging_files)}, hive_partitioning=false, union_by_name=true
+            )
+            WHERE list_contains({_sql_list(device_ids)}, device_id)
+                AND event_time < {day_start}
+                AND (
+                    lower(CAST(value AS VARCHAR)) IN ('true', 'false')
+                    OR list_contains({power_codes_sql}, code)
+                )
+        """)
+    if state_sources:
+        previous_state_sql = f"""
+            SELECT
+                device_id,
+                code,
+                arg_max(value, known_at) AS value,
+                arg_max(value_double, known_at) AS value_double
+            FROM ({" UNION ALL ".join(state_sources)})
+            GROUP BY device_id, code
+        """
+    else:
+        previous_state_sql = """
+            SELECT NULL::VARCHAR AS device_id, NULL::VARCHAR AS code,
+                   NULL::VARCHAR AS value, NULL::DOUBLE AS value_double
+            WHERE false
+        """
+
+    conn.execute(f"""
+        CREATE OR REPLACE TEMP TABLE {table_name} AS
+        WITH events AS (
+            -- DISTINCT: guards against the same event staged in two files
+            SELECT DISTINCT
+                device_id,
+                code,
+                event_time,
+                CAST(value AS VARCHAR) AS value,
+                {value_double} AS value_double
+            FROM read_parquet({_sql_list(staging_files)}, hive_partitioning=false, union_by_name=true)
+            WHERE list_contains({_sql_list(device_ids)}, device_id)
+                AND event_time >= {day_start} AND event_time < {bound}
+                AND (
+                    lower(CAST(value AS VARCHAR)) IN ('true', 'false')
+                    OR list_contains({power_codes_sql}, code)
+                )
+        ),
+        points AS (
+            SELECT * FROM events
+            UNION ALL
+            -- State carried over from before the day, unless an event sits at midnight
+            SELECT p.device_id, p.code, {day_start} AS event_time, p.value, p.value_double
+            FROM ({previous_state_sql}) p
+            WHERE list_contains({_sql_list(device_ids)}, p.device_id)
+                AND NOT EXISTS (
+                    SELECT 1 FROM events e
+                    WHERE e.device_id = p.device_id AND e.code = p.code
+                        AND e.event_time = {day_start}
+                )
+        ),
+        segments AS (
+            SELECT
+                *,
+                lead(event_time, 1, {bound}) OVER w AS next_time,
+                CASE WHEN value IS DISTINCT FROM lag(value) OVER w THEN 1 ELSE 0 END AS is_change
+            FROM points
+            WINDOW w AS (PARTITION BY device_id, code ORDER BY event_time, value)
+        ),
+        islands AS (
+            SELECT
+                *,
+                sum(is_change) OVER (
+                    PARTITION BY device_id, code ORDER BY event_time, value
+                    ROWS UNBOUNDED PRECEDING
+                ) AS island
+            FROM segments
+        )
+        SELECT
+            device_id,
+            code,
+            any_value(value) AS value,
+            any_value(value_double) AS value_double,
+            min(event_time) AS start_time,
+            max(next_time) AS end_time,
+            epoch(max(next_time)) - epoch(min(event_time)) AS duration_seconds,
+            CASE WHEN list_contains({power_codes_sql}, code)
+                THEN sum(value_double * (epoch(next_time) - epoch(event_time))) / 3600000.0
+            END AS energy_kwh,
+            max(next_time) = {bound} AND {bound_ms} < {day_end_ms} AS is_open
+        FROM islands
+        GROUP BY device_id, code, island
+        ORDER BY device_id, code, start_time
+    """)
+    return conn.execute(f"SELECT count(*) FROM {table_name}").fetchone()[0]
+
+
+def write_device_intervals(conn, table_name: str, intervals_dir: str, date_str: str, device_id: str) -> int:
+    """
+    Writes one device's intervals from `table_name` to its device-day file,
+    replacing it atomically (or removing it if the device has none).
+    Returns the number of intervals written.
+    """
+    output_path = interval_file_path(intervals_dir, date_str, device_id)
+    rows = conn.execute(
+        f"SELECT count(*) FROM {table_name} WHERE device_id = ?", [device_id]
+    ).fetchone()[0]
+    if rows == 0:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return 0
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    conn.execute(f"""
+        COPY (
+            SELECT * FROM {table_name} WHERE device_id = '{device_id}'
+            ORDER BY code, start_time
+        ) TO '{tmp_path}' (FORMAT PARQUET);
+    """)
+    os.replace(tmp_path, output_path)
+    return rows
@@ -0,0 +1,91 @@
+"""
+Typed value columns for staged Tuya logs.
+
+Raw log values arrive as strings. Using the per-device, per-code schema cached
+by the ingestion asset ({device_id: {code: {"type": ..., "scale": ...}}}, taken
+from the device's shadow properties and thing data model), staging also writes:
+value_bool    - "bool" codes (e.g. switch_1)
+value_int     - raw integer of "value" codes (e.g. cur_power in 0.1 W)
+value_double  - "value" codes divided by 10^scale (e.g. cur_power in W)
+value_str     - "enum", "string", "bitmap" and other codes
+Codes missing from the schema are typed from the value itself with scale 0.
+"""
+import pandas as pd
+
+CODE_SCHEMA_VIEW = "code_schema_view"
+TYPED_VALUE_COLUMNS = ("value_bool", "value_int", "value_double", "value_str")
+TYPED_VALUE_COLUMN_TYPES = {
+    "value_bool": "BOOLEAN",
+    "value_int": "BIGINT",
+    "value_double": "DOUBLE",
+    "value_str": "VARCHAR",
+}
+# Readers of files staged before the typed columns existed fall back to parsing
+# `value` (unscaled: cur_power reads 837 instead of 83.7 W)
+LEGACY_VALUE_DOUBLE_SQL = "TRY_CAST(CAST(value AS VARCHAR) AS DOUBLE)"
+LEGACY_VALUE_BOOL_SQL = (
+    "CASE lower(CAST(value AS VARCHAR)) WHEN 'true' THEN true WHEN 'false' THEN false END"
+)
+
+
+def code_schema_frame(schemas: dict) -> pd.DataFrame:
+    """Flattens {device_id: {code: {"type", "scale"}}} into one row per device and code."""
+    rows = [
+        (device_id, code, spec.get("type"), int(spec.get("scale", 0) or 0))
+        for device_id, codes in schemas.items()
+        for code, spec in codes.items()
+    ]
+    return pd.DataFrame(rows, columns=["device_id", "code", "value_type", "scale"]).astype(
+        {"device_id": "string", "code": "string", "value_type": "string", "scale": "int64"}
+    )
+
+
+def typed_value_columns_sql(value_sql: str, schema_alias: str) -> str:
+    """
+    SELECT-list SQL deriving the typed columns from the VARCHAR expression
+    `value_sql`, with `schema_alias` the alias of a joined CODE_SCHEMA_VIEW.
+    """
+    value_type = f"{schema_alias}.value_type"
+    is_bool_text = f"lower({value_sql}) IN ('true', 'false')"
+    is_bool = f"({value_type} = 'bool' OR ({value_type} IS NULL AND {is_bool_text}))"
+    is_number = f"({value_type} = 'value' OR ({value_type} IS NULL AND NOT {is_bool_text}))"
+    return f"""
+        CASE WHEN {is_bool} THEN lower({value_sql}) = 'true' END AS value_bool,
+        CASE WHEN {is_number} THEN TRY_CAST({value_sql} AS BIGINT) END AS value_int,
+        CASE WHEN {is_number}
+            THEN TRY_CAST({value_sql} AS DOUBLE) / power(10, coalesce({schema_alias}.scale, 0))
+        END AS value_double,
+        CASE WHEN NOT {is_bool} AND NOT ({is_number} AND TRY_CAST({value_sql} AS DOUBLE) IS NOT NULL)
+            THEN {value_sql}
+        END AS value_str"""
+
+
+def has_typed_value_columns(conn, parquet_paths: list) -> bool:
+    """Whether the staged files (read together) have the typed value columns."""
+    paths_sql = "[" + ", ".join(f"'{p}'" for p in parquet_paths) + "]"
+    columns = {
+        row[0] for row in conn.execute(
+            f"DESCRIBE SELECT * FROM read_parquet({paths_sql}, "
+            "hive_partitioning=false, union_by_name=true)"
+        ).fetchall()
+    }
+    return all(column in columns for column in TYPED_VALUE_COLUMNS)
+
+
+def _untyped_row_sql() -> str:
+    # Rows of legacy files read together with typed ones have all typed columns NULL
+    return " AND ".join(f"{column} IS NULL" for column in TYPED_VALUE_COLUMNS)
+
+
+def value_double_sql(has_typed_columns: bool) -> str:
+    """Scaled numeric value of a staged row, parsed from `value` only for legacy rows."""
+    if not has_typed_columns:
+        return LEGACY_VALUE_DOUBLE_SQL
+    return f"CASE WHEN {_untyped_row_sql()} THEN {LEGACY_VALUE_DOUBLE_SQL} ELSE value_double END"
+
+
+def value_bool_sql(has_typed_columns: bool) -> str:
+    """Boolean value of a staged row, parsed from `value` only for legacy rows."""
+    if not has_typed_columns:
+        return LEGACY_VALUE_BOOL_SQL
+    return f"CASE WHEN {_untyped_row_sql()} THEN {LEGACY_VALUE_BOOL_SQL} ELSE value_bool END"
@@ -0,0 +1,100 @@
+"""
+Helpers for the persistent DuckDB warehouse holding the deduplicated
+`device_logs` fact table, keyed on (device_id, code, event_time).
+Besides the raw `value`, rows carry the typed value columns written by staging
+(see typed_values); rows loaded from files staged before those existed have
+them NULL.
+"""
+from app.data_processing.typed_values import (
+    TYPED_VALUE_COLUMN_TYPES,
+    has_typed_value_columns,
+)
+
+DEVICE_LOGS_DDL = """
+CREATE TABLE IF NOT EXISTS device_logs (
+    device_id VARCHAR NOT NULL,
+    code VARCHAR NOT NULL,
+    event_time TIMESTAMP NOT NULL,
+    event_date DATE NOT NULL,
+    value VARCHAR,
+    value_bool BOOLEAN,
+    value_int BIGINT,
+    value_double DOUBLE,
+    value_str VARCHAR,
+    device_name VARCHAR,
+    ingestion_timestamp_utc TIMESTAMPTZ,
+    ingested_by VARCHAR,
+    filename VARCHAR,
+    PRIMARY KEY (device_id, code, event_time)
+);
+"""
+
+
+def ensure_device_logs_table(conn):
+    """Creates the device_logs fact table if it does not exist yet (or adds missing typed columns)."""
+    conn.execute(DEVICE_LOGS_DDL)
+    for column, column_type in TYPED_VALUE_COLUMN_TYPES.items():
+        conn.execute(f"ALTER TABLE device_logs ADD COLUMN IF NOT EXISTS {column} {column_type}")
+
+
+def upsert_device_logs(
+    conn, parquet_path: str, start_time_ms: int = None, end_time_ms: int = None
+) -> int:
+    """
+    Idempotently merges a staged Parquet batch into device_logs, optionally
+    restricted to events in [start_time_ms, end_time_ms) (e.g. one hour of a
+    compacted daily file).
+
+    Rows are deduplicated within the batch (latest ingestion wins) and then
+    inserted, updating existing rows with the same key, so re-loading a batch
+    or loading overlapping batches never creates duplicates.
+    Returns the number of rows in the deduplicated batch.
+    """
+    time_filter = ""
+    if start_time_ms is not None and end_time_ms is not None:
+        time_filter = f"""
+            AND event_time >= to_timestamp({start_time_ms} / 1000)::TIMESTAMP
+            AND event_time < to_timestamp({end_time_ms} / 1000)::TIMESTAMP
+        """
+    if has_typed_value_columns(conn, [parquet_path]):
+        typed_columns_sql = ", ".join(TYPED_VALUE_COLUMN_TYPES)
+    else:
+        typed_columns_sql = ", ".join(
+            f"NULL::{column_type} AS {column}"
+            for column, column_type in TYPED_VALUE_COLUMN_TYPES.items()
+        )
+    batch_query = f"""
+        SELECT
+            device_id,
+            code,
+            event_time,
+            CAST(event_time AS DATE) AS event_date,
+            value,
+            {typed_columns_sql},
+            device_name,
+            CAST(ingestion_timestamp_utc AS TIMESTAMPTZ) AS ingestion_timestamp_utc,
+            ingested_by,
+            filename
+        FROM read_parquet('{parquet_path}', hive_partitioning=false)
+        WHERE device_id IS NOT NULL AND code IS NOT NULL AND event_time IS NOT NULL
+        {time_filter}
+        QUALIFY row_number() OVER (
+            PARTITION BY device_id, code, event_time
+            ORDER BY ingestion_timestamp_utc DESC
+        ) = 1
+    """
+    batch_rows = conn.execute(f"SELECT count(*) FROM ({batch_query})").fetchone()[0]
+    conn.execute(f"""
+        INSERT INTO device_logs BY NAME ({batch_query})
+        ON CONFLICT (device_id, code, event_time) DO UPDATE SET
+            value = EXCLUDED.value,
+            value_bool = EXCLUDED.value_bool,
+            value_int = EXCLUDED.value_int,
+            value_double = EXCLUDED.value_double,
+            value_str = EXCLUDED.value_str,
+            device_name = EXCLUDED.device_name,
+            ingestion_timestamp_utc = EXCLUDED.ingestion_timestamp_utc,
+            ingested_by = EXCLUDED.ingested_by,
+            filename = EXCLUDED.filename
+    """)
+    return batch_rows
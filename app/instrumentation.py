@@ -0,0 +1,131 @@
+"""
+Run instrumentation helpers: summarizing per-device timings and counters into
+Dagster materialization metadata, and exporting them as a Prometheus
+text-format file (for node_exporter's textfile collector).
+
+Every exported metric is a gauge describing the latest materialization:
+tuya_pipeline_<metric>{asset="...",partition="..."}
+tuya_pipeline_device_<metric>{asset="...",partition="...",device_id="..."}
+"""
+import os
+import time
+from dagster import MetadataValue
+
+# Per-device counters collected by the ingestion asset
+DEVICE_METRIC_FIELDS = (
+    "seconds",
+    "pages",
+    "slices",
+    "requests",
+    "records",
+    "bytes",
+    "api_seconds",
+    "rate_limit_wait_seconds",
+    "write_seconds",
+)
+
+
+def new_device_metrics() -> dict:
+    """Returns a zeroed per-device metrics record."""
+    return {field: 0 for field in DEVICE_METRIC_FIELDS}
+
+
+class Timer:
+    """Context manager measuring wall time; adds it to `target[key]` if given."""
+
+    def __init__(self, target: dict = None, key: str = None):
+        self.target = target
+        self.key = key
+        self.seconds = 0.0
+        self._started = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self._started
+        if self.target is not None:
+            self.target[self.key] = self.target.get(self.key, 0) + self.seconds
+        return False
+
+
+def summarize_device_metrics(device_metrics: dict) -> dict:
+    """Totals the per-device metrics ({device_id: metrics}) of a run."""
+    totals = {field: 0 for field in DEVICE_METRIC_FIELDS if field != "seconds"}
+    for metrics in device_metrics.values():
+        for field in totals:
+            totals[field] += metrics.get(field, 0)
+    totals["api_latency_mean_ms"] = (
+        1000 * totals["api_seconds"] / totals["requests"] if totals["requests"] else 0.0
+    )
+    totals["records_written"] = totals.pop("records")
+    totals["bytes_written"] = totals.pop("bytes")
+    if device_metrics:
+        totals["device_seconds_max"] = max(m.get("seconds", 0) for m in device_metrics.values())
+    return {k: round(v, 3) if isinstance(v, float) else v for k, v in totals.items()}
+
+
+def slowest_devices_table(device_metrics: dict, limit: int = 10) -> MetadataValue:
+    """Markdown table of the slowest devices of a run, for asset metadata."""
+    rows = sorted(device_metrics.items(), key=lambda item: item[1].get("seconds", 0), reverse=True)
+    lines = [
+        "| device_id | seconds | pages | records | bytes | api_seconds |",
+        "|---|---|---|---|---|---|",
+    ]
+    for device_id, metrics in rows[:limit]:
+        lines.append(
+            f"| {device_id} | {metrics.get('seconds', 0):.3f} | {metrics.get('pages', 0)} "
+            f"| {metrics.get('records', 0)} | {metrics.get('bytes', 0)} "
+            f"| {metrics.get('api_seconds', 0):.3f} |"
+        )
+    return MetadataValue.md("\n".join(lines))
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(
+        f'{name}="{_escape_label_value(value)}"' for name, value in labels.items()
+    ) + "}"
+
+
+def write_prometheus_textfile(
+    directory: str,
+    asset_name: str,
+    partition_key: str,
+    metrics: dict,
+    device_metrics: dict = None
+) -> str:
+    """
+    Atomically writes the run's numeric metrics (and optional per-device
+    metrics) to <directory>/tuya_<asset_name>.prom. Returns the file path.
+    """
+    os.makedirs(directory, exist_ok=True)
+    base_labels = {"asset": asset_name, "partition": partition_key or ""}
+    lines = []
+    for name, value in sorted(metrics.items()):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        metric_name = f"tuya_pipeline_{name}"
+        lines.append(f"# TYPE {metric_name} gauge")
+        lines.append(f"{metric_name}{_labels(**base_labels)} {value}")
+    if device_metrics:
+        for field in DEVICE_METRIC_FIELDS:
+            metric_name = f"tuya_pipeline_device_{field}"
+            lines.append(f"# TYPE {metric_name} gauge")
+            for device_id, values in sorted(device_metrics.items()):
+                lines.append(
+                    f"{metric_name}{_labels(**base_labels, device_id=device_id)} "
+                    f"{values.get(field, 0)}"
+                )
+
+    file_path = os.path.join(directory, f"tuya_{asset_name}.prom")
+    # The textfile collector ignores files not ending in .prom, so the temp file is safe
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as prom_file:
+        prom_file.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, file_path)
+    return file_path